@@ -0,0 +1,292 @@
+"""Paper search against arXiv, PubMed and Semantic Scholar.
+
+Each backend pages through large result sets instead of stopping at the
+first page, and looks up paper IDs in batches. XML responses (arXiv Atom
+feeds, PubMed article sets) are parsed incrementally while they stream in,
+so a sweep over hundreds of papers never holds a whole feed in memory.
+PubMed searches are kept on the NCBI history server and fetched from there
+page by page. Request pacing (e.g. arXiv's one call every three seconds)
+is left to the provider rate limits in :mod:`ratelimit`.
+"""
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, Iterator, List
+
+from http_client import http
+from resilience import guards
+from results import SearchHit
+
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+ARXIV_PAGE_SIZE = int(os.getenv("ARXIV_PAGE_SIZE", "100"))
+ARXIV_FIELD_PREFIX = re.compile(r"\b(ti|au|abs|co|jr|cat|rn|id|all):")
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+PUBMED_BATCH_SIZE = int(os.getenv("PUBMED_BATCH_SIZE", "200"))
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+NCBI_EMAIL = os.getenv("NCBI_EMAIL")
+
+SEMANTIC_SCHOLAR_URL = "https://api.semanticscholar.org/graph/v1/paper"
+SEMANTIC_SCHOLAR_PAGE_SIZE = 100  # API maximum for /paper/search
+SEMANTIC_SCHOLAR_BATCH_SIZE = 500  # API maximum for /paper/batch
+SEMANTIC_SCHOLAR_FIELDS = "title,authors,venue,year,abstract,url,externalIds"
+
+# Simultaneous requests allowed per service; arXiv asks for a single connection
+SOURCE_CONCURRENCY = {
+      "arxiv": 1,
+      "pubmed": int(os.getenv("PUBMED_CONCURRENCY", "3")),
+      "semantic_scholar": int(os.getenv("SEMANTIC_SCHOLAR_CONCURRENCY", "2")),
+}
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+OPENSEARCH = "{http://a9.com/-/spec/opensearch/1.1/}"
+
+
+def batched(items: List[str], size: int) -> Iterator[List[str]]:
+      for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+
+def iter_xml(method: str, url: str, tags: Iterable[str], **kwargs) -> Iterator[ET.Element]:
+      """Stream an XML response and yield each element in ``tags`` once it is complete.
+
+      Yielded elements are cleared afterwards, so memory stays flat however
+      long the document is; read what you need before resuming the iterator.
+      """
+      wanted = set(tags)
+      with http.request(method, url, stream=True, **kwargs) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            for _, element in ET.iterparse(response.raw, events=("end",)):
+                  if element.tag in wanted:
+                        yield element
+                        element.clear()
+
+
+# arXiv
+
+def arxiv_query(query: str) -> str:
+      """``query`` in arXiv search syntax: every word must appear unless fields are given."""
+      if ARXIV_FIELD_PREFIX.search(query):
+            return query
+      return " AND ".join(f"all:{word}" for word in re.findall(r"[\w\-.]+", query)) or "all:*"
+
+
+def _arxiv_hit(entry: ET.Element) -> SearchHit:
+      link = entry.findtext(f"{ATOM}id", "")
+      return SearchHit(
+            title=" ".join(entry.findtext(f"{ATOM}title", "").split()),
+            url=link,
+            snippet=" ".join(entry.findtext(f"{ATOM}summary", "").split()),
+            source="arxiv",
+            authors=", ".join(author.findtext(f"{ATOM}name", "") for author in entry.findall(f"{ATOM}author")),
+            year=entry.findtext(f"{ATOM}published", "")[:4],
+            identifier="arXiv:" + link.rsplit("/abs/", 1)[-1]
+      )
+
+
+def _arxiv_pages(params: Dict[str, str], limit: int, page_size: int) -> List[SearchHit]:
+      papers: List[SearchHit] = []
+      start = 0
+      while len(papers) < limit:
+            size = min(page_size, limit - len(papers))
+            total, received = None, 0
+            for element in iter_xml("GET", ARXIV_API_URL, (f"{ATOM}entry", f"{OPENSEARCH}totalResults"),
+                                    params=dict(params, start=start, max_results=size)):
+                  if element.tag == f"{OPENSEARCH}totalResults":
+                        total = int(element.text or 0)
+                  else:
+                        received += 1
+                        # arXiv reports an unknown ID as an entry without a title
+                        if element.findtext(f"{ATOM}title"):
+                              papers.append(_arxiv_hit(element))
+            start += size
+            if received < size or (total is not None and start >= total):
+                  break
+      return papers[:limit]
+
+
+def fetch_arxiv(query: str, num_results: int, page_size: int = ARXIV_PAGE_SIZE) -> List[SearchHit]:
+      """arXiv papers matching ``query``, paging until ``num_results`` are collected."""
+      return _arxiv_pages({"search_query": arxiv_query(query)}, num_results, max(1, page_size))
+
+
+def fetch_arxiv_ids(ids: List[str], page_size: int = ARXIV_PAGE_SIZE) -> List[SearchHit]:
+      """arXiv papers by ID (``2101.00001`` or ``arXiv:2101.00001v2``), in batches."""
+      ids = [re.sub(r"^arxiv:", "", paper_id.strip(), flags=re.IGNORECASE) for paper_id in ids]
+      papers: List[SearchHit] = []
+      for batch in batched(ids, max(1, page_size)):
+            papers.extend(_arxiv_pages({"id_list": ",".join(batch)}, len(batch), len(batch)))
+      return papers
+
+
+# PubMed
+
+def _eutils_params(**params) -> Dict[str, str]:
+      params["db"] = "pubmed"
+      params["tool"] = "EnhancedKnowledgeAssistant"
+      if NCBI_API_KEY:
+            params["api_key"] = NCBI_API_KEY
+      if NCBI_EMAIL:
+            params["email"] = NCBI_EMAIL
+      return params
+
+
+def _pubmed_hit(article: ET.Element) -> SearchHit:
+      pmid = article.findtext("MedlineCitation/PMID", "")
+      citation = article.find("MedlineCitation/Article")
+      if citation is None:
+            return SearchHit(title="No title", url=f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/", source="pubmed",
+                             identifier=f"PMID:{pmid}")
+      authors = []
+      for author in citation.findall("AuthorList/Author"):
+            name = " ".join(filter(None, (author.findtext("LastName"), author.findtext("Initials"))))
+            authors.append(name or author.findtext("CollectiveName", ""))
+      abstract = " ".join(
+            (f"{part.get('Label')}: " if part.get("Label") else "") + "".join(part.itertext())
+            for part in citation.findall("Abstract/AbstractText")
+      )
+      year = citation.findtext("Journal/JournalIssue/PubDate/Year") or citation.findtext("Journal/JournalIssue/PubDate/MedlineDate", "")[:4]
+      doi = next((node.text for node in article.findall("PubmedData/ArticleIdList/ArticleId") if node.get("IdType") == "doi"), None)
+      title = citation.find("ArticleTitle")
+      return SearchHit(
+            title=" ".join("".join(title.itertext()).split()) if title is not None else "No title",
+            url=f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+            snippet=" ".join(abstract.split()),
+            source="pubmed",
+            authors=", ".join(filter(None, authors)),
+            year=year,
+            venue=citation.findtext("Journal/Title", ""),
+            identifier=doi or f"PMID:{pmid}"
+      )
+
+
+def _pubmed_efetch(**params) -> List[SearchHit]:
+      # POST so that long ID lists fit; E-utilities accepts both methods
+      return [
+            _pubmed_hit(article)
+            for article in iter_xml("POST", f"{EUTILS_URL}/efetch.fcgi", ("PubmedArticle",),
+                                    data=_eutils_params(retmode="xml", rettype="abstract", **params))
+      ]
+
+
+def fetch_pubmed(query: str, num_results: int, batch_size: int = PUBMED_BATCH_SIZE) -> List[SearchHit]:
+      """PubMed articles matching ``query``, with abstracts.
+
+      The search is stored on the NCBI history server and its records are
+      fetched from there ``batch_size`` at a time, so the ID list never has
+      to be sent back.
+      """
+      response = http.get(f"{EUTILS_URL}/esearch.fcgi",
+                          params=_eutils_params(term=query, retmode="json", retmax=0, usehistory="y"))
+      response.raise_for_status()
+      result = response.json().get("esearchresult", {})
+      count = min(int(result.get("count", 0)), num_results)
+      papers: List[SearchHit] = []
+      for start in range(0, count, max(1, batch_size)):
+            papers.extend(_pubmed_efetch(
+                  WebEnv=result["webenv"], query_key=result["querykey"],
+                  retstart=start, retmax=min(batch_size, count - start)
+            ))
+      return papers[:num_results]
+
+
+def fetch_pubmed_ids(ids: List[str], batch_size: int = PUBMED_BATCH_SIZE) -> List[SearchHit]:
+      """PubMed articles by PMID (``12345`` or ``PMID:12345``), in batches."""
+      ids = [re.sub(r"^pmid:", "", paper_id.strip(), flags=re.IGNORECASE) for paper_id in ids]
+      papers: List[SearchHit] = []
+      for batch in batched(ids, max(1, batch_size)):
+            papers.extend(_pubmed_efetch(id=",".join(batch)))
+      return papers
+
+
+# Semantic Scholar
+
+def _semantic_scholar_hit(paper: Dict) -> SearchHit:
+      external_ids = paper.get("externalIds") or {}
+      doi = external_ids.get("DOI")
+      return SearchHit(
+            title=paper.get("title") or "No title",
+            url=paper.get("url") or (f"https://doi.org/{doi}" if doi else ""),
+            snippet=paper.get("abstract") or "",
+            source="semantic_scholar",
+            authors=", ".join([author.get("name", "Unknown") for author in paper.get("authors") or []]),
+            year=str(paper.get("year") or ""),
+            venue=paper.get("venue") or "",
+            identifier=doi or (f"arXiv:{external_ids['ArXiv']}" if external_ids.get("ArXiv") else "")
+      )
+
+
+def fetch_semantic_scholar(query: str, num_results: int) -> List[SearchHit]:
+      """Semantic Scholar papers matching ``query``, paging with ``offset``."""
+      papers: List[SearchHit] = []
+      offset = 0
+      while len(papers) < num_results:
+            limit = min(SEMANTIC_SCHOLAR_PAGE_SIZE, num_results - len(papers))
+            response = http.get(f"{SEMANTIC_SCHOLAR_URL}/search", params={
+                  "query": query, "offset": offset, "limit": limit, "fields": SEMANTIC_SCHOLAR_FIELDS
+            })
+            response.raise_for_status()
+            page = response.json()
+            papers.extend(_semantic_scholar_hit(paper) for paper in page.get("data") or [])
+            offset = page.get("next")
+            if not offset or not page.get("data"):
+                  break
+      return papers[:num_results]
+
+
+def fetch_semantic_scholar_ids(ids: List[str]) -> List[SearchHit]:
+      """Semantic Scholar papers by ID (``DOI:...``, ``ARXIV:...``, ``PMID:...`` or paper IDs), in batches."""
+      papers: List[SearchHit] = []
+      for batch in batched(ids, SEMANTIC_SCHOLAR_BATCH_SIZE):
+            response = http.post(f"{SEMANTIC_SCHOLAR_URL}/batch", params={"fields": SEMANTIC_SCHOLAR_FIELDS},
+                                 json={"ids": batch})
+            response.raise_for_status()
+            # Unknown IDs come back as null
+            papers.extend(_semantic_scholar_hit(paper) for paper in response.json() if paper)
+      return papers
+
+
+FETCHERS = {
+      "semantic_scholar": fetch_semantic_scholar,
+      "arxiv": fetch_arxiv,
+      "pubmed": fetch_pubmed
+}
+_source_slots = {source: threading.BoundedSemaphore(max(1, limit)) for source, limit in SOURCE_CONCURRENCY.items()}
+
+
+def search(source: str, query: str, num_results: int) -> List[SearchHit]:
+      """Papers for ``query`` from ``source``, within that source's concurrency limit.
+
+      The slot is taken outside the provider guard, so waiting for it is not
+      counted as provider latency and a hedged backup request shares it.
+      Raises ``resilience.CircuitOpen`` while the source is failing.
+      """
+      with _source_slots[source]:
+            return guards[source].call(lambda: FETCHERS[source](query, num_results))
+
+
+def lookup_ids(identifiers: List[str]) -> List[SearchHit]:
+      """Papers for a mixed list of ``arXiv:``, ``PMID:`` and DOI identifiers.
+
+      Each kind is looked up in batches at the source that owns it; DOIs go
+      to Semantic Scholar. Unrecognized identifiers are skipped.
+      """
+      groups: Dict[str, List[str]] = {"arxiv": [], "pubmed": [], "doi": []}
+      for identifier in dict.fromkeys(identifier.strip() for identifier in identifiers):
+            lowered = identifier.lower()
+            if lowered.startswith("arxiv:"):
+                  groups["arxiv"].append(identifier)
+            elif lowered.startswith("pmid:") or identifier.isdigit():
+                  groups["pubmed"].append(identifier)
+            elif lowered.startswith(("doi:", "10.")):
+                  groups["doi"].append("DOI:" + re.sub(r"^doi:", "", identifier, flags=re.IGNORECASE))
+      papers: List[SearchHit] = []
+      for source, lookup, ids in (("arxiv", fetch_arxiv_ids, groups["arxiv"]),
+                                  ("pubmed", fetch_pubmed_ids, groups["pubmed"]),
+                                  ("semantic_scholar", fetch_semantic_scholar_ids, groups["doi"])):
+            if ids:
+                  with _source_slots[source]:
+                        papers.extend(lookup(ids))
+      return papers
@@ -1,22 +1,145 @@
-from flask import Flask, request, render_template
+from quart import Quart, Response, request, render_template, make_response
 import asyncio
-from know_client import run_agent
+import json
+import os
+import uuid
+from contextlib import asynccontextmanager
+from know_client import load_memory, run_agent, stream_agent, pool
+from memory import SESSION_TTL
+from telemetry import merge_metrics, render_metrics, span, start_span
 
-# Tell Flask to look inside "know/template" folder for HTML files
-app = Flask(__name__, template_folder='template')
+# Tell Quart to look inside "know/template" folder for HTML files
+app = Quart(__name__, template_folder='template')
+
+MAX_CONCURRENT_AGENTS = int(os.getenv("MAX_CONCURRENT_AGENTS", str(pool.size)))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "50"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "60"))
+# Cookie holding the conversation ID, so follow-up questions see the earlier turns
+SESSION_COOKIE = "session_id"
+
+
+class QueueFull(Exception):
+      """Raised when a request cannot get an agent slot in time."""
+
+
+class RequestQueue:
+      """Admission control for agent runs.
+
+      At most ``concurrency`` runs execute at once; up to ``max_waiting``
+      further requests wait in line for ``timeout`` seconds and anything
+      beyond that is turned away immediately.
+      """
+
+      def __init__(self, concurrency: int, max_waiting: int, timeout: float):
+            self.max_waiting = max_waiting
+            self.timeout = timeout
+            self.waiting = 0
+            self._slots = asyncio.Semaphore(max(1, concurrency))
+
+      @asynccontextmanager
+      async def slot(self):
+            with span("request_queue wait", waiting=self.waiting):
+                  await self._acquire()
+            try:
+                  yield
+            finally:
+                  self._slots.release()
+
+      async def _acquire(self):
+            if not self._slots.locked():
+                  await self._slots.acquire()
+            elif self.waiting >= self.max_waiting:
+                  raise QueueFull("The assistant is busy, please try again shortly.")
+            else:
+                  self.waiting += 1
+                  try:
+                        await asyncio.wait_for(self._slots.acquire(), self.timeout)
+                  except asyncio.TimeoutError:
+                        raise QueueFull("Timed out waiting for a free assistant, please try again.")
+                  finally:
+                        self.waiting -= 1
+
+
+agent_queue = RequestQueue(MAX_CONCURRENT_AGENTS, MAX_QUEUED_REQUESTS, QUEUE_TIMEOUT)
+
+@app.after_serving
+async def shutdown_pool():
+      await pool.close()
 
 @app.route("/", methods=["GET"])
-def index():
-      return render_template("index.html")  # ✅ just "index.html"
+async def index():
+      return await render_template("index.html")  # ✅ just "index.html"
+
+def session_id() -> str:
+      return request.cookies.get(SESSION_COOKIE) or uuid.uuid4().hex
+
+def with_session(response: Response, session: str) -> Response:
+      response.set_cookie(SESSION_COOKIE, session, max_age=int(SESSION_TTL), httponly=True, samesite="Lax")
+      return response
 
 @app.route("/ask", methods=["POST"])
-def ask():
-      query = request.form["query"]
-      try:
-            response = asyncio.run(run_agent(query))
-            return render_template("index.html", response=response, query=query)
-      except Exception as e:
-            return render_template("index.html", response=f"Error: {str(e)}", query=query)
+async def ask():
+      query = (await request.form)["query"]
+      session = session_id()
+      with span("http POST /ask") as current:
+            try:
+                  memory = await load_memory(session)
+                  async with agent_queue.slot():
+                        response = await run_agent(query, memory=memory)
+                  page = await render_template("index.html", response=response, query=query)
+                  return with_session(await make_response(page), session)
+            except QueueFull as e:
+                  current.record_exception(e)
+                  page = await render_template("index.html", response=f"Error: {str(e)}", query=query)
+                  return with_session(await make_response(page, 503), session)
+            except Exception as e:
+                  current.record_exception(e)
+                  page = await render_template("index.html", response=f"Error: {str(e)}", query=query)
+                  return with_session(await make_response(page), session)
+
+@app.route("/ask/stream", methods=["GET"])
+async def ask_stream():
+      """Stream agent steps and answer tokens as Server-Sent Events."""
+      query = request.args.get("query", "").strip()
+      session = session_id()
+      
+      async def events():
+            if not query:
+                  yield sse({"type": "error", "content": "Missing query"})
+                  return
+            # Flush something right away so the page can show progress
+            yield sse({"type": "start", "query": query})
+            current = start_span("http GET /ask/stream")
+            try:
+                  memory = await load_memory(session)
+                  async with agent_queue.slot():
+                        async for event in stream_agent(query, memory=memory):
+                              yield sse(event)
+            except Exception as e:
+                  current.record_exception(e)
+                  yield sse({"type": "error", "content": str(e)})
+            finally:
+                  current.end()
+            yield sse({"type": "done"})
+      
+      response = Response(events(), mimetype="text/event-stream")
+      response.headers["Cache-Control"] = "no-cache"
+      response.headers["X-Accel-Buffering"] = "no"
+      response.timeout = None
+      return with_session(response, session)
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+      """Prometheus metrics of this process and of every pooled MCP server process."""
+      texts = [render_metrics({"worker": f"app-{os.getpid()}"})] + await pool.server_metrics()
+      return Response(merge_metrics(texts), mimetype="text/plain; version=0.0.4")
+
+def sse(event: dict) -> str:
+      return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
 
 if __name__ == "__main__":
-      app.run(debug=True)
+      # For production serve the ASGI app with several workers, e.g.
+      # APP_WORKERS=4 hypercorn app:app --workers 4 --bind 0.0.0.0:5000
+      # APP_WORKERS must match --workers so the workers' server pools split the provider
+      # limits between them; with MCP_SERVER_URL they share one server instead
+      app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""Benchmark webpage text extraction against a corpus of saved pages.
+
+Usage:
+      python bench/bench_extract.py path/to/pages [--repeat 5] [--max-bytes 1048576]
+
+Every ``*.html``/``*.htm`` file under the corpus directory is extracted with
+each available backend and with the original full-page BeautifulSoup
+pipeline, and the mean time per page is reported relative to that baseline.
+``--max-bytes`` applies the same byte budget the streaming fetch uses.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extract  # noqa: E402
+
+
+def legacy_extract(html: str, max_length: int) -> str:
+      """The pre-streaming get_webpage_content pipeline, kept as the baseline."""
+      from bs4 import BeautifulSoup
+
+      soup = BeautifulSoup(html, 'html.parser')
+      for script_or_style in soup(["script", "style", "header", "footer", "nav"]):
+            script_or_style.decompose()
+      text = soup.get_text(separator='\n')
+      lines = (line.strip() for line in text.splitlines())
+      chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+      text = '\n'.join(chunk for chunk in chunks if chunk)
+      if len(text) > max_length:
+            text = text[:max_length] + "... [content truncated]"
+      return text
+
+
+def load_corpus(directory: str, max_bytes: int):
+      pages = []
+      for path in sorted(Path(directory).rglob("*")):
+            if path.suffix.lower() in (".html", ".htm"):
+                  raw = path.read_bytes()
+                  pages.append((raw.decode("utf-8", errors="replace"),
+                                raw[:max_bytes].decode("utf-8", errors="replace")))
+      return pages
+
+
+def time_per_page(func, pages, repeat: int) -> float:
+      runs = []
+      for _ in range(repeat):
+            start = time.perf_counter()
+            for html in pages:
+                  func(html)
+            runs.append((time.perf_counter() - start) / len(pages))
+      return statistics.mean(runs)
+
+
+def main():
+      parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+      parser.add_argument("corpus", help="Directory of saved .html pages")
+      parser.add_argument("--repeat", type=int, default=5)
+      parser.add_argument("--max-length", type=int, default=3000)
+      parser.add_argument("--max-bytes", type=int, default=1024 * 1024)
+      args = parser.parse_args()
+
+      pages = load_corpus(args.corpus, args.max_bytes)
+      if not pages:
+            sys.exit(f"No .html pages found under {args.corpus}")
+      full_pages = [full for full, _ in pages]
+      budget_pages = [capped for _, capped in pages]
+      total_mb = sum(len(page.encode("utf-8")) for page in full_pages) / 1e6
+      print(f"{len(pages)} pages, {total_mb:.1f} MB, {args.repeat} runs each\n")
+
+      baseline = time_per_page(lambda html: legacy_extract(html, args.max_length), full_pages, args.repeat)
+      print(f"{'legacy (html.parser, full page)':40s} {baseline * 1000:9.2f} ms/page    1.00x")
+      for backend in extract.available_backends():
+            elapsed = time_per_page(
+                  lambda html: extract.extract_text(html, args.max_length, backend=backend),
+                  budget_pages, args.repeat
+            )
+            label = f"{backend} (<= {args.max_bytes} bytes)"
+            print(f"{label:40s} {elapsed * 1000:9.2f} ms/page {baseline / elapsed:7.2f}x")
+
+
+if __name__ == "__main__":
+      main()
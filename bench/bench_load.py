@@ -0,0 +1,387 @@
+"""Offline throughput and latency benchmark of the tools and the web app.
+
+Usage:
+      python bench/bench_load.py [tools] [stdio] [http] [ask] [--requests 60] [--concurrency 8]
+      python bench/bench_load.py ask --url http://127.0.0.1:5000 --concurrency 16
+      python bench/bench_load.py --json bench.json --baseline main.json --max-regression 0.25
+
+Every upstream service is replaced by the stub in ``bench/stubs.py``, so no
+API keys or network access are needed and results are repeatable. The
+scenarios are:
+
+* ``tools``: the server.py tool functions called in this process
+* ``stdio``: the same tools called over MCP stdio on ``--sessions`` server processes
+* ``http``: the same tools called over streamable HTTP on one server.py
+  with ``--server-workers`` worker processes, from ``--sessions`` clients
+* ``ask``: POST /ask against app.py served by hypercorn, or against ``--url``,
+  which must already be pointed at a stub (``python bench/stubs.py``)
+
+Search and LLM caching and the client-side rate limits are turned off so
+that every request reaches the stub; ``--cache`` keeps the caches on.
+Throughput, p50/p95/p99 latencies and errors are reported per scenario and
+per tool. With ``--baseline`` the run is compared with an earlier
+``--json`` report and the exit status is 1 if throughput dropped, or p50 or
+p95 latency grew, by more than ``--max-regression``.
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import add_fault_arguments, parse_faults, start_stub  # noqa: E402
+
+QUERY = "retrieval augmented generation"
+# (tool, arguments) cycled through by the tools and stdio scenarios
+WORKLOAD: List[Tuple[str, Dict[str, Any]]] = [
+      ("search_google", {"query": QUERY, "num_results": 5}),
+      ("search_serper", {"query": QUERY, "num_results": 5}),
+      ("search_academic", {"query": QUERY, "source": "semantic_scholar", "num_results": 5}),
+      ("search_academic", {"query": QUERY, "source": "arxiv", "num_results": 3}),
+      ("search_academic", {"query": QUERY, "source": "pubmed", "num_results": 3}),
+      ("unified_search", {"query": QUERY, "sources": ["google", "serper", "semantic_scholar", "arxiv", "pubmed"], "num_results": 3}),
+      ("get_webpage_content", {"url": "https://example.org/blog/retrieval-augmented-generation"}),
+      ("fact_check", {"claim": "Retrieval-augmented generation was introduced by Lewis et al. in 2020."}),
+      ("analyze_topic", {"topic": QUERY, "depth": "brief"}),
+]
+ASK_QUERIES = [
+      "What is retrieval augmented generation?",
+      "Who introduced retrieval-augmented generation and when?",
+      "How do RAG pipelines combine keyword and vector search?",
+]
+PROVIDERS = ("GOOGLE", "SERPER", "SEMANTIC_SCHOLAR", "PUBMED", "ARXIV")
+ASK_ERROR = re.compile(r"<strong>Response:</strong><br>\s*Error:")
+
+
+def bench_env(stub_url: str, cache: bool) -> Dict[str, str]:
+      """Environment pointing the assistant at the stub, with fake keys and no rate limits."""
+      env = {
+            "HTTP_UPSTREAM_OVERRIDE": stub_url,
+            "AZURE_OPENAI_ENDPOINT": stub_url,
+            "AZURE_OPENAI_KEY": "bench",
+            "GOOGLE_API_KEY": "bench",
+            "GOOGLE_CSE_ID": "bench",
+            "SERPER_API_KEY": "bench",
+            "LLM_CACHE_BACKEND": "memory" if cache else "off",
+            "SEARCH_CACHE_PATH": "",
+            "DOC_INDEX_PATH": "",
+      }
+      for provider in PROVIDERS:
+            env.update({f"{provider}_RPS": "1000", f"{provider}_BURST": "1000", f"{provider}_DAILY_QUOTA": "0"})
+            if not cache:
+                  env[f"SEARCH_CACHE_TTL_{provider}"] = "0"
+      return env
+
+
+def tool_failed(text: str) -> bool:
+      """Same test as ``server.tool_failed``, applied to a tool result as sent over MCP."""
+      if text.startswith(("Error", "Invalid", "No valid")):
+            return True
+      try:
+            return "error" in json.loads(text)
+      except (ValueError, TypeError):
+            return False
+
+
+def percentile(ordered: List[float], q: float) -> float:
+      """Nearest-rank percentile of an ascending list."""
+      return ordered[max(0, math.ceil(q * len(ordered)) - 1)] if ordered else 0.0
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+      ordered = sorted(latencies)
+      return {
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+            "max_ms": round((ordered[-1] if ordered else 0.0) * 1000, 1),
+      }
+
+
+async def drive(call: Callable[[str, Dict[str, Any]], Awaitable[None]], operations: List[Tuple[str, Dict[str, Any]]],
+                requests: int, concurrency: int) -> Dict[str, Any]:
+      """Run ``requests`` operations, ``concurrency`` at a time, and summarize their latencies."""
+      latencies: Dict[str, List[float]] = defaultdict(list)
+      errors: Dict[str, int] = defaultdict(int)
+      first_errors: Dict[str, str] = {}
+      numbers = itertools.count()
+
+      async def worker():
+            while (number := next(numbers)) < requests:
+                  name, arguments = operations[number % len(operations)]
+                  started = time.perf_counter()
+                  try:
+                        await call(name, arguments)
+                  except Exception as e:
+                        errors[name] += 1
+                        first_errors.setdefault(name, f"{type(e).__name__}: {e}"[:300])
+                  latencies[name].append(time.perf_counter() - started)
+
+      started = time.perf_counter()
+      await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+      elapsed = time.perf_counter() - started
+      every = [latency for values in latencies.values() for latency in values]
+      return {
+            "requests": len(every),
+            "errors": sum(errors.values()),
+            "error_rate": round(sum(errors.values()) / max(1, len(every)), 4),
+            "concurrency": concurrency,
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(every) / elapsed, 2) if elapsed else 0.0,
+            **latency_summary(every),
+            "operations": {
+                  name: {"requests": len(values), "errors": errors.get(name, 0), **latency_summary(values)}
+                  for name, values in latencies.items()
+            },
+            "first_errors": first_errors,
+      }
+
+
+async def measure(call, operations, args) -> Dict[str, Any]:
+      if args.warmup:
+            await drive(call, operations, args.warmup, min(args.concurrency, args.warmup))
+      return await drive(call, operations, args.requests, args.concurrency)
+
+
+def workload(args) -> List[Tuple[str, Dict[str, Any]]]:
+      if not args.tools:
+            return WORKLOAD
+      wanted = set(args.tools.split(","))
+      return [(name, arguments) for name, arguments in WORKLOAD if name in wanted]
+
+
+async def bench_tools(args, env: Dict[str, str]) -> Dict[str, Any]:
+      """Call the tool functions in this process."""
+      os.environ.update(env)
+      import server
+      if not args.verbose:
+            # The HTTP clients log every request at INFO
+            logging.disable(logging.INFO)
+
+      async def call(name: str, arguments: Dict[str, Any]):
+            func = getattr(server, name)
+            if inspect.iscoroutinefunction(func):
+                  result = await func(**arguments)
+            else:
+                  result = await asyncio.to_thread(func, **arguments)
+            if server.tool_failed(result):
+                  raise RuntimeError(str(result)[:300])
+
+      return await measure(call, workload(args), args)
+
+
+async def bench_stdio(args, env: Dict[str, str]) -> Dict[str, Any]:
+      """Call the tools over MCP stdio, spreading requests over several server processes."""
+      from mcp import ClientSession, StdioServerParameters
+      from mcp.client.stdio import stdio_client
+
+      params = StdioServerParameters(command=sys.executable, args=["server.py"], cwd=ROOT, env=dict(os.environ, **env))
+      async with AsyncExitStack() as stack:
+            errlog = sys.stderr if args.verbose else stack.enter_context(open(os.devnull, "w"))
+            sessions = []
+            for _ in range(max(1, args.sessions)):
+                  read, write = await stack.enter_async_context(stdio_client(params, errlog=errlog))
+                  session = await stack.enter_async_context(ClientSession(read, write))
+                  await session.initialize()
+                  sessions.append(session)
+            return await call_over_mcp(sessions, args)
+
+
+async def call_over_mcp(sessions, args) -> Dict[str, Any]:
+      picks = itertools.cycle(sessions)
+
+      async def call(name: str, arguments: Dict[str, Any]):
+            result = await next(picks).call_tool(name, arguments)
+            text = "".join(getattr(block, "text", "") for block in result.content)
+            if result.isError or tool_failed(text):
+                  raise RuntimeError(text[:300])
+
+      return await measure(call, workload(args), args)
+
+
+async def bench_http(args, env: Dict[str, str]) -> Dict[str, Any]:
+      """Call the tools over streamable HTTP on one multi-process server."""
+      import httpx
+      from mcp import ClientSession
+      from mcp.client.streamable_http import streamable_http_client
+
+      port = free_port()
+      server_env = dict(os.environ, **env, MCP_TRANSPORT="streamable-http", MCP_PORT=str(port),
+                        MCP_WORKERS=str(args.server_workers))
+      output = None if args.verbose else subprocess.DEVNULL
+      process = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=server_env, stdout=output, stderr=output)
+      url = f"http://127.0.0.1:{port}/mcp"
+      try:
+            async with httpx.AsyncClient(timeout=args.timeout) as probe:
+                  await wait_until_up(probe, url, accept=(200, 400, 405, 406))
+            async with AsyncExitStack() as stack:
+                  sessions = []
+                  for _ in range(max(1, args.sessions)):
+                        read, write, _ = await stack.enter_async_context(streamable_http_client(url))
+                        session = await stack.enter_async_context(ClientSession(read, write))
+                        await session.initialize()
+                        sessions.append(session)
+                  return await call_over_mcp(sessions, args)
+      finally:
+            stop(process)
+
+
+def free_port() -> int:
+      with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+
+def stop(process: subprocess.Popen):
+      process.terminate()
+      try:
+            process.wait(timeout=10)
+      except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def wait_until_up(client, url: str, timeout: float = 60, accept=(200,)):
+      deadline = time.monotonic() + timeout
+      while True:
+            try:
+                  if (await client.get(url)).status_code in accept:
+                        return
+            except Exception:
+                  if time.monotonic() > deadline:
+                        raise
+            if time.monotonic() > deadline:
+                  raise TimeoutError(f"{url} did not come up within {timeout:g}s")
+            await asyncio.sleep(0.25)
+
+
+async def bench_ask(args, env: Dict[str, str]) -> Dict[str, Any]:
+      """POST /ask at the configured concurrency, starting app.py under hypercorn unless ``--url`` is given."""
+      import httpx
+
+      process = None
+      url = args.url
+      if not url:
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            app_env = dict(os.environ, **env, MCP_POOL_SIZE=str(args.pool_size))
+            output = None if args.verbose else subprocess.DEVNULL
+            process = subprocess.Popen(
+                  [sys.executable, "-m", "hypercorn", "app:app", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers)],
+                  cwd=ROOT, env=app_env, stdout=output, stderr=output
+            )
+      queries = [("ask", {"query": query}) for query in ASK_QUERIES]
+      try:
+            async with httpx.AsyncClient(base_url=url, timeout=args.timeout,
+                                         limits=httpx.Limits(max_connections=args.concurrency)) as client:
+                  await wait_until_up(client, "/")
+
+                  async def call(name: str, form: Dict[str, Any]):
+                        response = await client.post("/ask", data=form)
+                        if response.status_code != 200 or ASK_ERROR.search(response.text):
+                              raise RuntimeError(f"HTTP {response.status_code}")
+
+                  return await measure(call, queries, args)
+      finally:
+            if process is not None:
+                  stop(process)
+
+
+SCENARIOS = {"tools": bench_tools, "stdio": bench_stdio, "http": bench_http, "ask": bench_ask}
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+      """Scenarios that got slower than ``baseline`` by more than ``max_regression``."""
+      problems = []
+      for scenario, current in report["scenarios"].items():
+            previous = baseline.get("scenarios", {}).get(scenario)
+            if not previous:
+                  continue
+            if current["throughput"] < previous["throughput"] * (1 - max_regression):
+                  problems.append(f"{scenario}: throughput {current['throughput']:g}/s, baseline {previous['throughput']:g}/s")
+            for key in ("p50_ms", "p95_ms"):
+                  if current[key] > previous[key] * (1 + max_regression):
+                        problems.append(f"{scenario}: {key[:3]} {current[key]:g}ms, baseline {previous[key]:g}ms")
+            if current["error_rate"] > previous["error_rate"] + 0.01:
+                  problems.append(f"{scenario}: error rate {current['error_rate']:.2%}, baseline {previous['error_rate']:.2%}")
+      return problems
+
+
+def print_report(report: Dict[str, Any]):
+      print(f"{'scenario':<28}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+      for scenario, result in report["scenarios"].items():
+            rows = [(scenario, result)] + [(f"  {name}", stats) for name, stats in result["operations"].items()]
+            for label, stats in rows:
+                  throughput = f"{stats['throughput']:.2f}" if "throughput" in stats else ""
+                  print(f"{label:<28}{stats['requests']:>9}{stats['errors']:>8}{throughput:>9}"
+                        f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+            for name, error in result["first_errors"].items():
+                  print(f"  first {name} error: {error}")
+
+
+def main():
+      parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+      parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+      parser.add_argument("--requests", type=int, default=60, help="Measured requests per scenario")
+      parser.add_argument("--concurrency", type=int, default=8)
+      parser.add_argument("--warmup", type=int, default=9, help="Unmeasured requests sent first")
+      parser.add_argument("--tools", help="Comma-separated tools to include (default: the whole workload)")
+      parser.add_argument("--sessions", type=int, default=2, help="MCP client sessions for the stdio and http scenarios")
+      parser.add_argument("--server-workers", type=int, default=2, help="server.py worker processes for the http scenario")
+      parser.add_argument("--url", help="Benchmark this running app instead of starting one")
+      parser.add_argument("--workers", type=int, default=1, help="hypercorn workers for the ask scenario")
+      parser.add_argument("--pool-size", type=int, default=4, help="MCP_POOL_SIZE of the app")
+      parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout of the http and ask scenarios")
+      parser.add_argument("--cache", action="store_true", help="Leave the search and LLM caches on")
+      parser.add_argument("--json", dest="json_path", help="Write the report to this file")
+      parser.add_argument("--baseline", help="Report of an earlier run to compare with")
+      parser.add_argument("--max-regression", type=float, default=0.25,
+                          help="Allowed relative drop in throughput or growth in p50/p95")
+      parser.add_argument("--verbose", action="store_true", help="Show the output of server processes")
+      add_fault_arguments(parser)
+      args = parser.parse_args()
+      unknown = set(args.scenarios) - set(SCENARIOS)
+      if unknown:
+            parser.error(f"unknown scenario {', '.join(sorted(unknown))}; choose from {', '.join(SCENARIOS)}")
+
+      stub = None if args.url and args.scenarios == ["ask"] else start_stub(faults=parse_faults(args))
+      env = bench_env(stub.url if stub else "", args.cache)
+      report: Dict[str, Any] = {"settings": {key: value for key, value in vars(args).items() if key not in ("json_path", "baseline")},
+                                "scenarios": {}}
+      for name in args.scenarios or list(SCENARIOS):
+            print(f"Running {name}...", file=sys.stderr)
+            report["scenarios"][name] = asyncio.run(SCENARIOS[name](args, env))
+      if stub is not None:
+            report["upstream"] = stub.stats()
+            stub.shutdown()
+
+      print_report(report)
+      if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as handle:
+                  json.dump(report, handle, indent=2)
+
+      if args.baseline:
+            with open(args.baseline, encoding="utf-8") as handle:
+                  problems = regressions(report, json.load(handle), args.max_regression)
+            for problem in problems:
+                  print(f"REGRESSION {problem}")
+            if problems:
+                  sys.exit(1)
+
+
+if __name__ == "__main__":
+      main()
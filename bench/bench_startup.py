@@ -0,0 +1,212 @@
+"""Cold-start benchmark: import time and time to a ready MCP session.
+
+Usage:
+      python bench/bench_startup.py [server] [know_client] [app] [server_ready] [client_ready] [--runs 5]
+      python bench/bench_startup.py --budget server=0.8 --budget client_ready=3 --json startup.json
+
+Every target is measured in fresh interpreters, ``--runs`` times, and the
+median is reported:
+
+* ``server``, ``know_client``, ``app``: ``import <module>``
+* ``server_ready``: server.py spawned over MCP stdio until ``initialize`` and
+  ``list_tools`` have answered, which every pooled client session waits for
+* ``client_ready``: ``import know_client`` plus its first pooled session,
+  i.e. how long ``python know_client.py`` takes before it can run a query
+
+Times exclude the interpreter's own start-up, which is reported as
+``interpreter``. The third-party packages that took longest to import in
+the median run are listed, from ``python -X importtime``.
+
+The exit status is 1 when a target is over its budget (seconds, see
+:data:`BUDGETS` and ``--budget``) or when importing a module loaded one of
+the dependencies it is meant to load only on first use (:data:`LAZY`).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run in the fresh interpreter for each target; it must leave its duration in `elapsed`.
+# The interpreter's own start-up is timed from outside instead.
+TARGETS: Dict[str, str] = {
+      "interpreter": "elapsed = None",
+      "server": "started = time.perf_counter()\nimport server\nelapsed = time.perf_counter() - started",
+      "know_client": "started = time.perf_counter()\nimport know_client\nelapsed = time.perf_counter() - started",
+      "app": "started = time.perf_counter()\nimport app\nelapsed = time.perf_counter() - started",
+      "server_ready": """
+import asyncio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+async def ready():
+      params = StdioServerParameters(command=sys.executable, args=["server.py"], env=dict(os.environ))
+      started = time.perf_counter()
+      async with stdio_client(params) as (read, write):
+            async with ClientSession(read, write) as session:
+                  await session.initialize()
+                  await session.list_tools()
+                  return time.perf_counter() - started
+
+elapsed = asyncio.run(ready())
+""",
+      "client_ready": """
+import asyncio
+started = time.perf_counter()
+import know_client
+
+async def ready():
+      async with know_client.pool.session():
+            pass
+      await know_client.pool.close()
+
+asyncio.run(ready())
+elapsed = time.perf_counter() - started
+""",
+}
+DEFAULT_TARGETS = ["server", "know_client", "app", "server_ready", "client_ready"]
+
+# Seconds; generous enough for a laptop, tight enough to catch an eager import of openai or langchain
+BUDGETS: Dict[str, float] = {
+      "server": 1.0,
+      "know_client": 1.0,
+      "app": 1.5,
+      "server_ready": 2.0,
+      "client_ready": 5.0,
+}
+
+# Dependencies each module must not import until they are used
+LAZY: Dict[str, List[str]] = {
+      "server": ["openai", "requests", "bs4", "langchain_core"],
+      "know_client": ["openai", "langchain_openai", "langgraph", "langchain_mcp_adapters"],
+      "app": ["openai", "langchain_openai", "langgraph", "langchain_mcp_adapters"],
+}
+
+CHILD = """
+import json, os, sys, time
+{code}
+print("STARTUP " + json.dumps({{"elapsed": elapsed, "loaded": [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def startup_env() -> Dict[str, str]:
+      """Environment with fake keys, so nothing reaches Azure and no .env values are needed."""
+      env = dict(os.environ, PYTHONPATH=ROOT)
+      env.update({
+            "AZURE_OPENAI_KEY": env.get("AZURE_OPENAI_KEY") or "bench",
+            "AZURE_OPENAI_ENDPOINT": env.get("AZURE_OPENAI_ENDPOINT") or "http://127.0.0.1:9",
+            "MCP_POOL_SIZE": "1",
+            "MCP_SERVER_URL": "",
+      })
+      return env
+
+
+def run_once(target: str, env: Dict[str, str]) -> Tuple[float, List[str], str]:
+      """Run ``target`` in a new interpreter; returns its duration, eagerly loaded modules and import log."""
+      code = CHILD.format(code=TARGETS[target], lazy=LAZY.get(target, []))
+      started = time.perf_counter()
+      completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                                 capture_output=True, text=True, timeout=120)
+      wall = time.perf_counter() - started
+      for line in completed.stdout.splitlines():
+            if line.startswith("STARTUP "):
+                  result = json.loads(line[len("STARTUP "):])
+                  elapsed = result["elapsed"] if result["elapsed"] is not None else wall
+                  return elapsed, result["loaded"], completed.stderr
+      raise RuntimeError(f"{target} failed:\n{completed.stderr[-2000:]}")
+
+
+def slowest_packages(importtime_log: str, top: int) -> List[Tuple[str, float]]:
+      """Third-party packages of a ``-X importtime`` log with the largest cumulative import time, in seconds."""
+      package_time: Dict[str, float] = {}
+      for line in importtime_log.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                  continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            package = name.strip().split(".")[0]
+            if package in sys.stdlib_module_names or os.path.exists(os.path.join(ROOT, package + ".py")):
+                  continue
+            package_time[package] = max(package_time.get(package, 0.0), int(cumulative) / 1e6)
+      return sorted(package_time.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def measure(target: str, runs: int, env: Dict[str, str], top: int) -> Dict[str, Any]:
+      samples = [run_once(target, env) for _ in range(max(1, runs))]
+      ordered = sorted(samples, key=lambda sample: sample[0])
+      median_run = ordered[len(ordered) // 2]
+      return {
+            "median_s": round(statistics.median(sample[0] for sample in samples), 4),
+            "min_s": round(ordered[0][0], 4),
+            "max_s": round(ordered[-1][0], 4),
+            "eagerly_loaded": sorted({name for sample in samples for name in sample[1]}),
+            "slowest_packages": [{"package": name, "seconds": round(seconds, 4)}
+                                 for name, seconds in slowest_packages(median_run[2], top)],
+      }
+
+
+def budget_problems(report: Dict[str, Any], budgets: Dict[str, float]) -> List[str]:
+      problems = []
+      for target, result in report["targets"].items():
+            budget = budgets.get(target)
+            if budget is not None and result["median_s"] > budget:
+                  problems.append(f"{target}: {result['median_s']:.3f}s, budget {budget:g}s")
+            if result["eagerly_loaded"]:
+                  problems.append(f"{target}: imports {', '.join(result['eagerly_loaded'])} at start-up")
+      return problems
+
+
+def print_report(report: Dict[str, Any], budgets: Dict[str, float]):
+      print(f"{'target':<16}{'median s':>10}{'min s':>9}{'max s':>9}{'budget s':>10}")
+      for target, result in report["targets"].items():
+            budget = f"{budgets[target]:g}" if target in budgets else ""
+            print(f"{target:<16}{result['median_s']:>10.3f}{result['min_s']:>9.3f}{result['max_s']:>9.3f}{budget:>10}")
+            for entry in result["slowest_packages"]:
+                  print(f"    {entry['package']:<36}{entry['seconds']:>8.3f}")
+
+
+def parse_budget(value: str) -> Tuple[str, float]:
+      target, _, seconds = value.partition("=")
+      if target not in TARGETS or not seconds:
+            raise argparse.ArgumentTypeError(f"expected <target>=<seconds> with a target from {', '.join(TARGETS)}")
+      return target, float(seconds)
+
+
+def main():
+      parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+      parser.add_argument("targets", nargs="*", help=f"Targets to measure: {', '.join(TARGETS)} (default: all but interpreter)")
+      parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+      parser.add_argument("--top", type=int, default=5, help="Slowest packages listed per target")
+      parser.add_argument("--budget", type=parse_budget, action="append", default=[],
+                          help="Override a budget, e.g. server=0.8 (repeatable)")
+      parser.add_argument("--json", dest="json_path", help="Write the report to this file")
+      args = parser.parse_args()
+      unknown = set(args.targets) - set(TARGETS)
+      if unknown:
+            parser.error(f"unknown target {', '.join(sorted(unknown))}; choose from {', '.join(TARGETS)}")
+
+      budgets = dict(BUDGETS, **dict(args.budget))
+      env = startup_env()
+      report: Dict[str, Any] = {"settings": {"runs": args.runs, "budgets": budgets}, "targets": {}}
+      for target in ["interpreter"] + (args.targets or DEFAULT_TARGETS):
+            print(f"Measuring {target}...", file=sys.stderr)
+            report["targets"][target] = measure(target, args.runs, env, args.top)
+
+      print_report(report, budgets)
+      if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as handle:
+                  json.dump(report, handle, indent=2)
+
+      problems = budget_problems(report, budgets)
+      for problem in problems:
+            print(f"OVER BUDGET {problem}")
+      if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+      main()
@@ -0,0 +1,280 @@
+"""Local stand-ins for the search APIs, web pages and Azure OpenAI.
+
+Usage:
+      python bench/stubs.py [--port 8900] [--latency 0.05] [--latency llm=0.8] [--error-rate 0.02]
+      python bench/stubs.py --record
+
+Point the assistant at the stub with::
+
+      HTTP_UPSTREAM_OVERRIDE=http://127.0.0.1:8900
+      AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8900
+
+The shared HTTP client then sends every request to
+``<stub>/<scheme>/<host><path>``, and the stub answers it from the
+recorded responses in ``bench/fixtures``. Chat completions follow
+``fixtures/llm.json``: a request that offers the recorded tool and has no
+tool result yet gets a call of that tool, every other request gets the
+recorded answer, streamed when the client asks for a stream.
+
+``--latency``, ``--jitter`` and ``--error-rate`` take a plain value for
+every provider or ``provider=value`` for one of them (google, serper,
+semantic_scholar, pubmed, arxiv, web or llm). With ``--record`` the search
+and page requests are forwarded to the live services and every fixture is
+overwritten with the latest response for its route.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+FIXTURES = Path(__file__).with_name("fixtures")
+
+# (host, path prefix, provider, fixture); the first match wins and "*" matches any host
+ROUTES = [
+      ("www.googleapis.com", "/customsearch/", "google", "google.json"),
+      ("google.serper.dev", "/search", "serper", "serper.json"),
+      ("api.semanticscholar.org", "/graph/v1/paper/batch", "semantic_scholar", "semantic_scholar_batch.json"),
+      ("api.semanticscholar.org", "/graph/v1/paper/search", "semantic_scholar", "semantic_scholar_search.json"),
+      ("eutils.ncbi.nlm.nih.gov", "/entrez/eutils/esearch", "pubmed", "pubmed_esearch.json"),
+      ("eutils.ncbi.nlm.nih.gov", "/entrez/eutils/efetch", "pubmed", "pubmed_efetch.xml"),
+      ("export.arxiv.org", "/api/query", "arxiv", "arxiv.xml"),
+      ("*", "/", "web", "page.html"),
+]
+PROVIDERS = ["google", "serper", "semantic_scholar", "pubmed", "arxiv", "web", "llm"]
+CONTENT_TYPES = {
+      ".json": "application/json",
+      ".xml": "application/xml; charset=utf-8",
+      ".html": "text/html; charset=utf-8",
+}
+# Request headers passed on to the live service in record mode
+RECORD_HEADERS = ("Content-Type", "X-API-KEY", "x-api-key", "Accept")
+
+
+@dataclass
+class Faults:
+      """Latency and failures injected into one provider's responses."""
+      latency: float = 0.0
+      jitter: float = 0.0
+      error_rate: float = 0.0
+      error_status: int = 503
+
+      def delay(self) -> float:
+            return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+      def fails(self) -> bool:
+            return random.random() < self.error_rate
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+      """Add the latency and error injection options shared with the benchmark driver."""
+      parser.add_argument("--latency", action="append", default=[], metavar="[PROVIDER=]SECONDS",
+                          help="Mean response delay, for every provider or one of them")
+      parser.add_argument("--jitter", action="append", default=[], metavar="[PROVIDER=]SECONDS",
+                          help="Uniform random variation around the delay")
+      parser.add_argument("--error-rate", action="append", default=[], metavar="[PROVIDER=]FRACTION",
+                          help="Share of requests answered with --error-status")
+      parser.add_argument("--error-status", type=int, default=503, help="Status of injected errors, e.g. 429 or 503")
+
+
+def parse_faults(args: argparse.Namespace) -> Dict[str, Faults]:
+      """Per-provider :class:`Faults` from the options added by :func:`add_fault_arguments`."""
+      faults = {provider: Faults(error_status=args.error_status) for provider in PROVIDERS}
+      for attribute, values in (("latency", args.latency), ("jitter", args.jitter), ("error_rate", args.error_rate)):
+            # Plain values first, so that provider=value settings override them
+            for value in sorted(values, key=lambda value: "=" in value):
+                  provider, _, number = value.rpartition("=")
+                  if provider and provider not in faults:
+                        raise ValueError(f"Unknown provider '{provider}'. Choose from: {', '.join(PROVIDERS)}")
+                  for name in [provider] if provider else PROVIDERS:
+                        setattr(faults[name], attribute, float(number))
+      return faults
+
+
+def route(host: str, path: str) -> Tuple[str, str]:
+      """Provider and fixture file serving ``path`` on ``host``."""
+      for route_host, prefix, provider, fixture in ROUTES:
+            if route_host in ("*", host) and path.startswith(prefix):
+                  return provider, fixture
+      return "web", "page.html"
+
+
+def chat_reply(request: Dict) -> Dict:
+      """The scripted assistant message for a chat completion request."""
+      script = json.loads((FIXTURES / "llm.json").read_text(encoding="utf-8"))
+      call = script["tool_call"]
+      offered = {tool.get("function", {}).get("name") for tool in request.get("tools") or []}
+      answered = any(message.get("role") == "tool" for message in request.get("messages") or [])
+      if call["name"] in offered and not answered:
+            return {"role": "assistant", "content": None, "tool_calls": [{
+                  "id": f"call_{random.getrandbits(48):012x}",
+                  "type": "function",
+                  "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])}
+            }]}
+      return {"role": "assistant", "content": script["answer"]}
+
+
+def chat_completion(request: Dict) -> Tuple[Dict, List[Dict]]:
+      """A chat completion for ``request`` and the same completion as stream chunks."""
+      message = chat_reply(request)
+      base = {"id": f"chatcmpl-{random.getrandbits(64):016x}", "created": int(time.time()), "model": request.get("model") or "gpt-4o"}
+      finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+      # Roughly four characters per token, as for English text
+      prompt_tokens = len(json.dumps(request.get("messages") or [])) // 4
+      completion_tokens = max(1, len(message.get("content") or json.dumps(message.get("tool_calls"))) // 4)
+      usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+               "total_tokens": prompt_tokens + completion_tokens}
+      completion = dict(base, object="chat.completion", usage=usage, choices=[
+            {"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}
+      ])
+
+      chunk = dict(base, object="chat.completion.chunk")
+      deltas: List[Dict] = [{"role": "assistant", "content": ""}]
+      if message.get("tool_calls"):
+            deltas.append({"tool_calls": [dict(message["tool_calls"][0], index=0)]})
+      else:
+            words = message["content"].split(" ")
+            deltas.extend({"content": " ".join(words[start:start + 4]) + (" " if start + 4 < len(words) else "")}
+                          for start in range(0, len(words), 4))
+      chunks = [dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]) for delta in deltas]
+      chunks.append(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+      if (request.get("stream_options") or {}).get("include_usage"):
+            chunks.append(dict(chunk, choices=[], usage=usage))
+      return completion, chunks
+
+
+class StubServer(ThreadingHTTPServer):
+      """Threaded stub answering every provider; see the module docstring."""
+
+      daemon_threads = True
+
+      def __init__(self, address: Tuple[str, int], faults: Optional[Dict[str, Faults]] = None, record: bool = False):
+            super().__init__(address, StubHandler)
+            self.faults = faults or {}
+            self.record = record
+            self.fixtures: Dict[str, bytes] = {}
+            self.counts: Counter = Counter()
+            self._lock = threading.Lock()
+
+      @property
+      def url(self) -> str:
+            host, port = self.server_address[:2]
+            return f"http://{host}:{port}"
+
+      def fixture(self, name: str) -> bytes:
+            if self.record or name not in self.fixtures:
+                  self.fixtures[name] = (FIXTURES / name).read_bytes()
+            return self.fixtures[name]
+
+      def count(self, provider: str, status: int):
+            with self._lock:
+                  self.counts[(provider, status)] += 1
+
+      def stats(self) -> Dict[str, Dict[str, int]]:
+            """Responses sent so far, by provider and status code."""
+            with self._lock:
+                  counts = dict(self.counts)
+            stats: Dict[str, Dict[str, int]] = {}
+            for (provider, status), count in sorted(counts.items()):
+                  stats.setdefault(provider, {})[str(status)] = count
+            return stats
+
+
+class StubHandler(BaseHTTPRequestHandler):
+      # Keep connections open like the real services, so the client's pools are exercised
+      protocol_version = "HTTP/1.1"
+      server: StubServer
+
+      def log_message(self, format, *args):
+            pass
+
+      def do_GET(self):
+            self.handle_stub()
+
+      def do_POST(self):
+            self.handle_stub()
+
+      def handle_stub(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path, _, query = self.path.partition("?")
+            if path.endswith("/chat/completions"):
+                  provider = "llm"
+            else:
+                  scheme, _, rest = path.lstrip("/").partition("/")
+                  host, _, upstream_path = rest.partition("/")
+                  if scheme not in ("http", "https") or not host:
+                        return self.reply(404, b'{"error": "expected /<scheme>/<host>/<path>"}', "application/json", "unknown")
+                  provider, fixture = route(host, "/" + upstream_path)
+
+            faults = self.server.faults.get(provider, Faults())
+            time.sleep(faults.delay())
+            if faults.fails():
+                  headers = {"Retry-After": "1"} if faults.error_status == 429 else {}
+                  return self.reply(faults.error_status, b'{"error": "injected failure"}', "application/json", provider, headers)
+
+            if provider == "llm":
+                  return self.reply_chat(json.loads(body or b"{}"))
+            if self.server.record:
+                  return self.reply_recorded(f"{scheme}://{host}/{upstream_path}" + (f"?{query}" if query else ""), body, fixture, provider)
+            content_type = CONTENT_TYPES.get(Path(fixture).suffix, "application/octet-stream")
+            self.reply(200, self.server.fixture(fixture), content_type, provider)
+
+      def reply_chat(self, request: Dict):
+            completion, chunks = chat_completion(request)
+            if not request.get("stream"):
+                  return self.reply(200, json.dumps(completion).encode(), "application/json", "llm")
+            events = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            self.reply(200, events.encode(), "text/event-stream", "llm")
+
+      def reply_recorded(self, url: str, body: bytes, fixture: str, provider: str):
+            import requests
+
+            headers = {name: self.headers[name] for name in RECORD_HEADERS if self.headers.get(name)}
+            response = requests.request(self.command, url, data=body or None, headers=headers, timeout=30)
+            if response.ok:
+                  (FIXTURES / fixture).write_bytes(response.content)
+            self.reply(response.status_code, response.content, response.headers.get("Content-Type", ""), provider)
+
+      def reply(self, status: int, payload: bytes, content_type: str, provider: str, headers: Optional[Dict[str, str]] = None):
+            self.server.count(provider, status)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                  self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+
+def start_stub(port: int = 0, faults: Optional[Dict[str, Faults]] = None, record: bool = False) -> StubServer:
+      """Serve the stub from a background thread; port 0 picks a free port."""
+      server = StubServer(("127.0.0.1", port), faults, record)
+      threading.Thread(target=server.serve_forever, name="stub-upstream", daemon=True).start()
+      return server
+
+
+def main():
+      parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+      parser.add_argument("--port", type=int, default=8900)
+      parser.add_argument("--record", action="store_true", help="Forward to the live services and refresh the fixtures")
+      add_fault_arguments(parser)
+      args = parser.parse_args()
+
+      server = StubServer(("127.0.0.1", args.port), parse_faults(args), args.record)
+      print(f"HTTP_UPSTREAM_OVERRIDE={server.url}")
+      print(f"AZURE_OPENAI_ENDPOINT={server.url}", flush=True)
+      try:
+            server.serve_forever()
+      except KeyboardInterrupt:
+            pass
+      finally:
+            print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == "__main__":
+      main()
@@ -0,0 +1,129 @@
+"""Prompt token budgeting and evidence compaction.
+
+Research tools ask :func:`evidence_budget` how many tokens of evidence fit
+next to their fixed prompt and completion, split that budget across sources
+with :func:`allocate`, and fill it with :func:`pack`, which drops
+near-duplicate snippets and keeps the most relevant ones.
+"""
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from tokens import TOKENIZER_MODEL, count_tokens, truncate_tokens
+
+# Context windows of Azure OpenAI model families, matched by longest prefix
+CONTEXT_WINDOWS = {
+      "gpt-4.1": 1047576,
+      "gpt-4o": 128000,
+      "gpt-4-turbo": 128000,
+      "gpt-4-32k": 32768,
+      "gpt-4": 8192,
+      "gpt-35-turbo-16k": 16384,
+      "gpt-35-turbo": 16385,
+      "o1": 200000,
+      "o3": 200000,
+      "o4-mini": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+EVIDENCE_MAX_TOKENS = int(os.getenv("EVIDENCE_MAX_TOKENS", "6000"))
+PROMPT_SAFETY_MARGIN = 256
+
+
+def context_window(model: str = TOKENIZER_MODEL) -> int:
+      override = os.getenv("MODEL_CONTEXT_WINDOW")
+      if override:
+            return int(override)
+      matches = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+      return CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+def evidence_budget(fixed_prompt: str, completion_tokens: int, model: str = TOKENIZER_MODEL,
+                    cap: int = EVIDENCE_MAX_TOKENS) -> int:
+      """Tokens left for evidence after the fixed prompt text and the completion.
+
+      The result never exceeds ``cap``, so a large context window is not
+      filled just because it exists.
+      """
+      available = context_window(model) - count_tokens(fixed_prompt, model) - completion_tokens - PROMPT_SAFETY_MARGIN
+      return max(0, min(cap, available))
+
+
+def allocate(total: int, weights: Dict[str, float]) -> Dict[str, int]:
+      """Split ``total`` tokens across sources in proportion to their weights."""
+      weight_sum = sum(weight for weight in weights.values() if weight > 0)
+      if not weight_sum:
+            return {source: 0 for source in weights}
+      return {source: int(total * max(weight, 0) / weight_sum) for source, weight in weights.items()}
+
+
+def shingles(text: str, size: int = 3) -> set:
+      words = re.findall(r"\w+", text.lower())
+      if len(words) <= size:
+            return {" ".join(words)} if words else set()
+      return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def is_near_duplicate(a: set, b: set, threshold: float = 0.8) -> bool:
+      """Jaccard similarity of two shingle sets is at least ``threshold``."""
+      if not a or not b:
+            return False
+      return len(a & b) / len(a | b) >= threshold
+
+
+def pack(items: List[Dict[str, Any]], budget: int, render: Callable[[Dict[str, Any]], str],
+         quotas: Optional[Dict[str, int]] = None, content: Optional[Callable[[Dict[str, Any]], str]] = None,
+         model: str = TOKENIZER_MODEL, min_tokens: int = 32) -> List[str]:
+      """Render the most relevant distinct items that fit in ``budget`` tokens.
+
+      Items are taken in descending ``score`` order; near-duplicates of an
+      already chosen item are skipped. With ``quotas`` each ``source`` first
+      gets up to its own share, then leftover budget goes to the best
+      remaining items regardless of source. The first item that does not fit
+      is truncated when at least ``min_tokens`` remain.
+
+      Args:
+            items: Dicts with ``score`` and optionally ``source``
+            budget: Total tokens available
+            render: Turns an item into its prompt text
+            quotas: Per-source token shares, e.g. from :func:`allocate`
+            content: The part of an item compared for near-duplicates; defaults to ``render``
+            model: Tokenizer model
+            min_tokens: Smallest useful truncated entry
+      """
+      ranked = sorted(items, key=lambda item: item.get("score", 0), reverse=True)
+      candidates, seen = [], []
+      for item in ranked:
+            text = render(item)
+            fingerprint = shingles(content(item) if content else text)
+            if any(is_near_duplicate(fingerprint, other) for other in seen):
+                  continue
+            seen.append(fingerprint)
+            candidates.append((item, text, count_tokens(text, model)))
+
+      chosen: Dict[int, str] = {}
+      used = 0
+      spent: Dict[str, int] = {}
+
+      def take(index, text, cost):
+            nonlocal used
+            chosen[index] = text
+            used += cost
+            source = candidates[index][0].get("source", "")
+            spent[source] = spent.get(source, 0) + cost
+
+      if quotas:
+            for index, (item, text, cost) in enumerate(candidates):
+                  source = item.get("source", "")
+                  if used + cost <= budget and spent.get(source, 0) + cost <= quotas.get(source, 0):
+                        take(index, text, cost)
+      truncated = False
+      for index, (item, text, cost) in enumerate(candidates):
+            if index in chosen:
+                  continue
+            if used + cost <= budget:
+                  take(index, text, cost)
+            elif not truncated and budget - used >= min_tokens:
+                  truncated = True
+                  remaining = budget - used
+                  take(index, truncate_tokens(text, remaining - 1, model), remaining)
+      return [chosen[index] for index in sorted(chosen)]
@@ -0,0 +1,292 @@
+"""Result caching for the knowledge server tools.
+
+:class:`ResultCache` layers an in-memory LRU with per-entry TTLs over an
+optional persistent store (a SQLite file or a Redis-compatible server), so
+cached results survive server restarts, and it collapses concurrent misses
+for the same key into a single computation.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+      import redis
+except ImportError:
+      redis = None
+
+
+class _Abandoned(Exception):
+      """Handed to collapsed callers when the caller computing their value was cancelled."""
+
+
+class TTLCache:
+      """Thread-safe LRU mapping whose entries expire after their TTL."""
+
+      def __init__(self, max_entries: int = 1024):
+            self.max_entries = max(1, max_entries)
+            self.evictions = 0
+            self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+            self._lock = threading.Lock()
+
+      def get(self, key: str) -> Tuple[bool, Any]:
+            with self._lock:
+                  entry = self._data.get(key)
+                  if entry is None:
+                        return False, None
+                  expires_at, value = entry
+                  if expires_at <= time.time():
+                        del self._data[key]
+                        return False, None
+                  self._data.move_to_end(key)
+                  return True, value
+
+      def set(self, key: str, value: Any, ttl: float, expires_at: Optional[float] = None):
+            with self._lock:
+                  self._data[key] = (expires_at or time.time() + ttl, value)
+                  self._data.move_to_end(key)
+                  while len(self._data) > self.max_entries:
+                        self._data.popitem(last=False)
+                        self.evictions += 1
+
+      def clear(self):
+            with self._lock:
+                  self._data.clear()
+
+      def __len__(self) -> int:
+            return len(self._data)
+
+
+class SQLiteCache:
+      """On-disk cache tier storing JSON-encoded values with an expiry time."""
+
+      def __init__(self, path: str):
+            self.path = path
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                  "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._lock = threading.Lock()
+
+      def get(self, key: str) -> Tuple[bool, Any, float]:
+            with self._lock:
+                  row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= time.time():
+                  return False, None, 0.0
+            return True, json.loads(row[0]), row[1]
+
+      def set(self, key: str, value: Any, ttl: float):
+            with self._lock:
+                  self._conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), time.time() + ttl),
+                  )
+                  self._conn.commit()
+
+      def prune(self) -> int:
+            """Delete expired rows and return how many were removed."""
+            with self._lock:
+                  cursor = self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+                  self._conn.commit()
+                  return cursor.rowcount
+
+      def clear(self):
+            with self._lock:
+                  self._conn.execute("DELETE FROM cache")
+                  self._conn.commit()
+
+
+class RedisCache:
+      """Persistent cache tier on a Redis-compatible server.
+
+      Expiry is delegated to the server with ``SET ... EX``; keys are
+      namespaced with ``prefix`` so several caches can share one database.
+      """
+
+      def __init__(self, url: str, prefix: str = "cache:"):
+            if redis is None:
+                  raise RuntimeError("The redis package is required for the Redis cache backend")
+            self.prefix = prefix
+            self._client = redis.Redis.from_url(url)
+
+      def get(self, key: str) -> Tuple[bool, Any, float]:
+            pipeline = self._client.pipeline()
+            pipeline.get(self.prefix + key)
+            pipeline.pttl(self.prefix + key)
+            value, ttl_ms = pipeline.execute()
+            if value is None:
+                  return False, None, 0.0
+            return True, json.loads(value), time.time() + max(ttl_ms, 0) / 1000
+
+      def set(self, key: str, value: Any, ttl: float):
+            self._client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+      def prune(self) -> int:
+            return 0
+
+      def clear(self):
+            for key in self._client.scan_iter(match=self.prefix + "*"):
+                  self._client.delete(key)
+
+
+class ResultCache:
+      """Two-tier result cache with stampede protection and hit/miss counters.
+
+      Args:
+            max_entries: Size of the in-memory LRU tier
+            path: SQLite file for the persistent tier
+            store: Any persistent tier (``SQLiteCache``, ``RedisCache``); overrides ``path``
+
+      Without ``path`` or ``store`` the cache is memory-only.
+      """
+
+      def __init__(self, max_entries: int = 1024, path: Optional[str] = None, store=None):
+            self.memory = TTLCache(max_entries)
+            self.store = store if store is not None else (SQLiteCache(path) if path else None)
+            if self.store is not None:
+                  self.store.prune()
+            self._inflight: Dict[str, Future] = {}
+            self._async_inflight: Dict[str, asyncio.Future] = {}
+            self._lock = threading.Lock()
+            self._counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "collapsed": 0}
+
+      def _count(self, name: str):
+            with self._lock:
+                  self._counters[name] += 1
+
+      def _get_memory(self, key: str) -> Tuple[bool, Any]:
+            hit, value = self.memory.get(key)
+            if hit:
+                  self._count("memory_hits")
+            return hit, value
+
+      def _get_store(self, key: str) -> Tuple[bool, Any]:
+            if self.store is None:
+                  return False, None
+            hit, value, expires_at = self.store.get(key)
+            if hit:
+                  self.memory.set(key, value, 0, expires_at=expires_at)
+                  self._count("store_hits")
+            return hit, value
+
+      def get(self, key: str) -> Tuple[bool, Any]:
+            hit, value = self._get_memory(key)
+            if hit:
+                  return True, value
+            return self._get_store(key)
+
+      def set(self, key: str, value: Any, ttl: float):
+            self.memory.set(key, value, ttl)
+            if self.store is not None:
+                  self.store.set(key, value, ttl)
+
+      def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: float,
+                         cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+            """Return the cached value for ``key`` or compute and store it.
+
+            Concurrent callers missing on the same key wait for the first
+            caller's computation instead of repeating it. Exceptions are
+            propagated to every waiter and never cached.
+            """
+            hit, value = self.get(key)
+            if hit:
+                  return value
+
+            with self._lock:
+                  future = self._inflight.get(key)
+                  leader = future is None
+                  if leader:
+                        future = self._inflight[key] = Future()
+                        self._counters["misses"] += 1
+                  else:
+                        self._counters["collapsed"] += 1
+            if not leader:
+                  return future.result()
+
+            try:
+                  value = compute()
+                  if cacheable(value):
+                        self.set(key, value, ttl)
+                  future.set_result(value)
+                  return value
+            except BaseException as e:
+                  future.set_exception(e)
+                  raise
+            finally:
+                  with self._lock:
+                        self._inflight.pop(key, None)
+
+      async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: float,
+                                cacheable: Callable[[Any], bool] = lambda value: True,
+                                refresh: bool = False) -> Any:
+            """Async counterpart of :meth:`get_or_compute` for coroutine computations.
+
+            Persistent-store I/O runs in a worker thread. With ``refresh`` the
+            cached value is ignored and replaced by a fresh computation. If the
+            computing caller is cancelled, one of its waiters computes instead.
+            """
+            if not refresh:
+                  hit, value = self._get_memory(key)
+                  if not hit and self.store is not None:
+                        hit, value = await asyncio.to_thread(self._get_store, key)
+                  if hit:
+                        return value
+
+            while not refresh and key in self._async_inflight:
+                  self._count("collapsed")
+                  try:
+                        return await asyncio.shield(self._async_inflight[key])
+                  except _Abandoned:
+                        # The first waiter back here finds no computation left and takes it over
+                        pass
+            self._count("misses")
+            future = asyncio.get_running_loop().create_future()
+            if not refresh:
+                  self._async_inflight[key] = future
+
+            try:
+                  value = await compute()
+                  if cacheable(value):
+                        self.memory.set(key, value, ttl)
+                        if self.store is not None:
+                              await asyncio.to_thread(self.store.set, key, value, ttl)
+                  future.set_result(value)
+                  return value
+            except asyncio.CancelledError:
+                  # Waiters are other callers' requests: let them retry rather than cancel them too
+                  future.set_exception(_Abandoned())
+                  future.exception()
+                  raise
+            except Exception as e:
+                  future.set_exception(e)
+                  # Waiters receive the error; mark it retrieved for the leader
+                  future.exception()
+                  raise
+            finally:
+                  if self._async_inflight.get(key) is future:
+                        del self._async_inflight[key]
+
+      def stats(self) -> Dict[str, Any]:
+            with self._lock:
+                  stats = dict(self._counters)
+            hits = stats["memory_hits"] + stats["store_hits"]
+            lookups = hits + stats["misses"]
+            stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+            stats["entries"] = len(self.memory)
+            stats["evictions"] = self.memory.evictions
+            stats["persistent"] = self.store is not None
+            return stats
+
+      def clear(self):
+            self.memory.clear()
+            if self.store is not None:
+                  self.store.clear()
@@ -0,0 +1,262 @@
+"""Local BM25 index over fetched pages and search snippets.
+
+Documents are split into token-bounded chunks and scored with Okapi BM25.
+With a ``path`` the chunks are kept in SQLite and reloaded on start, so
+material gathered by earlier requests can be reused by later ones. Every
+write is also recorded in a change log in the same file. Before each search
+an index replays the changes made by other processes, so several server
+workers can share one index file.
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from tokens import count_tokens, split_text
+
+STOPWORDS = frozenset(
+      "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Change log entries kept for other processes to catch up from; one further behind reloads everything
+CHANGE_LOG_SIZE = 10000
+
+
+def terms(text: str) -> List[str]:
+      """Lower-cased word tokens of ``text`` without stopwords."""
+      return [term for term in re.findall(r"\w+", text.lower()) if term not in STOPWORDS]
+
+
+class DocumentIndex:
+      """Chunked BM25 index keyed by document URL.
+
+      Args:
+            path: SQLite file for persistence; memory-only when omitted
+            chunk_tokens: Maximum tokens per indexed chunk
+            max_documents: Oldest documents are evicted beyond this count
+      """
+
+      def __init__(self, path: Optional[str] = None, chunk_tokens: int = 200, max_documents: int = 5000):
+            self.chunk_tokens = chunk_tokens
+            self.max_documents = max_documents
+            self._lock = threading.RLock()
+            self._documents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+            self._chunks: Dict[int, Dict[str, Any]] = {}
+            self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+            self._total_length = 0
+            self._next_id = 1
+            self._seen_change = 0
+            self._conn = None
+            if path:
+                  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                  self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+                  self._conn.execute("PRAGMA journal_mode=WAL")
+                  self._conn.execute(
+                        "CREATE TABLE IF NOT EXISTS documents (url TEXT PRIMARY KEY, title TEXT, source TEXT, added_at REAL)"
+                  )
+                  self._conn.execute(
+                        "CREATE TABLE IF NOT EXISTS chunks (url TEXT, position INTEGER, text TEXT, PRIMARY KEY (url, position))"
+                  )
+                  self._conn.execute("CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT)")
+                  self._conn.commit()
+                  self._load()
+
+      def _load(self):
+            self._seen_change = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+            rows = self._conn.execute("SELECT url, title, source, added_at FROM documents ORDER BY added_at").fetchall()
+            chunk_rows = defaultdict(list)
+            for url, position, text in self._conn.execute("SELECT url, position, text FROM chunks ORDER BY url, position"):
+                  chunk_rows[url].append(text)
+            for url, title, source, added_at in rows:
+                  self._insert(url, chunk_rows.get(url, []), title, source, added_at)
+
+      def _insert(self, url: str, chunks: List[str], title: str, source: str, added_at: float):
+            chunk_ids = []
+            for text in chunks:
+                  chunk_id = self._next_id
+                  self._next_id += 1
+                  counts = Counter(terms(f"{title} {text}"))
+                  length = sum(counts.values())
+                  self._chunks[chunk_id] = {"url": url, "title": title, "source": source, "text": text, "length": length}
+                  for term, frequency in counts.items():
+                        self._postings[term][chunk_id] = frequency
+                  self._total_length += length
+                  chunk_ids.append(chunk_id)
+            self._documents[url] = {"title": title, "source": source, "added_at": added_at, "chunks": chunk_ids}
+
+      def _load_document(self, url: str):
+            """Replace the in-memory copy of ``url`` with what the database holds, if anything."""
+            self._remove(url)
+            row = self._conn.execute("SELECT title, source, added_at FROM documents WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                  chunks = [text for (text,) in self._conn.execute("SELECT text FROM chunks WHERE url = ? ORDER BY position", (url,))]
+                  self._insert(url, chunks, *row)
+
+      def _sync(self):
+            """Apply the documents other processes added or evicted since the last sync."""
+            if self._conn is None:
+                  return
+            changes = self._conn.execute("SELECT id, url FROM changes WHERE id > ? ORDER BY id", (self._seen_change,)).fetchall()
+            if not changes:
+                  return
+            oldest = self._conn.execute("SELECT MIN(id) FROM changes").fetchone()[0]
+            if oldest > self._seen_change + 1:
+                  # Some changes were pruned before this index saw them
+                  self._documents.clear()
+                  self._chunks.clear()
+                  self._postings.clear()
+                  self._total_length = 0
+                  self._load()
+            else:
+                  for url in dict.fromkeys(url for _, url in changes):
+                        self._load_document(url)
+                  self._seen_change = changes[-1][0]
+            self._evict()
+
+      def _store(self, url: str, chunks: List[str], title: str, source: str):
+            """Put ``url`` in memory as the newest document; returns its time and the URLs evicted for it."""
+            self._remove(url)
+            added_at = time.time()
+            self._insert(url, chunks, title, source, added_at)
+            return added_at, self._evict()
+
+      def _evict(self) -> List[str]:
+            evicted = []
+            while len(self._documents) > self.max_documents:
+                  oldest = next(iter(self._documents))
+                  self._remove(oldest)
+                  evicted.append(oldest)
+            return evicted
+
+      def _remove(self, url: str):
+            document = self._documents.pop(url, None)
+            if document is None:
+                  return
+            for chunk_id in document["chunks"]:
+                  chunk = self._chunks.pop(chunk_id)
+                  self._total_length -= chunk["length"]
+                  for term in set(terms(f"{chunk['title']} {chunk['text']}")):
+                        postings = self._postings.get(term)
+                        if postings is not None:
+                              postings.pop(chunk_id, None)
+                              if not postings:
+                                    del self._postings[term]
+
+      def add(self, url: str, text: str, title: str = "", source: str = "", replace: bool = True) -> bool:
+            """Index ``text`` under ``url``; returns False if nothing was added.
+
+            With ``replace=False`` an already indexed URL is left untouched,
+            which keeps full page text from being overwritten by a snippet.
+            """
+            text = text.strip()
+            if not url or not text:
+                  return False
+            chunks = split_text(text, self.chunk_tokens)
+            with self._lock:
+                  self._sync()
+                  if url in self._documents and not replace:
+                        return False
+                  if self._conn is None:
+                        self._store(url, chunks, title, source)
+                        return True
+                  # Hold the database's write lock from the last sync to the commit, so no other process's change is missed
+                  self._conn.execute("BEGIN IMMEDIATE")
+                  try:
+                        self._sync()
+                        if url in self._documents and not replace:
+                              self._conn.rollback()
+                              return False
+                        added_at, evicted = self._store(url, chunks, title, source)
+                        self._conn.executemany("DELETE FROM chunks WHERE url = ?", [(u,) for u in evicted + [url]])
+                        self._conn.executemany("DELETE FROM documents WHERE url = ?", [(u,) for u in evicted])
+                        self._conn.execute(
+                              "INSERT OR REPLACE INTO documents (url, title, source, added_at) VALUES (?, ?, ?, ?)",
+                              (url, title, source, added_at)
+                        )
+                        self._conn.executemany(
+                              "INSERT INTO chunks (url, position, text) VALUES (?, ?, ?)",
+                              [(url, position, chunk) for position, chunk in enumerate(chunks)]
+                        )
+                        self._conn.executemany("INSERT INTO changes (url) VALUES (?)", [(u,) for u in evicted + [url]])
+                        last_change = self._conn.execute("SELECT MAX(id) FROM changes").fetchone()[0]
+                        self._conn.execute("DELETE FROM changes WHERE id <= ?", (last_change - CHANGE_LOG_SIZE,))
+                        self._conn.commit()
+                  except BaseException:
+                        self._conn.rollback()
+                        raise
+                  self._seen_change = last_change
+            return True
+
+      def search(self, query: str, k: int = 5, token_budget: Optional[int] = None,
+                 sources: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+            """Return up to ``k`` chunks ranked by BM25 relevance to ``query``.
+
+            Args:
+                  query: Free-text query
+                  k: Maximum number of chunks
+                  token_budget: Stop adding chunks once their text would exceed this many tokens
+                  sources: Only consider chunks from these sources
+            """
+            query_terms = set(terms(query))
+            allowed = set(sources) if sources is not None else None
+            with self._lock:
+                  self._sync()
+                  if not self._chunks or not query_terms:
+                        return []
+                  total = len(self._chunks)
+                  average_length = self._total_length / total or 1
+                  scores: Dict[int, float] = defaultdict(float)
+                  for term in query_terms:
+                        postings = self._postings.get(term)
+                        if not postings:
+                              continue
+                        idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                        for chunk_id, frequency in postings.items():
+                              length = self._chunks[chunk_id]["length"]
+                              scores[chunk_id] += idf * frequency * (BM25_K1 + 1) / (
+                                    frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                              )
+                  ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+                  results, used = [], 0
+                  for chunk_id, score in ranked:
+                        chunk = self._chunks[chunk_id]
+                        if allowed is not None and chunk["source"] not in allowed:
+                              continue
+                        if token_budget is not None:
+                              cost = count_tokens(chunk["text"])
+                              if used + cost > token_budget:
+                                    continue
+                              used += cost
+                        results.append({
+                              "url": chunk["url"],
+                              "title": chunk["title"],
+                              "source": chunk["source"],
+                              "text": chunk["text"],
+                              "score": round(score, 4)
+                        })
+                        if len(results) >= k:
+                              break
+                  return results
+
+      def stats(self) -> Dict[str, Any]:
+            with self._lock:
+                  self._sync()
+                  return {
+                        "documents": len(self._documents),
+                        "chunks": len(self._chunks),
+                        "terms": len(self._postings),
+                        "persistent": self._conn is not None
+                  }
+
+
+def render_chunk(chunk: Dict[str, Any]) -> str:
+      """Render a retrieved chunk as prompt context with its source."""
+      return f"{chunk['title'] or chunk['url']}\nSource: {chunk['url']}\n{chunk['text']}"
@@ -0,0 +1,145 @@
+"""HTML to text extraction for fetched webpages.
+
+The fastest available parser backend is picked at import time: selectolax,
+then lxml (through BeautifulSoup), then Python's built-in ``html.parser``.
+Extraction prefers the page's main content (``<main>``, ``<article>`` or
+``role="main"``) and falls back to the whole body.
+
+Parsing is CPU-bound and holds the GIL, so with ``EXTRACT_PROCESSES`` set
+:func:`extract_page` runs it in a pool of worker processes instead, letting
+pages fetched concurrently be parsed on several cores.
+"""
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+try:
+      # selectolax 1.0 dropped the Modest backend (selectolax.parser); Lexbor parses the same API
+      from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+      try:
+            from selectolax.parser import HTMLParser
+      except ImportError:
+            HTMLParser = None
+
+try:
+      import lxml  # noqa: F401
+      BS4_FEATURES = "lxml"
+except ImportError:
+      BS4_FEATURES = "html.parser"
+
+BACKENDS = (["selectolax"] if HTMLParser is not None else []) + ["bs4-" + BS4_FEATURES]
+DEFAULT_BACKEND = BACKENDS[0]
+
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "header", "footer", "nav", "aside", "form"]
+MAIN_CONTENT_SELECTORS = ["main", "article", "[role=main]"]
+
+_SPACES = re.compile(r"[ \t\r\f\v\u00a0]+")
+
+# Worker processes for extract_page; 0 parses in the calling thread
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", "0"))
+# Smaller pages are parsed in the calling thread: shipping them to a worker costs more than it saves
+EXTRACT_OFFLOAD_MIN_BYTES = int(os.getenv("EXTRACT_OFFLOAD_MIN_BYTES", "32768"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def clean_text(text: str) -> str:
+      """Collapse runs of whitespace and drop empty lines."""
+      lines = (_SPACES.sub(" ", line).strip() for line in text.splitlines())
+      return "\n".join(line for line in lines if line)
+
+
+def _main_text_selectolax(html: str) -> str:
+      tree = HTMLParser(html)
+      tree.strip_tags(BOILERPLATE_TAGS)
+      for selector in MAIN_CONTENT_SELECTORS:
+            nodes = tree.css(selector)
+            if nodes:
+                  return "\n".join(node.text(separator="\n") for node in nodes)
+      root = tree.body or tree.root
+      return root.text(separator="\n") if root is not None else ""
+
+
+def _main_text_bs4(html: str, features: str) -> str:
+      from bs4 import BeautifulSoup
+
+      soup = BeautifulSoup(html, features)
+      for element in soup(BOILERPLATE_TAGS):
+            element.decompose()
+      for selector in MAIN_CONTENT_SELECTORS:
+            nodes = soup.select(selector)
+            if nodes:
+                  return "\n".join(node.get_text(separator="\n") for node in nodes)
+      root = soup.body or soup
+      return root.get_text(separator="\n")
+
+
+def extract_text(html: str, max_length: Optional[int] = None, backend: str = DEFAULT_BACKEND) -> str:
+      """Return the cleaned main-content text of ``html``.
+
+      Args:
+            html: Page markup
+            max_length: Truncate the text to this many characters, marking the cut
+            backend: One of ``BACKENDS``
+      """
+      if backend == "selectolax":
+            text = _main_text_selectolax(html)
+      elif backend.startswith("bs4-"):
+            text = _main_text_bs4(html, backend[len("bs4-"):])
+      else:
+            raise ValueError(f"Unknown extraction backend: {backend}")
+      text = clean_text(text)
+      if max_length is not None and len(text) > max_length:
+            text = text[:max_length] + "... [content truncated]"
+      return text
+
+
+def available_backends() -> List[str]:
+      """Every backend usable here, including the slower bs4 fallbacks."""
+      backends = list(BACKENDS)
+      if "bs4-html.parser" not in backends:
+            backends.append("bs4-html.parser")
+      return backends
+
+
+def process_pool() -> Optional[ProcessPoolExecutor]:
+      """The extraction process pool, started on first use; ``None`` when disabled."""
+      global _pool
+      if EXTRACT_PROCESSES <= 0:
+            return None
+      with _pool_lock:
+            if _pool is None:
+                  # Spawned rather than forked: the server process runs threads and an event loop
+                  _pool = ProcessPoolExecutor(EXTRACT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+            return _pool
+
+
+def extract_page(html: str, content_type: str = "text/html") -> str:
+      """Main text of a fetched page, parsed in the process pool when one is configured.
+
+      Blocks until the text is ready, so call it from a worker thread in async code.
+      """
+      if content_type == "text/plain":
+            return clean_text(html)
+      pool = process_pool() if len(html) >= EXTRACT_OFFLOAD_MIN_BYTES else None
+      if pool is not None:
+            try:
+                  return pool.submit(extract_text, html).result()
+            except BrokenProcessPool:
+                  # A worker died (e.g. out of memory); start a fresh pool next time
+                  shutdown_pool()
+      return extract_text(html)
+
+
+def shutdown_pool():
+      global _pool
+      with _pool_lock:
+            pool, _pool = _pool, None
+      if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,199 @@
+"""Shared, pooled HTTP sessions for the knowledge server tools.
+
+Every outbound call from ``server.py`` goes through :data:`http`, which keeps
+one ``requests.Session`` per API host so TCP/TLS connections to googleapis,
+serper.dev, Semantic Scholar, NCBI and arXiv are kept alive and reused.
+Fetched webpages share a single session that keeps connections only to the
+``HTTP_MAX_HOSTS`` most recently used sites.
+Calls to those APIs also pass through the provider's rate limiter from
+:mod:`ratelimit`, and so does every retry of them; a 429 from a provider
+raises ``ratelimit.ProviderUnavailable`` so the caller can switch providers.
+``requests`` is imported when the first session is opened.
+"""
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from ratelimit import ProviderLimiter, ProviderUnavailable, QuotaExceeded, limiter_for_host, note_queued
+from telemetry import span
+
+if TYPE_CHECKING:
+      import requests
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+# Other sites whose connections the shared webpage session keeps open; older ones are closed
+MAX_HOSTS = int(os.getenv("HTTP_MAX_HOSTS", "32"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+SERVER_ERROR_STATUSES = (500, 502, 503, 504)
+RETRY_STATUSES = (429,) + SERVER_ERROR_STATUSES
+# Send every request to <base>/<scheme>/<host><path> instead; the offline benchmarks point this at their stub server
+UPSTREAM_OVERRIDE = os.getenv("HTTP_UPSTREAM_OVERRIDE")
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+class HttpClient:
+      """Per-API-host ``requests`` sessions with keep-alive, timeouts and retries.
+
+      Hosts without a rate limiter share one session instead.
+
+      Args:
+            timeout: Default ``(connect, read)`` timeout applied when a call passes none
+            pool_maxsize: Connections kept open per host
+            max_hosts: Hosts the shared session keeps connections to, least recently used dropped first
+            max_retries: Retries on connection errors and 429/5xx responses; for rate limited
+                  hosts 5xx responses are retried through the limiter and 429s are not retried
+            backoff_factor: Exponential backoff base between retries
+            limiter_for: Returns the rate limiter for a host, or ``None`` for unlimited hosts
+            upstream_override: Base URL that receives every request in place of the real host
+      """
+
+      def __init__(self, timeout: Tuple[float, float] = (CONNECT_TIMEOUT, READ_TIMEOUT),
+                   pool_maxsize: int = POOL_MAXSIZE, max_hosts: int = MAX_HOSTS, max_retries: int = MAX_RETRIES,
+                   backoff_factor: float = RETRY_BACKOFF,
+                   limiter_for: Callable[[str], Optional[ProviderLimiter]] = limiter_for_host,
+                   upstream_override: Optional[str] = UPSTREAM_OVERRIDE):
+            self.timeout = timeout
+            self.limiter_for = limiter_for
+            self.upstream_override = upstream_override.rstrip("/") if upstream_override else None
+            self.pool_maxsize = pool_maxsize
+            self.max_hosts = max_hosts
+            self.max_retries = max_retries
+            self.backoff_factor = backoff_factor
+            self._sessions: Dict[str, "requests.Session"] = {}
+            self._lock = threading.Lock()
+
+      def _new_session(self, limited: bool = False) -> "requests.Session":
+            """A session retrying connection errors, and 429/5xx responses unless ``limited``.
+
+            Responses from rate limited hosts are retried by :meth:`request`,
+            through the limiter, which also honours their Retry-After.
+            """
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                  total=self.max_retries,
+                  backoff_factor=self.backoff_factor,
+                  status_forcelist=() if limited else RETRY_STATUSES,
+                  allowed_methods=None,  # search POSTs (Serper) are safe to retry
+                  respect_retry_after_header=not limited,
+                  raise_on_status=False,
+            )
+            # One connection pool for an API host's session; the shared session keeps the
+            # most recently used max_hosts pools and closes the others
+            hosts = 1 if limited else max(1, self.max_hosts)
+            adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=self.pool_maxsize, max_retries=retry)
+            session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            return session
+
+      def session_for(self, url: str) -> "requests.Session":
+            """Return the session of ``url``'s API host, or the one shared by every other host."""
+            parts = urlsplit(url)
+            limited = self.limiter_for(parts.netloc) is not None
+            key = f"{parts.scheme}://{parts.netloc}" if limited else ""
+            session = self._sessions.get(key)
+            if session is None:
+                  with self._lock:
+                        session = self._sessions.get(key)
+                        if session is None:
+                              session = self._sessions[key] = self._new_session(limited)
+            return session
+
+      def _send_limited(self, limiter: ProviderLimiter, session: "requests.Session", method: str, url: str,
+                        current, **kwargs: Any) -> "requests.Response":
+            """Send to a rate limited host, taking a token and a quota unit for every attempt."""
+            waited = 0.0
+            attempts = 0
+            while True:
+                  started = time.perf_counter()
+                  try:
+                        limiter.acquire()
+                  except ProviderUnavailable:
+                        if not attempts:
+                              raise
+                        # No time or quota left for another try; report the last answer
+                        break
+                  waited += time.perf_counter() - started
+                  response = session.request(method, url, **kwargs)
+                  attempts += 1
+                  if response.status_code not in SERVER_ERROR_STATUSES or attempts > self.max_retries:
+                        break
+                  backoff = self.backoff_factor * 2 ** (attempts - 1)
+                  note_queued(backoff)
+                  time.sleep(backoff)
+            current.set_attribute("rate_limit_wait_ms", round(waited * 1000, 1))
+            current.set_attribute("attempts", attempts)
+            if response.status_code == 429:
+                  current.set_attribute("status_code", 429)
+                  # Slow every caller down and let this one switch to another provider
+                  retry_after = response.headers.get("Retry-After", "")
+                  limiter.throttled(float(retry_after) if retry_after.isdigit() else None)
+                  if "per day" in response.text.lower():
+                        limiter.quota.exhaust()
+                        raise QuotaExceeded(f"{limiter.name} reports its daily quota used up")
+                  raise ProviderUnavailable(f"{limiter.name} is rate limiting requests (429)")
+            return response
+
+      def request(self, method: str, url: str, **kwargs: Any) -> "requests.Response":
+            """Send a request, first waiting for the host's rate limiter if it has one.
+
+            Raises ``ratelimit.ProviderUnavailable`` when the provider's quota
+            is spent, its queue is too long or it answered 429.
+            """
+            kwargs.setdefault("timeout", self.timeout)
+            parts = urlsplit(url)
+            limiter = self.limiter_for(parts.netloc)
+            session = self.session_for(url)
+            if self.upstream_override:
+                  url = f"{self.upstream_override}/{parts.scheme}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+            # Span names label the duration histogram, so they name the provider, never the arbitrary host
+            name = f"http {limiter.name}" if limiter is not None else f"http {method}"
+            with span(name, method=method, host=parts.netloc, path=parts.path) as current:
+                  if limiter is not None:
+                        response = self._send_limited(limiter, session, method, url, current, **kwargs)
+                  else:
+                        response = session.request(method, url, **kwargs)
+                  current.set_attribute("status_code", response.status_code)
+                  if response.status_code >= 400:
+                        current.status = "error"
+                  return response
+
+      def get(self, url: str, **kwargs: Any) -> "requests.Response":
+            return self.request("GET", url, **kwargs)
+
+      def post(self, url: str, **kwargs: Any) -> "requests.Response":
+            return self.request("POST", url, **kwargs)
+
+      def stats(self) -> Dict[str, Dict[str, int]]:
+            """Connection pool statistics per host."""
+            stats = {}
+            for session in list(self._sessions.values()):
+                  pools = session.get_adapter("https://").poolmanager.pools
+                  for pool_key in pools.keys():
+                        pool = pools[pool_key]
+                        stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                              "connections_opened": pool.num_connections,
+                              "requests": pool.num_requests,
+                              "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+                              "max_connections": self.pool_maxsize,
+                        }
+            return stats
+
+      def close(self):
+            with self._lock:
+                  sessions, self._sessions = self._sessions, {}
+            for session in sessions.values():
+                  session.close()
+
+
+http = HttpClient()
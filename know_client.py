@@ -1,59 +1,441 @@
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from langchain_mcp_adapters.tools import load_mcp_tools
-from langgraph.prebuilt import create_react_agent
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+import anyio
 import asyncio
-from langchain_openai import AzureChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from collections import OrderedDict
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
+from typing import List, Optional
+import logging
 import sys
 import os
+import time
+import uuid
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 load_dotenv()
 
+from memory import MEMORY_SUMMARY_TOKENS, SESSION_MAX_SESSIONS, ConversationMemory, make_session_store
+from telemetry import registry, span, start_span
+
 AZURE_API_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_DEPLOYMENT_NAME = os.getenv("AZURE_DEPLOYMENT_NAME", "gpt-4o")
-llm = AzureChatOpenAI(
-      azure_endpoint=AZURE_ENDPOINT,
-      api_key=AZURE_API_KEY,  
-      azure_deployment=AZURE_DEPLOYMENT_NAME,
-      api_version="2024-12-01-preview"
-)
+
+@lru_cache(maxsize=None)
+def get_llm():
+      """The agent's chat model, created on first use; langchain_openai and openai load slowly."""
+      from langchain_openai import AzureChatOpenAI
+
+      return AzureChatOpenAI(
+            azure_endpoint=AZURE_ENDPOINT,
+            api_key=AZURE_API_KEY,
+            azure_deployment=AZURE_DEPLOYMENT_NAME,
+            api_version="2024-12-01-preview"
+      )
+
+POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "4"))
+# Processes running a pool each, e.g. the app's hypercorn --workers; they inherit this
+# setting, so all their server processes together stay within the provider limits
+APP_WORKERS = int(os.getenv("APP_WORKERS", "1"))
 
 # Update this line to point to your enhanced knowledge server
 server_params = StdioServerParameters(
       command="python3",
-      args=["server.py"]  # Changed from knowledge_server.py
+      args=["server.py"],  # Changed from knowledge_server.py
+      # Pass API keys and tracing settings through to the server process; the pooled
+      # processes of every app worker split the provider rate limits and daily quotas between them
+      env=dict(os.environ, RATE_LIMIT_SHARE=str(
+            float(os.getenv("RATE_LIMIT_SHARE", "1")) / (max(1, POOL_SIZE) * max(1, APP_WORKERS))
+      ))
       )
 
-async def run_agent(query, chat_history=None):
+# Shared networked server, e.g. http://localhost:8000/mcp (or .../sse); each
+# pooled session spawns its own server.py over stdio when this is unset
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL")
+
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_POOL_HEALTH_CHECK_INTERVAL", "30"))
+POOL_PING_TIMEOUT = float(os.getenv("MCP_POOL_PING_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+agent_tokens = registry.counter("agent_tokens", "Azure OpenAI tokens used by the agent's own reasoning", ("type",))
+
+
+class AgentTracer(BaseCallbackHandler):
+      """LangChain callbacks recording the agent's LLM and tool calls as spans."""
+
+      run_inline = True
+
+      def __init__(self, parent=None):
+            self.parent = parent
+            self.spans = {}
+
+      def _start(self, run_id, name, **attributes):
+            self.spans[run_id] = start_span(name, parent=self.parent, **attributes)
+
+      def _end(self, run_id, error=None):
+            current = self.spans.pop(run_id, None)
+            if current is not None:
+                  if error is not None:
+                        current.record_exception(error)
+                  current.end()
+
+      def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._start(run_id, "agent llm", messages=sum(len(batch) for batch in messages))
+
+      def on_llm_end(self, response, *, run_id, **kwargs):
+            current = self.spans.get(run_id)
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            for kind in ("prompt_tokens", "completion_tokens"):
+                  count = usage.get(kind) or 0
+                  agent_tokens.inc(kind.split("_")[0], amount=count)
+                  if current is not None:
+                        current.set_attribute(f"llm.{kind}", count)
+            self._end(run_id)
+
+      def on_llm_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error)
+
+      def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self._start(run_id, f"agent tool {(serialized or {}).get('name') or kwargs.get('name', 'unknown')}")
+
+      def on_tool_end(self, output, *, run_id, **kwargs):
+            self._end(run_id)
+
+      def on_tool_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error)
+
+
+@asynccontextmanager
+async def connect(params: StdioServerParameters, url: Optional[str] = MCP_SERVER_URL):
+      """Read and write streams to the MCP server at ``url``, or to a new stdio server process."""
+      if not url:
+            async with stdio_client(params) as (read, write):
+                  yield read, write
+      elif urlsplit(url).path.rstrip("/").endswith("/sse"):
+            from mcp.client.sse import sse_client
+
+            async with sse_client(url) as (read, write):
+                  yield read, write
+      else:
+            from mcp.client.streamable_http import streamable_http_client
+
+            async with streamable_http_client(url) as (read, write, _):
+                  yield read, write
+
+
+def connection_lost(error: Optional[BaseException]) -> bool:
+      """True if ``error``, or an error it was raised from, means the MCP server connection is gone."""
+      while error is not None:
+            if isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, ConnectionError)):
+                  return True
+            if isinstance(error, McpError) and error.error.code == CONNECTION_CLOSED:
+                  return True
+            error = error.__cause__
+      return False
+
+
+class PooledSession:
+      """A long-lived server.py subprocess with an initialized session.
+
+      The MCP tool schemas and the ReAct agent graph are built once when the
+      session starts and reused for every query it serves.
+      """
+
+      def __init__(self, params: StdioServerParameters):
+            self.params = params
+            self.session: Optional[ClientSession] = None
+            self.tools = None
+            self.agent = None
+            self.last_used = 0.0
+            self.lost = False
+            self._closing = asyncio.Event()
+            self._task: Optional[asyncio.Task] = None
+
+      async def start(self):
+            """Spawn the server and wait until its tools and agent are ready."""
+            ready = asyncio.get_running_loop().create_future()
+            with span("mcp session_start"):
+                  self._task = asyncio.create_task(self._run(ready))
+                  await ready
+            self.last_used = time.monotonic()
+            return self
+
+      async def _run(self, ready):
+            # The transport must be entered and exited from the same task,
+            # so the whole session lifetime lives inside this coroutine.
+            try:
+                  from langchain_mcp_adapters.tools import load_mcp_tools
+                  from langgraph.prebuilt import create_react_agent
+
+                  async with connect(self.params) as (read, write):
+                        # The server's messages go through a relay so the end of the
+                        # transport (e.g. the server process died) marks this session lost
+                        relay_send, relay_read = anyio.create_memory_object_stream(0)
+                        async with anyio.create_task_group() as relay:
+                              relay.start_soon(self._relay, read, relay_send)
+                              async with ClientSession(relay_read, write) as session:
+                                    await session.initialize()
+                                    self.tools = await load_mcp_tools(session)
+                                    self.agent = create_react_agent(get_llm(), self.tools)
+                                    self.session = session
+                                    ready.set_result(True)
+                                    await self._closing.wait()
+                              relay.cancel_scope.cancel()
+            except Exception as e:
+                  if not ready.done():
+                        ready.set_exception(e)
+                  else:
+                        logger.warning("MCP session terminated: %s", e)
+            finally:
+                  self.session = None
+                  if not ready.done():
+                        ready.cancel()
+
+      async def _relay(self, read, relay_send):
+            with suppress(anyio.BrokenResourceError, anyio.ClosedResourceError):
+                  async with relay_send:
+                        async for message in read:
+                              await relay_send.send(message)
+            # The session itself is torn down by close(), once the pool takes the
+            # worker back, so a call still waiting gets its "connection closed" error
+            if not self._closing.is_set():
+                  logger.warning("MCP server connection closed")
+                  self.lost = True
+
+      @property
+      def alive(self) -> bool:
+            return (self.session is not None and not self.lost and not self._closing.is_set()
+                    and self._task is not None and not self._task.done())
+
+      async def ping(self, timeout: float = POOL_PING_TIMEOUT) -> bool:
+            """Return True if the server process still answers MCP pings."""
+            if not self.alive:
+                  return False
+            try:
+                  await asyncio.wait_for(self.session.send_ping(), timeout)
+                  return True
+            except Exception:
+                  return False
+
+      async def close(self):
+            self._closing.set()
+            if self._task is not None:
+                  with suppress(Exception, asyncio.CancelledError):
+                        await asyncio.wait_for(self._task, POOL_PING_TIMEOUT)
+
+
+class SessionPool:
+      """Bounded pool of initialized MCP sessions shared by all queries.
+
+      Sessions are started lazily, health-checked with a ping when they have
+      been idle for longer than ``health_check_interval`` and replaced when
+      their server process has died or a call lost its connection.
+      """
+
+      def __init__(self, params: StdioServerParameters, size: int = POOL_SIZE,
+                   health_check_interval: float = POOL_HEALTH_CHECK_INTERVAL):
+            self.params = params
+            self.size = max(1, size)
+            self.health_check_interval = health_check_interval
+            self._slots = asyncio.Semaphore(self.size)
+            self._idle: List[PooledSession] = []
+            self._workers: List[PooledSession] = []
+            self._closed = False
+            registry.gauge("mcp_sessions", "MCP server sessions by state", ("state",), lambda: {
+                  ("idle",): len(self._idle), ("live",): sum(worker.alive for worker in self._workers)
+            })
+
+      async def _checkout(self) -> PooledSession:
+            while self._idle:
+                  worker = self._idle.pop()
+                  idle_for = time.monotonic() - worker.last_used
+                  if worker.alive and (idle_for < self.health_check_interval or await worker.ping()):
+                        return worker
+                  logger.info("Replacing unhealthy MCP session")
+                  await worker.close()
+            worker = await PooledSession(self.params).start()
+            self._workers = [existing for existing in self._workers if existing.alive] + [worker]
+            return worker
+
+      async def _checkin(self, worker: PooledSession):
+            worker.last_used = time.monotonic()
+            if self._closed or not worker.alive:
+                  await worker.close()
+            else:
+                  self._idle.append(worker)
+
+      @asynccontextmanager
+      async def session(self):
+            """Borrow a ready session; it is returned to the pool on exit."""
+            if self._closed:
+                  raise RuntimeError("Session pool is closed")
+            # Covers waiting for a free slot and, when needed, starting a server
+            checkout = start_span("mcp session_checkout", idle=len(self._idle))
+            async with self._slots:
+                  try:
+                        worker = await self._checkout()
+                  except Exception as e:
+                        checkout.record_exception(e)
+                        raise
+                  finally:
+                        checkout.end()
+                  try:
+                        yield worker
+                  except BaseException as e:
+                        if connection_lost(e):
+                              logger.info("Dropping MCP session after a lost connection: %s", e)
+                              await worker.close()
+                        raise
+                  finally:
+                        await self._checkin(worker)
+
+      async def server_metrics(self) -> List[str]:
+            """Prometheus exports of every live server process in the pool."""
+            texts = []
+            for worker in [worker for worker in self._workers if worker.alive]:
+                  try:
+                        result = await asyncio.wait_for(worker.session.read_resource("metrics://prometheus"), POOL_PING_TIMEOUT)
+                        texts.extend(content.text for content in result.contents if hasattr(content, "text"))
+                  except Exception as e:
+                        logger.debug("Could not read server metrics: %s", e)
+            return texts
+
+      async def close(self):
+            """Shut down every idle server process."""
+            self._closed = True
+            idle, self._idle = self._idle, []
+            await asyncio.gather(*(worker.close() for worker in idle))
+
+
+pool = SessionPool(server_params)
+session_store = make_session_store()
+
+SUMMARY_PROMPT = (
+      "You maintain the running summary of a conversation between a user and a research assistant. "
+      "Merge the new turns into the current summary. Keep the user's goals and preferences, the facts "
+      "found and the sources (titles and URLs) that later questions may refer to; drop small talk and "
+      f"search mechanics. Reply with the updated summary only, in at most {MEMORY_SUMMARY_TOKENS * 3 // 4} words."
+)
+
+async def summarize_history(summary: str, transcript: str) -> str:
+      """Fold ``transcript`` into ``summary`` for :class:`memory.ConversationMemory`."""
+      reply = await get_llm().ainvoke([
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary:\n{summary or '(none yet)'}\n\nNew turns:\n{transcript}")
+      ])
+      return reply.content
+
+# Memories of recent sessions, kept so a summary still being written is finished before the next turn
+_memories: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+
+async def load_memory(session_id: str) -> ConversationMemory:
+      """The conversation memory saved under ``session_id``, or a new one."""
+      if session_store is None:
+            return ConversationMemory(session_id, summarize_history)
+      memory = _memories.pop(session_id, None) or ConversationMemory(session_id, summarize_history, session_store)
+      _memories[session_id] = memory
+      while len(_memories) > SESSION_MAX_SESSIONS:
+            _memories.popitem(last=False)
+      await memory.refresh()
+      return memory
+
+def tool_trace(messages) -> List[dict]:
+      """Tool calls made in ``messages`` (one agent run), with their inputs and outputs."""
+      inputs = {}
+      for message in messages:
+            for call in getattr(message, "tool_calls", None) or []:
+                  inputs[call["id"]] = call["args"]
+      return [
+            {"name": message.name, "input": inputs.get(message.tool_call_id, ""), "output": message.content}
+            for message in messages if isinstance(message, ToolMessage)
+      ]
+
+async def run_agent(query, chat_history=None, memory: Optional[ConversationMemory] = None):
       """
       Run the agent with the given query and optional chat history.
       
       Args:
             query: The user's question or request
             chat_history: List of previous messages in the conversation
+            memory: Conversation memory supplying the history; the turn is recorded in it
       
       Returns:
             The agent's response
       """
+      if memory is not None:
+            chat_history = await memory.history()
       if chat_history is None:
             chat_history = []
       
-      async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                  await session.initialize()
-                  tools = await load_mcp_tools(session)
-                  agent = create_react_agent(llm, tools)
-                  
+      with span("agent run", history_messages=len(chat_history)) as run:
+            async with pool.session() as worker:
                   # Construct messages from chat history and current query
                   messages = chat_history + [HumanMessage(content=query)]
                   
-                  agent_response = await agent.ainvoke({"messages": messages})
+                  agent_response = await worker.agent.ainvoke({"messages": messages}, config={"callbacks": [AgentTracer(run)]})
                   
                   # Get the last AI message
                   ai_message = agent_response["messages"][-1]
-                  return ai_message.content
+            if memory is not None:
+                  await memory.add_turn(query, ai_message.content, tool_trace(agent_response["messages"][len(messages):]))
+            return ai_message.content
+
+async def stream_agent(query, chat_history=None, memory: Optional[ConversationMemory] = None):
+      """
+      Run the agent and yield its progress as it happens.
+      
+      Args:
+            query: The user's question or request
+            chat_history: List of previous messages in the conversation
+            memory: Conversation memory supplying the history; the turn is recorded in it
+      
+      Yields:
+            Event dicts with a ``type`` of "tool_start", "tool_end", "token"
+            (a piece of LLM output) or "final" (the complete answer)
+      """
+      if memory is not None:
+            chat_history = await memory.history()
+      if chat_history is None:
+            chat_history = []
+      tools = []
+      
+      # Started by hand: a context-managed span cannot stay open across the yields below
+      run = start_span("agent run", history_messages=len(chat_history), streamed=True)
+      try:
+            async with pool.session() as worker:
+                  messages = chat_history + [HumanMessage(content=query)]
+                  
+                  events = worker.agent.astream_events({"messages": messages}, config={"callbacks": [AgentTracer(run)]}, version="v2")
+                  async for event in events:
+                        kind = event["event"]
+                        if kind == "on_chat_model_stream":
+                              content = event["data"]["chunk"].content
+                              if content:
+                                    yield {"type": "token", "content": content}
+                        elif kind == "on_tool_start":
+                              yield {"type": "tool_start", "name": event["name"], "input": event["data"].get("input")}
+                        elif kind == "on_tool_end":
+                              output = event["data"].get("output")
+                              output = getattr(output, "content", output)
+                              tools.append({"name": event["name"], "input": event["data"].get("input"), "output": output})
+                              yield {"type": "tool_end", "name": event["name"], "output": str(output)[:500]}
+                        elif kind == "on_chain_end" and not event.get("parent_ids"):
+                              # End of the top-level graph run carries the final state
+                              answer = event["data"]["output"]["messages"][-1].content
+                              if memory is not None:
+                                    await memory.add_turn(query, answer, tools)
+                              yield {"type": "final", "content": answer}
+      except Exception as e:
+            run.record_exception(e)
+            raise
+      finally:
+            run.end()
 
 async def interactive_chat():
       """Run an interactive chat session with the knowledge assistant."""
@@ -61,37 +443,38 @@ async def interactive_chat():
       print("Ask research questions or type 'exit' to quit.")
       print("=" * 50)
       
-      chat_history = []
+      # Set CHAT_SESSION_ID to resume a conversation kept in a persistent session store
+      session_id = os.getenv("CHAT_SESSION_ID") or uuid.uuid4().hex[:12]
+      memory = await load_memory(session_id)
+      if memory.turns or memory.summary:
+            print(f"Resuming session {session_id}.")
       
       while True:
-            # Get user input
-            user_input = input("\nYou: ").strip()
+            # Get user input; read in a thread so the memory can summarize in the meantime
+            user_input = (await asyncio.to_thread(input, "\nYou: ")).strip()
             
             if user_input.lower() in ['exit', 'quit', 'bye']:
                   print("\nKnowledge Assistant: Goodbye! Have a great day!")
                   break
             
             try:
-                  # Get response from agent
-                  response = await run_agent(user_input, chat_history)
+                  # Get response from agent; the memory supplies the history and records this turn
+                  response = await run_agent(user_input, memory=memory)
                   print(f"\nKnowledge Assistant: {response}")
                   
-                  # Update chat history
-                  chat_history.append(HumanMessage(content=user_input))
-                  chat_history.append(AIMessage(content=response))
-                  
-                  # Keep history manageable (optional)
-                  if len(chat_history) > 10:  # Keep last 5 turns
-                        chat_history = chat_history[-10:]
-                  
             except Exception as e:
                   print(f"\nError: {e}")
 
+async def main():
+      try:
+            if len(sys.argv) > 1:
+                  # Single question mode
+                  print(await run_agent(" ".join(sys.argv[1:])))
+            else:
+                  # Interactive mode
+                  await interactive_chat()
+      finally:
+            await pool.close()
+
 if __name__ == "__main__":
-      if len(sys.argv) > 1:
-            # Single question mode
-            result = asyncio.run(run_agent(" ".join(sys.argv[1:])))
-            print(result)
-      else:
-            # Interactive mode
-            asyncio.run(interactive_chat())
\ No newline at end of file
+      asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""Async Azure OpenAI access for the knowledge server tools.
+
+All completions go through :func:`complete`, which bounds the number of
+in-flight requests, retries rate-limited and transient failures (waiting as
+long as the service's ``retry-after`` header asks) and, when an MCP context is
+given, streams the answer back as progress notifications. Replies are cached
+by a hash of the request in memory, SQLite or a Redis-compatible server,
+selected with ``LLM_CACHE_BACKEND``.
+
+The ``openai`` package is imported, and the client built, on the first
+completion, so starting a server whose tools never call the LLM stays fast.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from cache import RedisCache, ResultCache, SQLiteCache
+from telemetry import current_span, registry, span
+
+AZURE_API_KEY = os.getenv("AZURE_OPENAI_KEY")
+AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_DEPLOYMENT_NAME = os.getenv("AZURE_DEPLOYMENT_NAME", "gpt-4o")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_PROGRESS_CHARS = int(os.getenv("LLM_PROGRESS_CHARS", "200"))
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")  # memory, sqlite, redis or off
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite"))
+LLM_CACHE_REDIS_URL = os.getenv("LLM_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+logger = logging.getLogger(__name__)
+
+llm_slots = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+llm_tokens = registry.counter("llm_tokens", "Azure OpenAI tokens used by server tools", ("type",))
+
+
+@lru_cache(maxsize=None)
+def get_llm():
+      """The shared Azure OpenAI client, created on first use."""
+      from openai import AsyncAzureOpenAI
+
+      # Retries are handled in complete() so that waiting never holds a concurrency slot
+      return AsyncAzureOpenAI(
+            azure_endpoint=AZURE_ENDPOINT,
+            api_key=AZURE_API_KEY,
+            azure_deployment=AZURE_DEPLOYMENT_NAME,
+            api_version="2024-12-01-preview",
+            max_retries=0,
+            timeout=LLM_TIMEOUT
+      )
+
+
+def record_usage(usage):
+      """Add a response's token usage to the current span and the token counter."""
+      if usage is None:
+            return
+      llm_span = current_span()
+      for kind in ("prompt_tokens", "completion_tokens"):
+            count = getattr(usage, kind, None) or 0
+            llm_tokens.inc(kind.split("_")[0], amount=count)
+            if llm_span is not None:
+                  llm_span.set_attribute(f"llm.{kind}", count)
+
+
+def make_completion_cache(backend: str = LLM_CACHE_BACKEND) -> Optional[ResultCache]:
+      """Build the completion cache for ``backend``; ``None`` disables caching."""
+      if backend == "off":
+            return None
+      if backend == "sqlite":
+            return ResultCache(LLM_CACHE_SIZE, store=SQLiteCache(LLM_CACHE_PATH))
+      if backend == "redis":
+            return ResultCache(LLM_CACHE_SIZE, store=RedisCache(LLM_CACHE_REDIS_URL, prefix="llm:"))
+      if backend == "memory":
+            return ResultCache(LLM_CACHE_SIZE)
+      raise ValueError(f"Unknown LLM_CACHE_BACKEND: {backend}")
+
+
+_completion_cache: Optional[ResultCache] = None
+_completion_cache_ready = False
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[ResultCache]:
+      """The completion cache, opened on first use; ``None`` when caching is off."""
+      global _completion_cache, _completion_cache_ready
+      with _completion_cache_lock:
+            if not _completion_cache_ready:
+                  _completion_cache = make_completion_cache()
+                  _completion_cache_ready = True
+            return _completion_cache
+
+
+def completion_key(request: Dict[str, Any]) -> str:
+      """Stable hash of the deployment, messages and sampling parameters."""
+      payload = json.dumps(
+            [request["model"], request["messages"], request["temperature"], request["max_tokens"]],
+            sort_keys=True, ensure_ascii=False
+      )
+      return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+      """Seconds to wait before retrying ``error``: the server's hint or exponential backoff."""
+      response = getattr(error, "response", None)
+      headers = response.headers if response is not None else {}
+      retry_after_ms = headers.get("retry-after-ms")
+      if retry_after_ms:
+            try:
+                  return float(retry_after_ms) / 1000
+            except ValueError:
+                  pass
+      retry_after = headers.get("retry-after")
+      if retry_after:
+            try:
+                  return float(retry_after)
+            except ValueError:
+                  try:
+                        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                  except (TypeError, ValueError):
+                        pass
+      return min(30.0, 0.5 * 2 ** attempt) + random.uniform(0, 0.25)
+
+
+def is_retryable(error: Exception) -> bool:
+      import openai
+
+      if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+      return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+async def _stream_completion(request: Dict[str, Any], ctx) -> str:
+      stream = await get_llm().chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+      parts: List[str] = []
+      pending = ""
+      async for chunk in stream:
+            # The last chunk carries the token usage and no choices
+            record_usage(getattr(chunk, "usage", None))
+            # Azure sends a leading chunk with content-filter results and no choices
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                  continue
+            delta = chunk.choices[0].delta.content
+            parts.append(delta)
+            pending += delta
+            if len(pending) >= LLM_PROGRESS_CHARS:
+                  await ctx.report_progress(sum(map(len, parts)), None, pending)
+                  pending = ""
+      if pending:
+            await ctx.report_progress(sum(map(len, parts)), None, pending)
+      return "".join(parts)
+
+
+async def _complete_uncached(request: Dict[str, Any], ctx) -> str:
+      for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                  async with llm_slots:
+                        if ctx is not None:
+                              return await _stream_completion(request, ctx)
+                        response = await get_llm().chat.completions.create(**request)
+                        record_usage(response.usage)
+                        return response.choices[0].message.content
+            except Exception as e:
+                  if attempt == LLM_MAX_RETRIES or not is_retryable(e):
+                        raise
+                  delay = retry_delay(e, attempt)
+                  logger.warning("Azure OpenAI call failed (%s), retrying in %.1fs", e, delay)
+                  await asyncio.sleep(delay)
+
+
+async def complete(messages: List[Dict[str, str]], temperature: float, max_tokens: int, ctx=None,
+                   bypass_cache: bool = False) -> str:
+      """Return the assistant reply for ``messages``.
+
+      Replies are served from the completion cache when an identical request
+      was answered before.
+
+      Args:
+            messages: Chat messages sent to the deployment
+            temperature: Sampling temperature
+            max_tokens: Completion token limit
+            ctx: Optional MCP ``Context``; when given the reply is streamed
+                  and partial output is sent as progress notifications
+            bypass_cache: Ignore any cached reply and replace it with a fresh one
+      """
+      request = {
+            "model": AZURE_DEPLOYMENT_NAME,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+      }
+      with span("llm chat", model=AZURE_DEPLOYMENT_NAME, max_tokens=max_tokens, streamed=ctx is not None) as llm_span:
+            completion_cache = get_completion_cache()
+            if completion_cache is None:
+                  return await _complete_uncached(request, ctx)
+
+            computed = False
+
+            async def compute():
+                  nonlocal computed
+                  computed = True
+                  return await _complete_uncached(request, ctx)
+
+            content = await completion_cache.aget_or_compute(
+                  completion_key(request), compute, ttl=LLM_CACHE_TTL,
+                  cacheable=bool, refresh=bypass_cache
+            )
+            llm_span.set_attribute("cache_hit", not computed)
+            if ctx is not None and not computed:
+                  await ctx.report_progress(len(content), None, content)
+            return content
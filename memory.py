@@ -0,0 +1,199 @@
+"""Token-budgeted conversation memory for the agent clients.
+
+A :class:`ConversationMemory` sends the most recent turns verbatim, newest
+first until ``MEMORY_RECENT_TOKENS`` is used, and folds every older turn,
+including the tool calls the agent made for it, into a running summary that
+is updated incrementally by an LLM. Summarizing happens in the background
+after a turn is recorded, so it overlaps with the user typing the next
+question instead of delaying the answer.
+
+Conversations are saved by session ID in a store selected with
+``SESSION_STORE_BACKEND``: ``memory`` (this process only), ``sqlite`` or
+``redis`` (shared by app workers and kept across restarts) or ``off``.
+"""
+import asyncio
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from cache import RedisCache, SQLiteCache, TTLCache
+from telemetry import span
+from tokens import count_tokens, truncate_tokens
+
+MEMORY_RECENT_TOKENS = int(os.getenv("MEMORY_RECENT_TOKENS", "2000"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))
+MEMORY_TOOL_OUTPUT_TOKENS = int(os.getenv("MEMORY_TOOL_OUTPUT_TOKENS", "150"))
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")  # memory, sqlite, redis or off
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", os.path.join(".cache", "sessions.sqlite"))
+SESSION_STORE_REDIS_URL = os.getenv("SESSION_STORE_REDIS_URL", "redis://localhost:6379/0")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+# Sessions untouched for this long are forgotten
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+logger = logging.getLogger(__name__)
+
+Summarizer = Callable[[str, str], Awaitable[str]]
+
+
+def make_session_store(backend: str = SESSION_STORE_BACKEND):
+      """Build the session store for ``backend``; ``None`` keeps no sessions."""
+      if backend == "off":
+            return None
+      if backend == "sqlite":
+            return SQLiteCache(SESSION_STORE_PATH)
+      if backend == "redis":
+            return RedisCache(SESSION_STORE_REDIS_URL, prefix="session:")
+      if backend == "memory":
+            return TTLCache(SESSION_MAX_SESSIONS)
+      raise ValueError(f"Unknown SESSION_STORE_BACKEND: {backend}")
+
+
+@dataclass
+class Turn:
+      """One question and answer, with the tool calls the agent made for it."""
+      user: str
+      answer: str
+      tools: List[Dict[str, str]] = field(default_factory=list)
+
+      def tokens(self) -> int:
+            return count_tokens(self.user) + count_tokens(self.answer)
+
+      def render(self) -> str:
+            lines = [f"User: {self.user}"]
+            lines.extend(f"Tool {tool['name']}({tool.get('input', '')}) returned: {tool.get('output', '')}" for tool in self.tools)
+            lines.append(f"Assistant: {self.answer}")
+            return "\n".join(lines)
+
+
+class ConversationMemory:
+      """Recent turns verbatim plus a running summary of everything older.
+
+      Args:
+            session_id: Key of the conversation in ``store``
+            summarize: Coroutine ``(summary, transcript) -> new summary``;
+                  without one, older turns are condensed by truncation
+            store: Session store from :func:`make_session_store`, or ``None``
+            recent_tokens: Budget for the turns sent verbatim
+            summary_tokens: Longest summary kept
+      """
+
+      def __init__(self, session_id: str = "", summarize: Optional[Summarizer] = None, store=None,
+                   recent_tokens: int = MEMORY_RECENT_TOKENS, summary_tokens: int = MEMORY_SUMMARY_TOKENS):
+            self.session_id = session_id
+            self.summarize = summarize
+            self.store = store
+            self.recent_tokens = recent_tokens
+            self.summary_tokens = summary_tokens
+            self.summary = ""
+            self.turns: List[Turn] = []
+            # Turns being folded into the summary by the background task
+            self._folding: List[Turn] = []
+            self._compaction: Optional[asyncio.Task] = None
+
+      @classmethod
+      async def load(cls, session_id: str, store=None, summarize: Optional[Summarizer] = None, **kwargs) -> "ConversationMemory":
+            """The saved conversation ``session_id``, or a new one."""
+            memory = cls(session_id, summarize, store, **kwargs)
+            await memory.refresh()
+            return memory
+
+      async def refresh(self):
+            """Finish any running summary, then reload the conversation from the store.
+
+            The store is the source of truth, so a memory object kept between
+            requests also sees turns that other app workers added.
+            """
+            if self._compaction is not None:
+                  await self._compaction
+            if self.store is None or not self.session_id:
+                  return
+            found, data = (await asyncio.to_thread(self.store.get, self.session_id))[:2]
+            if found:
+                  self.summary = data.get("summary", "")
+                  self.turns = [Turn(**turn) for turn in data.get("turns", [])]
+
+      def to_dict(self) -> Dict[str, Any]:
+            # Turns still being folded are saved as turns, so nothing is lost if the process stops first
+            return {"summary": self.summary, "turns": [asdict(turn) for turn in self._folding + self.turns]}
+
+      async def save(self):
+            if self.store is not None and self.session_id:
+                  await asyncio.to_thread(self.store.set, self.session_id, self.to_dict(), SESSION_TTL)
+
+      async def history(self) -> List[BaseMessage]:
+            """Messages to send ahead of the next query: the summary, then the recent turns."""
+            if self._compaction is not None:
+                  await self._compaction
+            messages: List[BaseMessage] = []
+            if self.summary:
+                  messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{self.summary}"))
+            overflow = sum(turn.tokens() for turn in self.turns) - self.recent_tokens
+            for turn in self.turns:
+                  answer = turn.answer
+                  if overflow > 0:
+                        # Only a lone newest turn can exceed the budget; shorten its answer
+                        answer = truncate_tokens(answer, max(1, count_tokens(answer) - overflow))
+                        overflow = 0
+                  messages.extend([HumanMessage(content=turn.user), AIMessage(content=answer)])
+            return messages
+
+      async def add_turn(self, user: str, answer: str, tools: Iterable[Dict[str, Any]] = ()):
+            """Record a finished turn and start summarizing the turns that no longer fit."""
+            if self._compaction is not None:
+                  await self._compaction
+            tools = [
+                  {"name": str(tool.get("name", "")), "input": str(tool.get("input", "")),
+                   "output": truncate_tokens(str(tool.get("output", "")), MEMORY_TOOL_OUTPUT_TOKENS)}
+                  for tool in tools
+            ]
+            self.turns.append(Turn(user, answer, tools))
+            keep = self._first_recent()
+            if keep:
+                  self._folding, self.turns = self.turns[:keep], self.turns[keep:]
+                  self._compaction = asyncio.create_task(self._compact())
+            await self.save()
+
+      async def clear(self):
+            if self._compaction is not None:
+                  await self._compaction
+            self.summary, self.turns = "", []
+            await self.save()
+
+      def _first_recent(self) -> int:
+            """Index of the oldest turn that still fits the verbatim budget; the newest always does."""
+            used = 0
+            for index in range(len(self.turns) - 1, -1, -1):
+                  used += self.turns[index].tokens()
+                  if used > self.recent_tokens and index < len(self.turns) - 1:
+                        return index + 1
+            return 0
+
+      async def _compact(self):
+            turns = self._folding
+            summary = None
+            with span("memory summarize", turns=len(turns)) as current:
+                  if self.summarize is not None:
+                        try:
+                              summary = await self.summarize(self.summary, "\n\n".join(turn.render() for turn in turns))
+                        except Exception as e:
+                              current.record_exception(e)
+                              logger.warning("Could not summarize the conversation, condensing it instead: %s", e)
+                  self.summary = truncate_tokens(summary.strip(), self.summary_tokens) if summary else self._condense(turns)
+                  current.set_attribute("summary_tokens", count_tokens(self.summary))
+            self._folding = []
+            self._compaction = None
+            try:
+                  await self.save()
+            except Exception as e:
+                  logger.warning("Could not save session %s: %s", self.session_id, e)
+
+      def _condense(self, turns: List[Turn]) -> str:
+            """Summary without an LLM: the previous one plus a line per turn, oldest lines dropped first."""
+            lines = [line for line in self.summary.splitlines() if line.strip()]
+            lines.extend(f"- Asked: {turn.user} Answered: {truncate_tokens(turn.answer, 60)}" for turn in turns)
+            while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_tokens:
+                  lines.pop(0)
+            return truncate_tokens("\n".join(lines), self.summary_tokens)
@@ -0,0 +1,244 @@
+"""Client-side rate limits and daily quotas for the external search APIs.
+
+Every provider gets a :class:`ProviderLimiter`: a token bucket for its
+request rate plus an optional daily request quota. The limiters are attached
+to the shared HTTP client by host, so all concurrent calls to one provider
+draw from the same bucket. A call that finds the bucket empty waits its turn
+instead of failing; only a call that would wait longer than ``max_wait``,
+or past the caller's :data:`call_deadline`, or that finds the day's quota
+used up, raises :class:`ProviderUnavailable` so the caller can switch to
+another provider.
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+# Pause applied after a 429 that carries no Retry-After header
+RATE_LIMIT_PENALTY = float(os.getenv("RATE_LIMIT_PENALTY", "5"))
+# Fraction of every provider's limits this process may use; server.py sets it to
+# 1/workers when several worker processes serve the HTTP transport, and
+# know_client.py to 1/(MCP_POOL_SIZE * APP_WORKERS) for its pools of stdio server processes
+RATE_LIMIT_SHARE = float(os.getenv("RATE_LIMIT_SHARE", "1"))
+
+# Requests per second, burst size and daily quota (0 = unlimited) per provider;
+# each can be overridden with <PROVIDER>_RPS, <PROVIDER>_BURST and <PROVIDER>_DAILY_QUOTA
+PROVIDER_DEFAULTS = {
+      "google": {"rps": 1.5, "burst": 5, "daily_quota": 100},
+      "serper": {"rps": 5, "burst": 10, "daily_quota": 0},
+      "semantic_scholar": {"rps": 1, "burst": 1, "daily_quota": 0},
+      "pubmed": {"rps": 10 if os.getenv("NCBI_API_KEY") else 3, "burst": 3, "daily_quota": 0},
+      "arxiv": {"rps": 1 / 3, "burst": 1, "daily_quota": 0},
+}
+PROVIDER_HOSTS = {
+      "www.googleapis.com": "google",
+      "google.serper.dev": "serper",
+      "api.semanticscholar.org": "semantic_scholar",
+      "eutils.ncbi.nlm.nih.gov": "pubmed",
+      "export.arxiv.org": "arxiv",
+}
+
+# time.monotonic() after which the caller stops waiting for the current call; it is
+# copied into worker threads started with asyncio.to_thread
+call_deadline: ContextVar[Optional[float]] = ContextVar("call_deadline", default=None)
+# Seconds the current provider call has spent waiting on our own limits rather than on the
+# provider; resilience.ProviderGuard sets a fresh total per call and leaves it out of the latency
+queued_seconds: ContextVar[Optional[List[float]]] = ContextVar("queued_seconds", default=None)
+
+
+def note_queued(seconds: float):
+      """Add ``seconds`` of local queueing to the current provider call's total."""
+      total = queued_seconds.get()
+      if total is not None:
+            total[0] += seconds
+
+
+class ProviderUnavailable(RuntimeError):
+      """The provider cannot take another request now; try a different one."""
+
+
+class QuotaExceeded(ProviderUnavailable):
+      """The provider's daily request quota is used up."""
+
+
+class TokenBucket:
+      """Thread-safe token bucket that hands out waiting times in arrival order.
+
+      Tokens refill at ``rate`` per second up to ``burst``. A caller that
+      finds the bucket empty takes a token on credit and sleeps until it would
+      have refilled, so queued callers are released one interval apart.
+      """
+
+      def __init__(self, rate: float, burst: int = 1):
+            self.rate = max(rate, 1e-6)
+            self.burst = max(1, burst)
+            self._tokens = float(self.burst)
+            self._updated = time.monotonic()
+            self._lock = threading.Lock()
+
+      def _refill(self, now: float):
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+      def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+            """Take a token and return how long to wait before using it.
+
+            Returns ``None`` (and takes nothing) if the wait would exceed ``max_wait``.
+            """
+            with self._lock:
+                  now = time.monotonic()
+                  self._refill(now)
+                  wait = max(0.0, (1 - self._tokens) / self.rate)
+                  if max_wait is not None and wait > max_wait:
+                        return None
+                  self._tokens -= 1
+                  return wait
+
+      def pause(self, seconds: float):
+            """Hand out no tokens for the next ``seconds``, e.g. after a 429 response."""
+            with self._lock:
+                  now = time.monotonic()
+                  self._refill(now)
+                  self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class DailyQuota:
+      """Requests allowed per UTC calendar day; ``limit`` 0 means unlimited."""
+
+      def __init__(self, limit: int = 0):
+            self.limit = limit
+            self._day = self._today()
+            self.used = 0
+            self._lock = threading.Lock()
+
+      @staticmethod
+      def _today() -> str:
+            return datetime.now(timezone.utc).date().isoformat()
+
+      def consume(self) -> bool:
+            """Count one request; False if today's quota is already used up."""
+            with self._lock:
+                  today = self._today()
+                  if today != self._day:
+                        self._day, self.used = today, 0
+                  if self.limit and self.used >= self.limit:
+                        return False
+                  self.used += 1
+                  return True
+
+      def refund(self):
+            """Give back a request counted by :meth:`consume` that was never sent."""
+            with self._lock:
+                  self.used = max(0, self.used - 1)
+
+      def exhaust(self):
+            """Treat the rest of the day as used, e.g. when the provider reports its quota spent."""
+            with self._lock:
+                  self.used = max(self.used, self.limit)
+
+      def remaining(self) -> Optional[int]:
+            with self._lock:
+                  if self._today() != self._day:
+                        return self.limit or None
+                  return max(0, self.limit - self.used) if self.limit else None
+
+
+class ProviderLimiter:
+      """Rate limit plus daily quota for one provider.
+
+      Args:
+            name: Provider name used in errors and stats
+            rps: Sustained requests per second
+            burst: Requests allowed back to back before pacing starts
+            daily_quota: Requests per UTC day; 0 for no quota
+            max_wait: Longest a call queues for a token before giving up
+      """
+
+      def __init__(self, name: str, rps: float, burst: int = 1, daily_quota: int = 0,
+                   max_wait: float = RATE_LIMIT_MAX_WAIT):
+            self.name = name
+            self.bucket = TokenBucket(rps, burst)
+            self.quota = DailyQuota(daily_quota)
+            self.max_wait = max_wait
+            self._lock = threading.Lock()
+            self._counters = {"requests": 0, "waited": 0, "wait_seconds": 0.0, "rejected": 0, "throttled": 0}
+            # Callers sleeping for their token right now; a pause after a 429 is not a queue
+            self._waiting = 0
+
+      @classmethod
+      def from_env(cls, name: str, share: float = RATE_LIMIT_SHARE) -> "ProviderLimiter":
+            defaults = PROVIDER_DEFAULTS[name]
+            prefix = name.upper()
+            daily_quota = int(os.getenv(f"{prefix}_DAILY_QUOTA", str(defaults["daily_quota"])))
+            return cls(
+                  name,
+                  rps=float(os.getenv(f"{prefix}_RPS", str(defaults["rps"]))) * share,
+                  burst=max(1, round(int(os.getenv(f"{prefix}_BURST", str(defaults["burst"]))) * share)),
+                  daily_quota=max(1, int(daily_quota * share)) if daily_quota else 0
+            )
+
+      def _count(self, name: str, amount: float = 1):
+            with self._lock:
+                  self._counters[name] += amount
+
+      def acquire(self):
+            """Block until a request to this provider may be sent.
+
+            Raises:
+                  QuotaExceeded: The daily quota is used up
+                  ProviderUnavailable: The queue is longer than ``max_wait`` or
+                        than the time left before :data:`call_deadline`
+            """
+            max_wait = self.max_wait
+            deadline = call_deadline.get()
+            if deadline is not None:
+                  max_wait = min(max_wait, deadline - time.monotonic())
+            if max_wait < 0:
+                  self._count("rejected")
+                  raise ProviderUnavailable(f"{self.name} call ran out of time before it could be sent")
+            if not self.quota.consume():
+                  self._count("rejected")
+                  raise QuotaExceeded(f"{self.name} daily quota of {self.quota.limit} requests exhausted")
+            wait = self.bucket.reserve(max_wait)
+            if wait is None:
+                  self.quota.refund()
+                  self._count("rejected")
+                  raise ProviderUnavailable(f"{self.name} rate limit queue is longer than {max_wait:g}s")
+            self._count("requests")
+            if wait > 0:
+                  self._count("waited")
+                  self._count("wait_seconds", wait)
+                  note_queued(wait)
+                  with self._lock:
+                        self._waiting += 1
+                  try:
+                        time.sleep(wait)
+                  finally:
+                        with self._lock:
+                              self._waiting -= 1
+
+      def throttled(self, retry_after: Optional[float] = None):
+            """Record a 429 from the provider and pause further requests."""
+            self._count("throttled")
+            self.bucket.pause(retry_after if retry_after is not None else RATE_LIMIT_PENALTY)
+
+      def stats(self) -> Dict[str, Any]:
+            with self._lock:
+                  stats = dict(self._counters)
+                  stats["queued"] = self._waiting
+            stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+            stats["rps"] = round(self.bucket.rate, 4)
+            stats["daily_quota"] = self.quota.limit or None
+            stats["quota_remaining"] = self.quota.remaining()
+            return stats
+
+
+limiters: Dict[str, ProviderLimiter] = {name: ProviderLimiter.from_env(name) for name in PROVIDER_DEFAULTS}
+
+
+def limiter_for_host(host: str) -> Optional[ProviderLimiter]:
+      provider = PROVIDER_HOSTS.get(host.lower())
+      return limiters.get(provider) if provider else None
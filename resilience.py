@@ -0,0 +1,255 @@
+"""Circuit breakers, latency histograms and hedged requests per search provider.
+
+Every provider call goes through its :class:`ProviderGuard`. The guard
+records the call's latency in a :class:`LatencyHistogram` and feeds the
+outcome to a :class:`CircuitBreaker`. After repeated failures the breaker
+opens, and calls fail immediately with :class:`CircuitOpen` until a cool-down
+has passed. Callers then skip the provider, or fall back to another one,
+instead of waiting on it. For providers listed in ``HEDGE_PROVIDERS``, a
+second identical request is sent once the first has run longer than the
+provider's observed p95 latency, and whichever answers first is used.
+
+Latency is the time spent on the provider only: waits for our own rate
+limiters, reported through :func:`ratelimit.note_queued`, are left out, so
+queueing never inflates the histograms or the hedging thresholds.
+"""
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from ratelimit import PROVIDER_DEFAULTS, ProviderUnavailable, queued_seconds
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+HEDGE_PROVIDERS = [name.strip() for name in os.getenv("HEDGE_PROVIDERS", "").split(",") if name.strip()]
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+
+# Bucket upper bounds in seconds, growing by half from 10ms to about 80s
+LATENCY_BUCKETS = [round(0.01 * 1.5 ** i, 4) for i in range(23)]
+
+
+class CircuitOpen(ProviderUnavailable):
+      """The provider failed repeatedly and is skipped until its cool-down ends."""
+
+
+class LatencyHistogram:
+      """Bucketed latency distribution with approximate quantiles.
+
+      Once ``window`` samples are recorded all counts are halved, so the
+      quantiles follow the provider's recent behaviour rather than its
+      whole history.
+      """
+
+      def __init__(self, buckets: List[float] = LATENCY_BUCKETS, window: int = 1000):
+            self.buckets = list(buckets)
+            self.window = window
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._total = 0
+            self._sum = 0.0
+            self._lock = threading.Lock()
+
+      def observe(self, seconds: float):
+            with self._lock:
+                  self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+                  self._total += 1
+                  self._sum += seconds
+                  if self._total >= self.window:
+                        self._counts = [count // 2 for count in self._counts]
+                        self._sum *= sum(self._counts) / self._total
+                        self._total = sum(self._counts)
+
+      @property
+      def count(self) -> int:
+            return self._total
+
+      def quantile(self, q: float) -> Optional[float]:
+            """Upper bound of the bucket holding the ``q`` quantile; ``None`` without samples."""
+            with self._lock:
+                  if not self._total:
+                        return None
+                  rank = q * self._total
+                  seen = 0
+                  for index, count in enumerate(self._counts):
+                        seen += count
+                        if seen >= rank and count:
+                              return self.buckets[index] if index < len(self.buckets) else self.buckets[-1] * 1.5
+            return None
+
+      def snapshot(self) -> Dict[str, Any]:
+            with self._lock:
+                  counts, total, total_sum = list(self._counts), self._total, self._sum
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            return {
+                  "count": total,
+                  "mean": round(total_sum / total, 4) if total else None,
+                  "p50": self.quantile(0.5),
+                  "p95": self.quantile(0.95),
+                  "p99": self.quantile(0.99),
+                  "buckets": {bound: count for bound, count in zip(bounds, counts) if count}
+            }
+
+
+class CircuitBreaker:
+      """Closed / open / half-open breaker counting consecutive failures.
+
+      Args:
+            name: Provider name used in errors
+            failure_threshold: Consecutive failures that open the circuit
+            cooldown: Seconds the circuit stays open before one trial call is let through
+      """
+
+      def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                   cooldown: float = BREAKER_COOLDOWN):
+            self.name = name
+            self.failure_threshold = max(1, failure_threshold)
+            self.cooldown = cooldown
+            self.state = "closed"
+            self.failures = 0
+            self.opened = 0
+            self._opened_at = 0.0
+            self._trial_running = False
+            self._lock = threading.Lock()
+
+      def allow(self):
+            """Raise :class:`CircuitOpen` unless a call may go to the provider now."""
+            with self._lock:
+                  if self.state == "closed":
+                        return
+                  remaining = self._opened_at + self.cooldown - time.monotonic()
+                  if self.state == "open" and remaining <= 0:
+                        self.state = "half_open"
+                  if self.state == "half_open" and not self._trial_running:
+                        self._trial_running = True
+                        return
+                  raise CircuitOpen(f"{self.name} is failing; skipped for another {max(remaining, 0):.1f}s")
+
+      def record_success(self):
+            with self._lock:
+                  self.state = "closed"
+                  self.failures = 0
+                  self._trial_running = False
+
+      def release(self):
+            """End a call that says nothing about the provider's health."""
+            with self._lock:
+                  self._trial_running = False
+
+      def record_failure(self):
+            with self._lock:
+                  self.failures += 1
+                  if self.state == "half_open" or self.failures >= self.failure_threshold:
+                        if self.state != "open":
+                              self.opened += 1
+                        self.state = "open"
+                        self._opened_at = time.monotonic()
+                  self._trial_running = False
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=max(2, HEDGE_WORKERS), thread_name_prefix="hedge")
+
+
+class ProviderGuard:
+      """Circuit breaker, latency histogram and optional hedging for one provider."""
+
+      def __init__(self, name: str, hedge: bool = False):
+            self.name = name
+            self.hedge = hedge
+            self.breaker = CircuitBreaker(name)
+            self.latency = LatencyHistogram()
+            self._lock = threading.Lock()
+            self._counters = {"calls": 0, "failures": 0, "short_circuited": 0, "hedged": 0, "hedge_wins": 0}
+
+      def _count(self, name: str):
+            with self._lock:
+                  self._counters[name] += 1
+
+      def hedge_delay(self) -> Optional[float]:
+            """Seconds after which a backup request is sent, or ``None`` when not hedging."""
+            if not self.hedge or self.latency.count < HEDGE_MIN_SAMPLES:
+                  return None
+            return self.latency.quantile(HEDGE_QUANTILE)
+
+      def _timed(self, func: Callable[[], Any]) -> Any:
+            queued = [0.0]
+            token = queued_seconds.set(queued)
+            started = time.monotonic()
+            try:
+                  return func()
+            finally:
+                  queued_seconds.reset(token)
+                  self.latency.observe(max(0.0, time.monotonic() - started - queued[0]))
+
+      def _submit(self, func: Callable[[], Any]):
+            # Each attempt runs in a copy of the caller's context: its span, deadline and own queueing total
+            return _hedge_pool.submit(contextvars.copy_context().run, self._timed, func)
+
+      def _hedged(self, func: Callable[[], Any], delay: float) -> Any:
+            primary = self._submit(func)
+            done, _ = wait([primary], timeout=delay)
+            if done:
+                  return primary.result()
+            self._count("hedged")
+            backup = self._submit(func)
+            pending = {primary, backup}
+            error = None
+            while pending:
+                  done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                  for future in done:
+                        if future.exception() is None:
+                              if future is backup:
+                                    self._count("hedge_wins")
+                              return future.result()
+                        error = future.exception()
+            raise error
+
+      def call(self, func: Callable[[], Any]) -> Any:
+            """Run ``func`` against the provider, unless its circuit is open."""
+            try:
+                  self.breaker.allow()
+            except CircuitOpen:
+                  self._count("short_circuited")
+                  raise
+            self._count("calls")
+            delay = self.hedge_delay()
+            try:
+                  result = self._hedged(func, delay) if delay is not None else self._timed(func)
+            except ProviderUnavailable:
+                  # Our own rate limit or quota said no; that says nothing about the provider
+                  self.breaker.release()
+                  raise
+            except Exception:
+                  self._count("failures")
+                  self.breaker.record_failure()
+                  raise
+            self.breaker.record_success()
+            return result
+
+      def stats(self) -> Dict[str, Any]:
+            with self._lock:
+                  stats = dict(self._counters)
+            stats["state"] = self.breaker.state
+            stats["consecutive_failures"] = self.breaker.failures
+            stats["times_opened"] = self.breaker.opened
+            stats["hedge_after"] = self.hedge_delay()
+            stats["latency"] = self.latency.snapshot()
+            return stats
+
+
+guards: Dict[str, ProviderGuard] = {name: ProviderGuard(name, hedge=name in HEDGE_PROVIDERS) for name in PROVIDER_DEFAULTS}
+
+
+def guarded(name: str):
+      """Route every call of the decorated function through the ``name`` provider guard."""
+      def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                  return guards[name].call(lambda: func(*args, **kwargs))
+            return wrapper
+      return decorator
@@ -0,0 +1,211 @@
+"""Structured search results and their renderers.
+
+Every search backend returns a list of :class:`SearchHit`. Turning hits into
+text for the agent or the LLM is a separate step: pick a renderer by name
+with :func:`render_hits`, or add one with :func:`register_renderer`.
+Hit lists from several sources are combined with :func:`fuse_hits`.
+"""
+import itertools
+import json
+import re
+from dataclasses import asdict, dataclass, fields, replace
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+@dataclass(slots=True)
+class SearchHit:
+      """One result from a web or academic search."""
+      title: str
+      url: str
+      snippet: str = ""
+      source: str = ""
+      authors: str = ""
+      year: str = ""
+      venue: str = ""
+      identifier: str = ""  # DOI ("10.1234/x"), "arXiv:<id>" or "PMID:<id>" when known
+
+      def to_dict(self) -> Dict[str, str]:
+            """Plain dict without empty fields, for JSON and caching."""
+            return {key: value for key, value in asdict(self).items() if value}
+
+      @classmethod
+      def from_dict(cls, data: Dict[str, Any]) -> "SearchHit":
+            names = {field.name for field in fields(cls)}
+            return cls(**{key: str(value) for key, value in data.items() if key in names})
+
+
+Renderer = Callable[[List[SearchHit]], str]
+RENDERERS: Dict[str, Renderer] = {}
+
+
+def register_renderer(name: str):
+      """Register a function turning a list of hits into text under ``name``."""
+      def decorator(renderer: Renderer) -> Renderer:
+            RENDERERS[name] = renderer
+            return renderer
+      return decorator
+
+
+def render_hits(hits: Iterable[SearchHit], style: str = "text") -> str:
+      if style not in RENDERERS:
+            raise ValueError(f"Unknown output format '{style}'. Choose from: {', '.join(RENDERERS)}")
+      return RENDERERS[style](list(hits))
+
+
+@register_renderer("text")
+def render_text(hits: List[SearchHit]) -> str:
+      """Labelled multi-line blocks, one per hit; empty fields are left out."""
+      blocks = []
+      for hit in hits:
+            lines = [f"Title: {hit.title}"]
+            if hit.authors:
+                  lines.append(f"Authors: {hit.authors}")
+            if hit.year:
+                  lines.append(f"Year: {hit.year}")
+            if hit.venue:
+                  lines.append(f"Venue: {hit.venue}")
+            lines.append(f"Link: {hit.url}")
+            if hit.source:
+                  lines.append(f"Source: {hit.source}")
+            if hit.snippet:
+                  lines.append(f"Snippet: {hit.snippet}")
+            blocks.append("\n".join(lines) + "\n")
+      return "\n\n".join(blocks)
+
+
+@register_renderer("compact")
+def render_compact(hits: List[SearchHit]) -> str:
+      """Numbered two-line entries with the fewest tokens."""
+      entries = []
+      for number, hit in enumerate(hits, 1):
+            details = ", ".join(value for value in (hit.authors, hit.year, hit.venue) if value)
+            heading = f"{number}. {hit.title}" + (f" ({details})" if details else "") + f" <{hit.url}>"
+            if hit.source:
+                  heading += f" [{hit.source}]"
+            entries.append(heading + (f"\n   {hit.snippet}" if hit.snippet else ""))
+      return "\n".join(entries)
+
+
+@register_renderer("json")
+def render_json(hits: List[SearchHit]) -> str:
+      return json.dumps([hit.to_dict() for hit in hits], ensure_ascii=False)
+
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = frozenset(("fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "ref"))
+DOI_PATTERN = re.compile(r"\b(10\.\d{4,9}/[^\s?#]+)", re.IGNORECASE)
+ARXIV_PATTERN = re.compile(r"arxiv(?:\.org/(?:abs|pdf)/|:)([^\s?#]+?)(?:v\d+)?(?:\.pdf)?/?$", re.IGNORECASE)
+PUBMED_PATTERN = re.compile(r"(?:pubmed\.ncbi\.nlm\.nih\.gov/|pmid:)(\d+)", re.IGNORECASE)
+RRF_K = 60
+
+
+def canonical_url(url: str) -> str:
+      """``url`` reduced to what identifies the page: no scheme, ``www.``, fragment, tracking parameters or trailing slash."""
+      parts = urlsplit(url.strip())
+      host = parts.netloc.lower()
+      if host.startswith("www."):
+            host = host[4:]
+      query = urlencode([
+            (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not name.lower().startswith("utm_") and name.lower() not in TRACKING_PARAMS
+      ])
+      return host + parts.path.rstrip("/") + (f"?{query}" if query else "")
+
+
+def hit_keys(hit: SearchHit) -> List[str]:
+      """Keys under which ``hit`` counts as the same document as another hit.
+
+      DOIs, arXiv IDs and PubMed IDs are taken from the identifier or the
+      URL, so a paper found on the web and in an academic index match. Papers
+      (hits with authors) also match on their normalized title.
+      """
+      keys = []
+      for text in (hit.identifier, hit.url):
+            if not text:
+                  continue
+            doi = DOI_PATTERN.search(text)
+            if doi:
+                  keys.append("doi:" + doi.group(1).lower().rstrip("."))
+            arxiv = ARXIV_PATTERN.search(text)
+            if arxiv:
+                  keys.append("arxiv:" + arxiv.group(1).lower())
+            pubmed = PUBMED_PATTERN.search(text)
+            if pubmed:
+                  keys.append("pmid:" + pubmed.group(1))
+      if hit.authors and hit.title:
+            keys.append("title:" + " ".join(re.findall(r"\w+", hit.title.lower())))
+      if hit.url:
+            keys.append("url:" + canonical_url(hit.url))
+      return list(dict.fromkeys(keys))
+
+
+def fuse_hits(ranked_lists: Dict[str, List[SearchHit]], k: int = RRF_K, limit: Optional[int] = None) -> List[SearchHit]:
+      """Merge ranked hit lists into one list ordered by reciprocal rank fusion.
+
+      Hits for the same document are combined: the best-ranked copy keeps its
+      title and URL, empty fields are filled in from the others, and the
+      longest snippet wins. ``source`` of a merged hit lists every source that
+      returned it, in order of first appearance. A source that returned the
+      same document more than once (e.g. a paper's abstract and PDF pages)
+      counts only with its best rank.
+
+      Args:
+            ranked_lists: Hits per source, best first
+            k: RRF constant; larger values flatten the weight of top ranks
+            limit: Maximum number of hits returned
+      """
+      groups: Dict[int, Dict[str, Any]] = {}
+      index: Dict[str, int] = {}
+      group_ids = itertools.count()
+      # Interleave the lists so that the best-ranked copy of a document is seen first
+      depth = max((len(hits) for hits in ranked_lists.values()), default=0)
+      for rank in range(depth):
+            for name, hits in ranked_lists.items():
+                  if rank >= len(hits):
+                        continue
+                  hit = hits[rank]
+                  keys = hit_keys(hit)
+                  matches = list(dict.fromkeys(index[key] for key in keys if key in index))
+                  if matches:
+                        group_id = matches[0]
+                        # The hit links documents seen as separate so far, e.g. a paper's DOI and its title
+                        for other in matches[1:]:
+                              _merge_group(groups[group_id], groups.pop(other))
+                  else:
+                        group_id = next(group_ids)
+                        # ranks: best rank per source, in order of first appearance
+                        groups[group_id] = {"hit": replace(hit), "ranks": {}, "keys": []}
+                  group = groups[group_id]
+                  group["keys"].extend(key for key in keys if key not in group["keys"])
+                  for key in group["keys"]:
+                        index[key] = group_id
+                  # Ranks only grow as the lists are walked, so a source's first rank here is its best
+                  group["ranks"].setdefault(name, rank)
+                  _fill_hit(group["hit"], hit)
+      for group in groups.values():
+            group["score"] = sum(1.0 / (k + rank + 1) for rank in group["ranks"].values())
+      ranked = sorted(groups.values(), key=lambda group: group["score"], reverse=True)
+      fused = []
+      for group in ranked[:limit]:
+            group["hit"].source = ", ".join(group["ranks"])
+            fused.append(group["hit"])
+      return fused
+
+
+def _fill_hit(merged: SearchHit, hit: SearchHit):
+      """Complete ``merged`` with the fields of ``hit`` it lacks, keeping the longer snippet."""
+      for field in fields(SearchHit):
+            value = getattr(hit, field.name)
+            if field.name == "snippet":
+                  if len(value) > len(merged.snippet):
+                        merged.snippet = value
+            elif value and not getattr(merged, field.name):
+                  setattr(merged, field.name, value)
+
+
+def _merge_group(group: Dict[str, Any], other: Dict[str, Any]):
+      for source, rank in other["ranks"].items():
+            group["ranks"][source] = min(rank, group["ranks"].get(source, rank))
+      group["keys"].extend(key for key in other["keys"] if key not in group["keys"])
+      _fill_hit(group["hit"], other["hit"])
@@ -1,320 +1,637 @@
-from mcp.server.fastmcp import FastMCP
-import requests
-from openai import AzureOpenAI
+from mcp.server.fastmcp import Context, FastMCP
+import asyncio
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+import contextvars
+from dataclasses import replace
+import functools
+import inspect
 import json
 import os
-from typing import List, Dict, Any, Optional
-import re
-from bs4 import BeautifulSoup
+import threading
+import time
+import weakref
+from typing import Callable, List, Dict, Any, Optional, Sequence
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 load_dotenv()
 
-mcp = FastMCP("EnhancedKnowledgeAssistant")
+from http_client import http
+from ratelimit import ProviderUnavailable, call_deadline, limiters
+from resilience import guarded, guards
+from telemetry import registry, render_metrics, span
+from cache import ResultCache
+import academic
+import extract
+from llm_client import complete, get_completion_cache
+from tokens import count_tokens, split_text, truncate_tokens
+from doc_index import DocumentIndex, render_chunk, terms
+from budget import allocate, evidence_budget, pack
+from results import RENDERERS, SearchHit, canonical_url, fuse_hits, render_hits
 
-AZURE_API_KEY = os.getenv("AZURE_OPENAI_KEY")
-AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_DEPLOYMENT_NAME = os.getenv("AZURE_DEPLOYMENT_NAME", "gpt-4o")
-llm = AzureOpenAI(
-      azure_endpoint=AZURE_ENDPOINT,
-      api_key=AZURE_API_KEY,  
-      azure_deployment=AZURE_DEPLOYMENT_NAME,
-      api_version="2024-12-01-preview"
-)
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio")  # stdio, sse or streamable-http
+MCP_HOST = os.getenv("MCP_HOST", "127.0.0.1")
+MCP_PORT = int(os.getenv("MCP_PORT", "8000"))
+# Worker processes serving streamable HTTP; requests are stateless, so any worker can answer any client
+MCP_WORKERS = int(os.getenv("MCP_WORKERS", "1"))
 
-@mcp.tool()
-def search_google(query: str, num_results: int = 3) -> str:
+mcp = FastMCP("EnhancedKnowledgeAssistant", host=MCP_HOST, port=MCP_PORT, stateless_http=True)
+
+def tool_failed(result: Any) -> bool:
+      """Whether a tool's return value reports an error (tools return errors instead of raising)."""
+      if isinstance(result, dict):
+            return "error" in result
+      return isinstance(result, str) and result.startswith(("Error", "Invalid", "No valid"))
+
+def tool():
+      """``mcp.tool()`` that also traces every call of the tool as a span."""
+      def decorator(func):
+            span_name = f"tool {func.__name__}"
+            if inspect.iscoroutinefunction(func):
+                  @functools.wraps(func)
+                  async def wrapper(*args, **kwargs):
+                        with span(span_name) as current:
+                              result = await func(*args, **kwargs)
+                              if tool_failed(result):
+                                    current.status = "error"
+                              return result
+            else:
+                  @functools.wraps(func)
+                  def wrapper(*args, **kwargs):
+                        with span(span_name) as current:
+                              result = func(*args, **kwargs)
+                              if tool_failed(result):
+                                    current.status = "error"
+                              return result
+            return mcp.tool()(wrapper)
+      return decorator
+
+# Per-source time limits for fanned-out searches; a slow source is reported
+# as timed out instead of holding back the others.
+SOURCE_TIMEOUTS = {
+      "google": float(os.getenv("GOOGLE_TIMEOUT", "8")),
+      "serper": float(os.getenv("SERPER_TIMEOUT", "8")),
+      "semantic_scholar": float(os.getenv("SEMANTIC_SCHOLAR_TIMEOUT", "10")),
+      "arxiv": float(os.getenv("ARXIV_TIMEOUT", "12")),
+      "pubmed": float(os.getenv("PUBMED_TIMEOUT", "12")),
+}
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "15"))
+# Threads for search provider calls, which can sleep in a rate limiter queue for up to
+# RATE_LIMIT_MAX_WAIT; kept apart from asyncio's default executor so page fetches and
+# index reads never wait behind them
+PROVIDER_THREADS = int(os.getenv("PROVIDER_THREADS", "64"))
+
+provider_pool = ThreadPoolExecutor(max_workers=max(1, PROVIDER_THREADS), thread_name_prefix="provider")
+
+async def in_thread(func: Callable[[], Any], *slots: asyncio.Semaphore, timeout: Optional[float] = None,
+                    executor: Optional[Executor] = None) -> Any:
+      """Run ``func`` in a worker thread of ``executor`` once each of ``slots`` has been taken, in order.
+
+      ``timeout`` bounds the run, not the wait for slots. The slots are held
+      until the thread finishes, even when the caller stops waiting for it,
+      so a slot always stands for one busy thread. Without an ``executor``
+      asyncio's default one is used.
+      """
+      taken = []
+      try:
+            for slot in slots:
+                  await slot.acquire()
+                  taken.append(slot)
+            # Like asyncio.to_thread, the thread sees this task's context (call deadline, spans)
+            task = asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, func)
+      except BaseException:
+            for slot in taken:
+                  slot.release()
+            raise
+
+      def finished(task):
+            for slot in taken:
+                  slot.release()
+            # Mark the outcome as seen; the caller may have given up on it
+            if not task.cancelled():
+                  task.exception()
+
+      task.add_done_callback(finished)
+      return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+async def provider_thread(func: Callable[..., Any], *args: Any) -> Any:
+      """``asyncio.to_thread`` for search provider calls: ``func(*args)`` in :data:`provider_pool`."""
+      return await in_thread(functools.partial(func, *args), executor=provider_pool)
+
+async def fan_out(calls: Dict[Any, Callable[[], Any]], deadline: float = SEARCH_DEADLINE,
+                  timeouts: Optional[Dict[Any, float]] = None,
+                  slots: Optional[Dict[Any, Sequence[asyncio.Semaphore]]] = None) -> Dict[Any, Any]:
+      """Run blocking search provider calls concurrently in :data:`provider_pool`.
+
+      Each call is bounded by its own timeout and by the overall deadline.
+      Calls that fail or run out of time yield an error string instead of
+      raising, so callers always get the partial results that did arrive.
+      A call listed in ``slots`` waits for its semaphores before it takes a
+      thread, so queued calls do not tie up provider threads.
+      """
+      timeouts = timeouts or {}
+      slots = slots or {}
+
+      async def run(name, func):
+            limit = min(timeouts.get(name, deadline), deadline)
+            # Rate limiters give up instead of queueing past the time this call is waited for
+            call_deadline.set(time.monotonic() + limit)
+            try:
+                  return await asyncio.wait_for(in_thread(func, *slots.get(name, ()), executor=provider_pool),
+                                                timeout=limit)
+            except asyncio.TimeoutError:
+                  return f"Error searching {name}: timed out after {limit:g}s"
+            except Exception as e:
+                  return f"Error searching {name}: {str(e)}"
+
+      results = await asyncio.gather(*(run(name, func) for name, func in calls.items()))
+      return dict(zip(calls.keys(), results))
+
+SEARCH_CACHE_TTLS = {
+      "google": float(os.getenv("SEARCH_CACHE_TTL_GOOGLE", "21600")),
+      "serper": float(os.getenv("SEARCH_CACHE_TTL_SERPER", "21600")),
+      "semantic_scholar": float(os.getenv("SEARCH_CACHE_TTL_SEMANTIC_SCHOLAR", "86400")),
+      "arxiv": float(os.getenv("SEARCH_CACHE_TTL_ARXIV", "86400")),
+      "pubmed": float(os.getenv("SEARCH_CACHE_TTL_PUBMED", "86400")),
+}
+
+# The caches and the document index are opened on first use: extraction and
+# uvicorn worker processes re-import this file as their __main__ and never use them
+_search_cache: Optional[ResultCache] = None
+_doc_index: Optional[DocumentIndex] = None
+_state_lock = threading.Lock()
+
+def get_search_cache() -> ResultCache:
+      """Search hits by fetcher, normalized query, result count and source."""
+      global _search_cache
+      with _state_lock:
+            if _search_cache is None:
+                  _search_cache = ResultCache(
+                        max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+                        path=os.getenv("SEARCH_CACHE_PATH") or None
+                  )
+            return _search_cache
+
+def get_doc_index() -> DocumentIndex:
+      """Fetched pages and search snippets, reused as retrieval context across requests."""
+      global _doc_index
+      with _state_lock:
+            if _doc_index is None:
+                  _doc_index = DocumentIndex(
+                        path=os.getenv("DOC_INDEX_PATH") or None,
+                        chunk_tokens=int(os.getenv("DOC_INDEX_CHUNK_TOKENS", "200")),
+                        max_documents=int(os.getenv("DOC_INDEX_MAX_DOCUMENTS", "5000"))
+                  )
+            return _doc_index
+
+def index_hits(source: str, hits: List[SearchHit]):
+      """Add search hits to the document index without replacing fetched pages."""
+      doc_index = get_doc_index()
+      for hit in hits:
+            if hit.url.startswith("http"):
+                  doc_index.add(hit.url, hit.snippet, hit.title, source, replace=False)
+
+def normalize_query(query: str) -> str:
+      """Fold case, whitespace and trailing punctuation so near-identical queries share a cache key."""
+      return " ".join(query.casefold().split()).strip(" ?!.")
+
+def cached_search(source: Optional[str] = None):
+      """Cache a search fetcher on (fetcher, normalized query, num_results, source).
+
+      Fetchers without a ``source`` argument use the ``source`` given here,
+      which also selects the TTL from ``SEARCH_CACHE_TTLS``. Hits are cached
+      as plain dicts so the persistent tier can store them as JSON.
+      """
+      def decorator(fetch):
+            signature = inspect.signature(fetch)
+
+            @functools.wraps(fetch)
+            def wrapper(*args, **kwargs):
+                  bound = signature.bind(*args, **kwargs)
+                  bound.apply_defaults()
+                  arguments = bound.arguments
+                  cache_source = arguments.get("source", source)
+                  key = json.dumps([fetch.__name__, normalize_query(arguments["query"]), arguments["num_results"], cache_source])
+                  cached = get_search_cache().get_or_compute(
+                        key,
+                        lambda: [hit.to_dict() for hit in fetch(*args, **kwargs)],
+                        ttl=SEARCH_CACHE_TTLS.get(cache_source, 3600)
+                  )
+                  hits = [SearchHit.from_dict(hit) for hit in cached]
+                  index_hits(cache_source, hits)
+                  return hits
+            return wrapper
+      return decorator
+
+@cached_search("google")
+@guarded("google")
+def fetch_google(query: str, num_results: int) -> List[SearchHit]:
+      """Google Custom Search hits."""
+      url = "https://www.googleapis.com/customsearch/v1"
+      params = {
+            "key": os.environ.get("GOOGLE_API_KEY"),
+            "cx": os.environ.get("GOOGLE_CSE_ID"),
+            "q": query,
+            "num": num_results
+      }
+      response = http.get(url, params=params)
+      response.raise_for_status()
+      results = response.json()
+      return [
+            SearchHit(title=item.get("title", ""), url=item["link"], snippet=item.get("snippet", ""), source="google")
+            for item in results.get("items", [])
+      ]
+
+@tool()
+async def search_google(query: str, num_results: int = 3, output_format: str = "text") -> str:
       """Search the web using Google Custom Search API.
       
       Args:
             query: Search query
             num_results: Number of results (1-10)
+            output_format: How hits are rendered ("text", "compact" or "json")
       """
       api_key = os.environ.get("GOOGLE_API_KEY")
       search_engine_id = os.environ.get("GOOGLE_CSE_ID")
       
       if not api_key or not search_engine_id:
             return "Error: Google Search API key or Search Engine ID not configured."
-      
-      url = "https://www.googleapis.com/customsearch/v1"
-      params = {
-            "key": api_key,
-            "cx": search_engine_id,
-            "q": query,
-            "num": min(max(1, num_results), 10)
-      }
+      if output_format not in RENDERERS:
+            return f"Invalid output format. Choose from: {', '.join(RENDERERS)}"
       
       try:
-            response = requests.get(url, params=params)
-            results = response.json()
-            
-            if "items" not in results:
-                  return f"No results found for query: {query}"
-            
-            formatted_results = []
-            for item in results["items"]:
-                  formatted_results.append(
-                  f"Title: {item['title']}\n"
-                  f"Link: {item['link']}\n"
-                  f"Snippet: {item['snippet']}\n"
-                  )
-            
-            return "\n\n".join(formatted_results)
-            
+            items = await provider_thread(fetch_web, "google", query, min(max(1, num_results), 10))
       except Exception as e:
             return f"Error performing Google search: {str(e)}"
+      
+      if not items:
+            return f"No results found for query: {query}"
+      
+      return render_hits(items, output_format)
+
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(1024 * 1024)))
+PAGE_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+def fetch_page_text(url: str, max_length: int = 3000, max_bytes: int = FETCH_MAX_BYTES, timeout: float = 10) -> str:
+      """Stream ``url`` up to ``max_bytes`` and return its extracted main text.
+
+      Responses that are not HTML or plain text are rejected from their
+      headers, before any of the body is downloaded.
+      """
+      with http.get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type and content_type not in PAGE_CONTENT_TYPES:
+                  raise ValueError(f"Unsupported content type: {content_type}")
+            
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                  body.extend(chunk)
+                  if len(body) >= max_bytes:
+                        break
+            # requests assumes ISO-8859-1 when no charset is declared
+            encoding = response.encoding if "charset" in response.headers.get("Content-Type", "") else "utf-8"
+      
+      html = bytes(body[:max_bytes]).decode(encoding or "utf-8", errors="replace")
+      text = extract.extract_page(html, content_type)
+      # Keep the whole page for later retrieval, return only max_length of it
+      get_doc_index().add(url, text, source="web")
+      return text[:max_length] + "... [content truncated]" if len(text) > max_length else text
 
-@mcp.tool()
-def get_webpage_content(url: str, max_length: int = 3000) -> str:
+@tool()
+async def get_webpage_content(url: str, max_length: int = 3000, max_bytes: int = FETCH_MAX_BYTES) -> str:
       """Fetch and extract the main content from a webpage.
       
       Args:
             url: The URL of the webpage to fetch
             max_length: Maximum content length to return
+            max_bytes: Stop downloading after this many bytes of the page
       
       Returns:
             Extracted text content from the webpage
       """
       try:
-            headers = {
-                  "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            # Parse HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove script and style elements
-            for script_or_style in soup(["script", "style", "header", "footer", "nav"]):
-                  script_or_style.decompose()
-            
-            # Get text content
-            text = soup.get_text(separator='\n')
-            
-            # Clean up text (remove excessive newlines, etc.)
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            
-            # Limit length
-            if len(text) > max_length:
-                  text = text[:max_length] + "... [content truncated]"
-            
-            return text
+            return await asyncio.to_thread(fetch_page_text, url, max_length, max_bytes)
       except Exception as e:
             return f"Error fetching webpage content: {str(e)}"
 
-@mcp.tool()
-def search_serper(query: str, num_results: int = 3) -> str:
-      """Search the web using Serper.dev API (Google results).
+BATCH_FETCH_CONCURRENCY = int(os.getenv("BATCH_FETCH_CONCURRENCY", "8"))
+BATCH_FETCH_PER_HOST = int(os.getenv("BATCH_FETCH_PER_HOST", "2"))
+
+# Shared by every batch fetch in this process; a host's slot goes away once no fetch holds or awaits it
+fetch_slots = asyncio.Semaphore(max(1, BATCH_FETCH_CONCURRENCY))
+host_fetch_slots: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+def host_fetch_slot(host: str) -> asyncio.Semaphore:
+      slot = host_fetch_slots.get(host)
+      if slot is None:
+            slot = host_fetch_slots[host] = asyncio.Semaphore(max(1, BATCH_FETCH_PER_HOST))
+      return slot
+
+@tool()
+async def get_webpages_content(urls: List[str], max_length: int = 3000,
+                               max_concurrency: int = BATCH_FETCH_CONCURRENCY,
+                               per_host_limit: int = BATCH_FETCH_PER_HOST,
+                               timeout: float = 15) -> str:
+      """Fetch and extract the main content of several webpages concurrently.
       
       Args:
-            query: Search query
-            num_results: Number of results (1-10)
+            urls: The URLs of the webpages to fetch
+            max_length: Maximum content length to return per page
+            max_concurrency: Maximum number of pages of this call fetched at the same time
+            per_host_limit: Maximum number of simultaneous fetches per host for this call;
+                  all calls together stay within BATCH_FETCH_CONCURRENCY and BATCH_FETCH_PER_HOST
+            timeout: Seconds allowed for each page
+      
+      Returns:
+            The extracted text of each page, in the order of ``urls``
       """
-      api_key = os.environ.get("SERPER_API_KEY")
+      call_slots = asyncio.Semaphore(max(1, max_concurrency))
+      call_host_slots = defaultdict(lambda: asyncio.Semaphore(max(1, per_host_limit)))
       
-      if not api_key:
-            return "Error: Serper API key not configured."
+      async def fetch_one(url):
+            host = urlsplit(url).netloc.lower()
+            # Host slots come before the wider ones so a busy host does not hold global slots
+            slots = (call_host_slots[host], call_slots, host_fetch_slot(host), fetch_slots)
+            try:
+                  return await in_thread(lambda: fetch_page_text(url, max_length, FETCH_MAX_BYTES, timeout), *slots,
+                                         timeout=timeout)
+            except asyncio.TimeoutError:
+                  return f"Error fetching webpage content: timed out after {timeout:g}s"
+            except Exception as e:
+                  return f"Error fetching webpage content: {str(e)}"
       
+      # Fetch each distinct URL once
+      unique_urls = list(dict.fromkeys(urls))
+      pages = dict(zip(unique_urls, await asyncio.gather(*(fetch_one(url) for url in unique_urls))))
+      
+      return "\n\n".join(f"=== {url} ===\n{pages[url]}\n" for url in urls)
+
+@cached_search("serper")
+@guarded("serper")
+def fetch_serper(query: str, num_results: int) -> List[SearchHit]:
+      """Serper.dev organic hits."""
       url = "https://google.serper.dev/search"
       payload = {
             "q": query,
-            "num": min(max(1, num_results), 10)
+            "num": num_results
       }
       headers = {
-            "X-API-KEY": api_key,
+            "X-API-KEY": os.environ.get("SERPER_API_KEY", ""),
             "Content-Type": "application/json"
       }
+      response = http.post(url, headers=headers, data=json.dumps(payload))
+      response.raise_for_status()
+      results = response.json()
+      return [
+            SearchHit(title=item.get("title", ""), url=item["link"], snippet=item.get("snippet", ""), source="serper")
+            for item in results.get("organic", [])[:num_results]
+      ]
+
+@tool()
+async def search_serper(query: str, num_results: int = 3, output_format: str = "text") -> str:
+      """Search the web using Serper.dev API (Google results).
+      
+      Args:
+            query: Search query
+            num_results: Number of results (1-10)
+            output_format: How hits are rendered ("text", "compact" or "json")
+      """
+      api_key = os.environ.get("SERPER_API_KEY")
+      
+      if not api_key:
+            return "Error: Serper API key not configured."
+      if output_format not in RENDERERS:
+            return f"Invalid output format. Choose from: {', '.join(RENDERERS)}"
       
       try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            results = response.json()
-            
-            if "organic" not in results:
-                  return f"No results found for query: {query}"
-            
-            formatted_results = []
-            for item in results["organic"][:num_results]:
-                  formatted_results.append(
-                  f"Title: {item['title']}\n"
-                  f"Link: {item['link']}\n"
-                  f"Snippet: {item.get('snippet', 'No snippet available')}\n"
-                  )
-            
-            return "\n\n".join(formatted_results)
-            
+            items = await provider_thread(fetch_web, "serper", query, min(max(1, num_results), 10))
       except Exception as e:
             return f"Error performing Serper search: {str(e)}"
+      
+      if not items:
+            return f"No results found for query: {query}"
+      
+      return render_hits(items, output_format)
+
+# Web provider to use when one is rate limited or out of its daily quota
+WEB_FALLBACKS = {"google": "serper", "serper": "google"}
+
+def web_configured(source: str) -> bool:
+      if source == "google":
+            return bool(os.environ.get("GOOGLE_API_KEY") and os.environ.get("GOOGLE_CSE_ID"))
+      return bool(os.environ.get("SERPER_API_KEY"))
 
-@mcp.tool()
-def search_academic(query: str, source: str = "semantic_scholar", num_results: int = 3) -> str:
+def fetch_web(source: str, query: str, num_results: int) -> List[SearchHit]:
+      """Web hits from ``source``, or from its fallback provider when ``source`` cannot take the request."""
+      fetchers = {"google": fetch_google, "serper": fetch_serper}
+      try:
+            return fetchers[source](query, num_results)
+      except ProviderUnavailable:
+            fallback = WEB_FALLBACKS[source]
+            if not web_configured(fallback):
+                  raise
+            return fetchers[fallback](query, num_results)
+
+ACADEMIC_SOURCES = ("semantic_scholar", "arxiv", "pubmed")
+ABSTRACT_TOKENS = int(os.getenv("ABSTRACT_TOKENS", "75"))
+
+@cached_search()
+def fetch_academic(query: str, source: str, num_results: int) -> List[SearchHit]:
+      """Paper metadata from one of ``ACADEMIC_SOURCES``."""
+      return academic.search(source, query, num_results)
+
+def shorten_abstracts(papers: List[SearchHit]) -> List[SearchHit]:
+      """Copies of ``papers`` with abstracts cut to ``ABSTRACT_TOKENS`` for display."""
+      return [replace(paper, snippet=truncate_tokens(paper.snippet, ABSTRACT_TOKENS)) for paper in papers]
+
+@tool()
+async def search_academic(query: str, source: str = "semantic_scholar", num_results: int = 3,
+                    output_format: str = "text") -> str:
       """Search academic sources for scholarly information.
       
       Args:
             query: Search query
             source: Academic source to use ("semantic_scholar", "arxiv", "pubmed")
             num_results: Number of results (1-10)
+            output_format: How papers are rendered ("text", "compact" or "json")
       """
-      sources = {
-            "semantic_scholar": {
-                  "url": "https://api.semanticscholar.org/graph/v1/paper/search",
-                  "params": {
-                  "query": query,
-                  "limit": min(max(1, num_results), 10),
-                  "fields": "title,authors,venue,year,abstract,url"
-                  },
-                  "headers": {}
-            },
-            "arxiv": {
-                  "url": f"http://export.arxiv.org/api/query?search_query=all:{query}&start=0&max_results={min(max(1, num_results), 10)}",
-                  "params": {},
-                  "headers": {}
-            },
-            "pubmed": {
-                  "url": "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi",
-                  "params": {
-                  "db": "pubmed",
-                  "term": query,
-                  "retmode": "json",
-                  "retmax": min(max(1, num_results), 10)
-                  },
-                  "headers": {}
-            }
+      if source not in ACADEMIC_SOURCES:
+            return f"Invalid source. Choose from: {', '.join(ACADEMIC_SOURCES)}"
+      if output_format not in RENDERERS:
+            return f"Invalid output format. Choose from: {', '.join(RENDERERS)}"
+      
+      try:
+            papers = await provider_thread(fetch_academic, query, source, min(max(1, num_results), 10))
+      except Exception as e:
+            return f"Error performing academic search via {source}: {str(e)}"
+      
+      if not papers:
+            return f"No results found in {source} for query: {query}"
+      
+      return render_hits(shorten_abstracts(papers), output_format)
+
+ACADEMIC_MAX_RESULTS = int(os.getenv("ACADEMIC_MAX_RESULTS", "500"))
+ACADEMIC_BATCH_DEADLINE = float(os.getenv("ACADEMIC_BATCH_DEADLINE", "300"))
+# Batch searches in flight per source; the rest wait here rather than in a worker thread
+batch_slots = {source: asyncio.Semaphore(max(1, limit)) for source, limit in academic.SOURCE_CONCURRENCY.items()}
+
+@tool()
+async def search_academic_batch(queries: List[str], sources: List[str] = ["semantic_scholar"],
+                                num_results: int = 20, output_format: str = "compact",
+                                deadline: float = ACADEMIC_BATCH_DEADLINE) -> str:
+      """Run many academic searches in one call, for literature sweeps.
+      
+      Every query is sent to every source concurrently (within each source's
+      request limits). Large result counts are paged through, and each
+      query's papers are merged across sources into one ranked list.
+      
+      Args:
+            queries: Search queries
+            sources: Academic sources to use ("semantic_scholar", "arxiv", "pubmed")
+            num_results: Papers per query and source (1-500)
+            output_format: How papers are rendered ("text", "compact" or "json")
+            deadline: Maximum number of seconds to wait for all searches
+      """
+      valid_sources = list(dict.fromkeys(s for s in sources if s in ACADEMIC_SOURCES))
+      if not valid_sources:
+            return f"Invalid source. Choose from: {', '.join(ACADEMIC_SOURCES)}"
+      if output_format not in RENDERERS:
+            return f"Invalid output format. Choose from: {', '.join(RENDERERS)}"
+      queries = list(dict.fromkeys(query for query in queries if query.strip()))
+      if not queries:
+            return "No queries specified."
+      num_results = min(max(1, num_results), ACADEMIC_MAX_RESULTS)
+      
+      calls = {
+            (query, source): (lambda q=query, s=source: fetch_academic(q, s, num_results))
+            for query in queries for source in valid_sources
       }
+      results = await fan_out(calls, deadline=deadline, slots={key: [batch_slots[key[1]]] for key in calls})
+      
+      merged = {}
+      for query in queries:
+            hit_lists = {source: results[(query, source)] for source in valid_sources if isinstance(results[(query, source)], list)}
+            errors = {source: results[(query, source)] for source in valid_sources if isinstance(results[(query, source)], str)}
+            merged[query] = (fuse_hits(hit_lists), errors)
       
-      if source not in sources:
-            return f"Invalid source. Choose from: {', '.join(sources.keys())}"
+      if output_format == "json":
+            return json.dumps({
+                  query: {"results": [hit.to_dict() for hit in shorten_abstracts(hits)], "errors": errors}
+                  for query, (hits, errors) in merged.items()
+            }, ensure_ascii=False)
       
-      api_config = sources[source]
+      sections = []
+      for query, (hits, errors) in merged.items():
+            body = render_hits(shorten_abstracts(hits), output_format) if hits else f"No results found for query: {query}"
+            sections.append("\n\n".join([f"=== {query} ({len(hits)} papers) ===\n{body}", *errors.values()]))
+      return "\n\n".join(sections)
+
+def lookup_and_index(identifiers: List[str]) -> List[SearchHit]:
+      """Papers for ``identifiers``, added to the document index."""
+      papers = academic.lookup_ids(identifiers)
+      for source in ACADEMIC_SOURCES:
+            index_hits(source, [paper for paper in papers if paper.source == source])
+      return papers
+
+@tool()
+async def lookup_papers(identifiers: List[str], output_format: str = "text") -> str:
+      """Look up papers by identifier, batching requests per source.
       
+      Args:
+            identifiers: Paper IDs such as "arXiv:2101.00001", "PMID:12345678" or DOIs ("10.1038/...")
+            output_format: How papers are rendered ("text", "compact" or "json")
+      """
+      if output_format not in RENDERERS:
+            return f"Invalid output format. Choose from: {', '.join(RENDERERS)}"
       try:
-            if source == "arxiv":
-                  # Special handling for arXiv's XML response
-                  import xml.etree.ElementTree as ET
-                  response = requests.get(api_config["url"])
-                  root = ET.fromstring(response.content)
-                  
-                  ns = {'atom': 'http://www.w3.org/2005/Atom'}
-                  entries = root.findall('./atom:entry', ns)
-                  
-                  formatted_results = []
-                  for entry in entries:
-                        title = entry.find('./atom:title', ns).text.strip()
-                        authors = ", ".join([author.find('./atom:name', ns).text for author in entry.findall('./atom:author', ns)])
-                        summary = entry.find('./atom:summary', ns).text.strip()
-                        link = entry.find('./atom:id', ns).text
-                        
-                        formatted_results.append(
-                              f"Title: {title}\n"
-                              f"Authors: {authors}\n"
-                              f"Link: {link}\n"
-                              f"Summary: {summary[:300]}...\n"
-                        )
-                  
-                  return "\n\n".join(formatted_results)
-                  
-            elif source == "semantic_scholar":
-                  response = requests.get(api_config["url"], params=api_config["params"], headers=api_config["headers"])
-                  results = response.json()
-                  
-                  if "data" not in results:
-                        return f"No results found in Semantic Scholar for query: {query}"
-                  
-                  formatted_results = []
-                  for paper in results["data"]:
-                        authors = ", ".join([author.get("name", "Unknown") for author in paper.get("authors", [])])
-                        formatted_results.append(
-                              f"Title: {paper.get('title', 'No title')}\n"
-                              f"Authors: {authors}\n"
-                              f"Year: {paper.get('year', 'Unknown')}\n"
-                              f"Venue: {paper.get('venue', 'Unknown')}\n"
-                              f"URL: {paper.get('url', 'No URL available')}\n"
-                              f"Abstract: {paper.get('abstract', 'No abstract available')[:300]}...\n"
-                        )
-                  
-                  return "\n\n".join(formatted_results)
-                  
-            elif source == "pubmed":
-                  response = requests.get(api_config["url"], params=api_config["params"], headers=api_config["headers"])
-                  results = response.json()
-                  
-                  if "esearchresult" not in results or "idlist" not in results["esearchresult"]:
-                        return f"No results found in PubMed for query: {query}"
-                  
-                  # Get details for each paper ID
-                  id_list = results["esearchresult"]["idlist"]
-                  if not id_list:
-                        return f"No results found in PubMed for query: {query}"
-                  
-                  # Fetch details
-                  summary_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-                  summary_params = {
-                  "db": "pubmed",
-                  "id": ",".join(id_list),
-                  "retmode": "json"
-                  }
-                  
-                  summary_response = requests.get(summary_url, params=summary_params)
-                  summary_results = summary_response.json()
-                  
-                  formatted_results = []
-                  for paper_id in id_list:
-                        paper = summary_results["result"][paper_id]
-                        formatted_results.append(
-                              f"Title: {paper.get('title', 'No title')}\n"
-                              f"Authors: {', '.join(paper.get('authors', [{'name': 'Unknown'}])[0].get('name', 'Unknown'))}\n"
-                              f"Journal: {paper.get('fulljournalname', 'Unknown')}\n"
-                              f"Year: {paper.get('pubdate', 'Unknown').split()[0]}\n"
-                              f"PubMed ID: {paper_id}\n"
-                              f"Link: https://pubmed.ncbi.nlm.nih.gov/{paper_id}/\n"
-                        )
-                  
-                  return "\n\n".join(formatted_results)
-                  
+            papers = await provider_thread(lookup_and_index, identifiers)
       except Exception as e:
-            return f"Error performing academic search via {source}: {str(e)}"
+            return f"Error looking up papers: {str(e)}"
+      if not papers:
+            return "No papers found for the given identifiers."
+      return render_hits(shorten_abstracts(papers), output_format)
+
+SEARCH_SOURCES = ("google", "serper") + ACADEMIC_SOURCES
 
-@mcp.tool()
-def unified_search(query: str, sources: List[str] = ["google"], num_results: int = 2) -> str:
+def fetch_hits(source: str, query: str, num_results: int) -> List[SearchHit]:
+      """Hits for ``query`` from any of ``SEARCH_SOURCES``; raises if the source is not configured."""
+      if source == "google" and not web_configured("google"):
+            raise ValueError("Google Search API key or Search Engine ID not configured.")
+      if source == "serper" and not web_configured("serper"):
+            raise ValueError("Serper API key not configured.")
+      if source in WEB_FALLBACKS:
+            return fetch_web(source, query, num_results)
+      return fetch_academic(query, source, num_results)
+
+@tool()
+async def unified_search(query: str, sources: List[str] = ["google"], num_results: int = 2,
+                         deadline: float = SEARCH_DEADLINE, output_format: str = "text",
+                         merge: bool = True, top_n: int = 0) -> str:
       """Search multiple sources at once and combine results.
       
+      All selected sources are queried concurrently; a source that does not
+      answer within its timeout (or the overall deadline) is reported as timed
+      out while the other results are still returned. By default hits for the
+      same page or paper are merged across sources and ranked into one list
+      with reciprocal rank fusion; each hit names the sources that found it.
+      
       Args:
             query: Search query
             sources: List of sources to search (google, serper, semantic_scholar, arxiv, pubmed)
             num_results: Number of results per source
+            deadline: Maximum number of seconds to wait for all sources
+            output_format: How hits are rendered ("text", "compact" or "json")
+            merge: Return one ranked list instead of a section per source
+            top_n: Length of the merged list; defaults to num_results times the number of sources
       """
-      available_sources = {
-            "google": search_google,
-            "serper": search_serper,
-            "semantic_scholar": lambda q, n=num_results: search_academic(q, "semantic_scholar", n),
-            "arxiv": lambda q, n=num_results: search_academic(q, "arxiv", n),
-            "pubmed": lambda q, n=num_results: search_academic(q, "pubmed", n)
-      }
-      
       # Validate sources
-      valid_sources = [s for s in sources if s in available_sources]
+      valid_sources = list(dict.fromkeys(s for s in sources if s in SEARCH_SOURCES))
       if not valid_sources:
-            return f"No valid sources specified. Choose from: {', '.join(available_sources.keys())}"
+            return f"No valid sources specified. Choose from: {', '.join(SEARCH_SOURCES)}"
+      if output_format not in RENDERERS:
+            return f"Invalid output format. Choose from: {', '.join(RENDERERS)}"
+      num_results = min(max(1, num_results), 10)
       
-      all_results = {}
-      for source in valid_sources:
-            search_func = available_sources[source]
-            try:
-                  results = search_func(query, num_results)
-                  all_results[source] = results
-            except Exception as e:
-                  all_results[source] = f"Error searching {source}: {str(e)}"
+      all_results = await fan_out(
+            {source: (lambda s=source: fetch_hits(s, query, num_results)) for source in valid_sources},
+            deadline=deadline,
+            timeouts=SOURCE_TIMEOUTS
+      )
+      hit_lists = {source: shorten_abstracts(results) for source, results in all_results.items() if isinstance(results, list)}
+      errors = {source: results for source, results in all_results.items() if isinstance(results, str)}
+      
+      if merge:
+            hits = fuse_hits(hit_lists, limit=top_n if top_n > 0 else num_results * len(valid_sources))
+            if output_format == "json":
+                  return json.dumps({"results": [hit.to_dict() for hit in hits], "errors": errors}, ensure_ascii=False)
+            sections = [render_hits(hits, output_format) if hits else f"No results found for query: {query}"]
+            sections.extend(errors.values())
+            return "\n\n".join(sections)
+      
+      if output_format == "json":
+            return json.dumps({
+                  source: [hit.to_dict() for hit in hit_lists[source]] if source in hit_lists else {"error": errors[source]}
+                  for source in all_results
+            }, ensure_ascii=False)
       
-      # Format combined results
+      # Format per-source results
       formatted_output = []
-      for source, results in all_results.items():
+      for source in all_results:
+            if source in errors:
+                  results = errors[source]
+            else:
+                  results = render_hits(hit_lists[source], output_format) if hit_lists[source] else f"No results found for query: {query}"
             formatted_output.append(f"=== {source.upper()} RESULTS ===\n{results}\n")
       
       return "\n\n".join(formatted_output)
 
-@mcp.tool()
-def analyze_topic(topic: str, depth: str = "medium") -> str:
+ANALYZE_CONTEXT_CHUNKS = int(os.getenv("ANALYZE_CONTEXT_CHUNKS", "40"))
+ANALYZE_COMPLETION_TOKENS = 1000
+
+@tool()
+async def analyze_topic(topic: str, depth: str = "medium", bypass_cache: bool = False,
+                        ctx: Optional[Context] = None) -> str:
       """Analyze a research topic at different depths of detail.
       
       This tool performs a comprehensive analysis by searching multiple sources
@@ -323,6 +640,7 @@ def analyze_topic(topic: str, depth: str = "medium") -> str:
       Args:
             topic: The research topic to analyze
             depth: Level of analysis - "brief", "medium", or "comprehensive"
+            bypass_cache: Ignore any cached analysis and generate a fresh one
       """
       # Define search parameters based on depth
       depth_config = {
@@ -334,11 +652,12 @@ def analyze_topic(topic: str, depth: str = "medium") -> str:
       # Use default if depth not recognized
       config = depth_config.get(depth, depth_config["medium"])
       
-      # Get information from multiple sources
-      search_results = unified_search(
+      # Get information from multiple sources; the hits land in the document index
+      search_results = await unified_search(
             query=topic, 
             sources=config["sources"],
-            num_results=config["num_results"]
+            num_results=config["num_results"],
+            output_format="compact"
       )
       
       # Create analysis introduction based on depth
@@ -347,63 +666,156 @@ def analyze_topic(topic: str, depth: str = "medium") -> str:
             "medium": f"Medium-depth analysis of {topic}:",
             "comprehensive": f"Comprehensive examination of {topic}:"
       }
+      system_prompt = f"You are a research assistant. Provide a detailed {depth} analysis of a topic based on gathered content."
+      user_prefix = f"Topic: {topic}\n\nSearch Results:\n"
+      budget = evidence_budget(system_prompt + user_prefix, ANALYZE_COMPLETION_TOKENS)
+      
+      # Send only the indexed material most relevant to the topic, which also
+      # includes pages fetched by earlier requests, shared evenly across sources
+      chunks = await asyncio.to_thread(get_doc_index().search, topic, ANALYZE_CONTEXT_CHUNKS)
+      if chunks:
+            quotas = allocate(budget, {source: 1.0 for source in config["sources"] + ["web"]})
+            search_results = "\n\n".join(pack(chunks, budget, render_chunk, quotas, content=lambda chunk: chunk["text"]))
+      else:
+            search_results = truncate_tokens(search_results, budget)
+      
       # Ask Azure OpenAI to generate a real analysis
       try:
-            response = llm.chat.completions.create(
-                  deployment_id=AZURE_DEPLOYMENT_NAME,
+            return await complete(
                   messages=[
-                        {"role": "system", "content": f"You are a research assistant. Provide a detailed {depth} analysis of a topic based on gathered content."},
-                        {"role": "user", "content": f"Topic: {topic}\n\nSearch Results:\n{search_results}"}
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prefix + search_results}
                   ],
                   temperature=0.5,
-                  max_tokens=1000
+                  max_tokens=ANALYZE_COMPLETION_TOKENS,
+                  ctx=ctx,
+                  bypass_cache=bypass_cache
             )
-            return response.choices[0].message.content
       except Exception as e:
             return f"Error generating analysis: {str(e)}"
 
 
-@mcp.tool()
-def fact_check(claim: str) -> dict:
-      """Verify a factual claim using Azure OpenAI and web results."""
+FACT_CHECK_COMPLETION_TOKENS = 600
+FACT_CHECK_CONTEXT_TOKENS = int(os.getenv("FACT_CHECK_CONTEXT_TOKENS", "250"))
+# Share of the evidence budget for fresh search hits vs. previously fetched pages
+FACT_CHECK_WEIGHTS = {"search": 0.7, "web": 0.3}
+
+def query_terms(text: str) -> set:
+      return set(terms(text))
+
+def relevance(wanted: set, text: str) -> float:
+      """Fraction of the distinct query terms ``wanted`` that occur in ``text``."""
+      if not wanted:
+            return 0.0
+      return len(wanted & query_terms(text)) / len(wanted)
+
+def merge_hits(result_lists: List[List[SearchHit]]) -> List[Dict[str, Any]]:
+      """Merge search hit lists, keeping one entry per URL.
+
+      Each merged hit records how many lists returned it (``seen``) and its
+      best position in any of them (``rank``).
+      """
+      merged: Dict[str, Dict[str, Any]] = {}
+      for hits in result_lists:
+            for position, hit in enumerate(hits):
+                  key = canonical_url(hit.url)
+                  if key in merged:
+                        merged[key]["seen"] += 1
+                        merged[key]["rank"] = min(merged[key]["rank"], position)
+                        if len(hit.snippet) > len(merged[key]["snippet"]):
+                              merged[key]["snippet"] = hit.snippet
+                  else:
+                        merged[key] = {"title": hit.title, "link": hit.url, "snippet": hit.snippet, "seen": 1, "rank": position}
+      return list(merged.values())
+
+def render_evidence(item: Dict[str, Any]) -> str:
+      return f"Title: {item['title']}\nLink: {item['link']}\nSnippet: {item['snippet']}\n"
+
+def score_evidence(claim: str, hits: List[Dict[str, Any]], page_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+      """Turn search hits and page chunks into scored evidence items for ``pack``.
+
+      Items are scored by how much of the claim they cover; search hits
+      returned by several queries, or ranked higher, win ties.
+      """
+      claim_terms = query_terms(claim)
+      items = []
+      for hit in hits:
+            items.append({
+                  "title": hit["title"], "link": hit["link"], "snippet": hit["snippet"], "source": "search",
+                  "score": relevance(claim_terms, f"{hit['title']} {hit['snippet']}") + 0.01 * hit["seen"] - 0.001 * hit["rank"]
+            })
+      for chunk in page_chunks:
+            items.append({
+                  "title": chunk["title"] or chunk["url"], "link": chunk["url"], "snippet": chunk["text"], "source": "web",
+                  "score": relevance(claim_terms, chunk["text"])
+            })
+      return items
+
+@tool()
+async def fact_check(claim: str, bypass_cache: bool = False, ctx: Optional[Context] = None) -> dict:
+      """Verify a factual claim using Azure OpenAI and web results.
+      
+      Args:
+            claim: The claim to verify
+            bypass_cache: Ignore any cached assessment and generate a fresh one
+      """
       
-      # Step 1: Search the web for verification context
+      # Step 1: Search the web for verification context, all queries at once
       verification_queries = [
             f"is it true that {claim}",
             f"fact check {claim}",
             f"evidence for {claim}"
       ]
 
-      search_results = []
-      for query in verification_queries:
-            result = search_google(query, num_results=3)
-            search_results.append(result)
-
-      combined_text = "\n\n".join(search_results)
+      provider = next((source for source in WEB_FALLBACKS if web_configured(source)), None)
+      if provider is not None:
+            search_results = await fan_out(
+                  {query: (lambda q=query: fetch_web(provider, q, 3)) for query in verification_queries},
+                  timeouts={query: SOURCE_TIMEOUTS[provider] for query in verification_queries}
+            )
+            hit_lists = [result for result in search_results.values() if isinstance(result, list)]
+            errors = [result for result in search_results.values() if isinstance(result, str)]
+      else:
+            hit_lists, errors = [], ["Error: No web search API (Google or Serper) configured."]
 
       # Step 2: Use Azure OpenAI to assess the claim
-      prompt = (
+      system_prompt = "You are a fact-checking expert."
+      prompt_prefix = (
             f"Analyze the following claim and determine if it is true, false, or inconclusive "
             f"based on the evidence provided. Give a short explanation and confidence level.\n\n"
             f"Claim: {claim}\n\n"
-            f"Evidence:\n{combined_text[:3000]}"
+            f"Evidence:\n"
       )
+      budget = evidence_budget(system_prompt + prompt_prefix, FACT_CHECK_COMPLETION_TOKENS)
+      
+      # Deduplicate search hits by URL, add passages from previously fetched
+      # pages, and pack the distinct evidence most relevant to the claim
+      page_chunks = await asyncio.to_thread(get_doc_index().search, claim, 10, None, ["web"])
+      evidence = pack(
+            score_evidence(claim, merge_hits(hit_lists), page_chunks),
+            budget,
+            render_evidence,
+            allocate(budget, FACT_CHECK_WEIGHTS),
+            content=lambda item: item["snippet"]
+      )
+      combined_text = "\n\n".join(evidence) or "\n".join(errors)
+      prompt = prompt_prefix + combined_text
 
       try:
-            response = llm.chat.completions.create(
-                  deployment_id=AZURE_DEPLOYMENT_NAME,
+            content = await complete(
                   messages=[
-                  {"role": "system", "content": "You are a fact-checking expert."},
+                  {"role": "system", "content": system_prompt},
                   {"role": "user", "content": prompt}
                   ],
                   temperature=0.3,
-                  max_tokens=600
+                  max_tokens=FACT_CHECK_COMPLETION_TOKENS,
+                  ctx=ctx,
+                  bypass_cache=bypass_cache
             )
-            content = response.choices[0].message.content
             return {
                   "claim": claim,
                   "assessment": content,
-                  "search_context": combined_text[:1000] + ("..." if len(combined_text) > 1000 else "")
+                  "search_context": truncate_tokens(combined_text, FACT_CHECK_CONTEXT_TOKENS)
             }
       except Exception as e:
             return {
@@ -413,22 +825,153 @@ def fact_check(claim: str) -> dict:
             }
 
 
-@mcp.tool()
-def summarize_text(text: str, length: str = "medium") -> str:
-      """Summarize text using Azure OpenAI."""
-      prompt = f"Summarize this text in a {length} way:\n\n{text}"
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+SUMMARY_FAN_OUT = int(os.getenv("SUMMARY_FAN_OUT", "5"))
+
+async def summarize_chunks(chunks: List[str], reduce_fan_out: int, bypass_cache: bool = False) -> List[str]:
+      """Map step plus intermediate reduce rounds of a chunked summary.
+
+      Chunks are summarized concurrently, then groups of ``reduce_fan_out``
+      partial summaries are merged round by round until a single group is
+      left for the final summary.
+      """
+      partials = await asyncio.gather(*(
+            complete(
+                  messages=[{"role": "user", "content": f"Summarize this section of a longer text. Keep key facts, figures and names:\n\n{chunk}"}],
+                  temperature=0.3,
+                  max_tokens=512,
+                  bypass_cache=bypass_cache
+            )
+            for chunk in chunks
+      ))
+      while len(partials) > reduce_fan_out:
+            groups = [partials[i:i + reduce_fan_out] for i in range(0, len(partials), reduce_fan_out)]
+            partials = await asyncio.gather(*(
+                  complete(
+                        messages=[{"role": "user", "content": "Merge these consecutive partial summaries of one text into a single summary, in order:\n\n" + "\n\n".join(group)}],
+                        temperature=0.3,
+                        max_tokens=512,
+                        bypass_cache=bypass_cache
+                  )
+                  for group in groups
+            ))
+      return list(partials)
 
+@tool()
+async def summarize_text(text: str, length: str = "medium", chunk_tokens: int = SUMMARY_CHUNK_TOKENS,
+                         reduce_fan_out: int = SUMMARY_FAN_OUT, bypass_cache: bool = False,
+                         ctx: Optional[Context] = None) -> str:
+      """Summarize text using Azure OpenAI.
+      
+      Texts longer than ``chunk_tokens`` are split on structural boundaries,
+      the chunks are summarized concurrently and the partial summaries are
+      combined ``reduce_fan_out`` at a time.
+      
+      Args:
+            text: The text to summarize
+            length: Desired summary length, e.g. "short", "medium" or "long"
+            chunk_tokens: Maximum tokens per chunk sent to the model
+            reduce_fan_out: Number of partial summaries merged per reduce call
+            bypass_cache: Ignore any cached summaries and generate fresh ones
+      """
       try:
-            response = llm.chat.completions.create(
-                  deployment_id=AZURE_DEPLOYMENT_NAME,
+            if count_tokens(text) > chunk_tokens:
+                  chunks = split_text(text, max(256, chunk_tokens))
+                  text = "\n\n".join(await summarize_chunks(chunks, max(2, reduce_fan_out), bypass_cache))
+            
+            prompt = f"Summarize this text in a {length} way:\n\n{text}"
+            return await complete(
                   messages=[{"role": "user", "content": prompt}],
                   temperature=0.5,
-                  max_tokens=512
+                  max_tokens=512,
+                  ctx=ctx,
+                  bypass_cache=bypass_cache
             )
-            return response.choices[0].message.content
       except Exception as e:
             return f"Error summarizing with Azure OpenAI: {str(e)}"
 
 
+@mcp.resource("stats://http-pool")
+def http_pool_stats() -> str:
+      """Connection pool statistics of the shared HTTP client, per host."""
+      return json.dumps(http.stats(), indent=2)
+
+
+@mcp.resource("stats://search-cache")
+def search_cache_stats() -> str:
+      """Hit/miss counters and size of the search result cache."""
+      return json.dumps(get_search_cache().stats(), indent=2)
+
+
+@mcp.resource("stats://llm-cache")
+def llm_cache_stats() -> str:
+      """Hit/miss counters and size of the completion cache."""
+      completion_cache = get_completion_cache()
+      return json.dumps(completion_cache.stats() if completion_cache is not None else {"enabled": False}, indent=2)
+
+
+def cache_ratios():
+      caches = {"search": get_search_cache(), "llm": get_completion_cache()}
+      return {(name,): cache.stats()["hit_ratio"] for name, cache in caches.items() if cache is not None}
+
+registry.gauge("cache_hit_ratio", "Share of cache lookups served from memory or the persistent store", ("cache",), cache_ratios)
+registry.gauge("provider_circuit_open", "1 while a provider's circuit breaker is open", ("provider",),
+               lambda: {(name,): int(guard.breaker.state == "open") for name, guard in guards.items()})
+registry.gauge("provider_quota_remaining", "Requests left in a provider's daily quota", ("provider",),
+               lambda: {(name,): limiter.quota.remaining() for name, limiter in limiters.items()})
+registry.gauge("doc_index_chunks", "Chunks held by the document index", (), lambda: {(): get_doc_index().stats()["chunks"]})
+
+
+@mcp.resource("metrics://prometheus", mime_type="text/plain")
+def prometheus_metrics() -> str:
+      """Latency, error, token and cache metrics of this server process in the Prometheus text format."""
+      return render_metrics({"worker": str(os.getpid())})
+
+
+@mcp.resource("stats://rate-limits")
+def rate_limit_stats() -> str:
+      """Request, wait and quota counters of each provider's rate limiter."""
+      return json.dumps({name: limiter.stats() for name, limiter in limiters.items()}, indent=2)
+
+
+@mcp.resource("stats://providers")
+def provider_stats() -> str:
+      """Circuit breaker state, hedging counters and latency histogram of each provider."""
+      return json.dumps({name: guard.stats() for name, guard in guards.items()}, indent=2)
+
+
+@mcp.resource("stats://doc-index")
+def doc_index_stats() -> str:
+      """Size of the local document index."""
+      return json.dumps(get_doc_index().stats(), indent=2)
+
+
+def http_app():
+      """ASGI app for the networked transport; uvicorn builds one in every worker process."""
+      return mcp.sse_app() if MCP_TRANSPORT == "sse" else mcp.streamable_http_app()
+
+
+def serve_workers(workers: int):
+      """Serve streamable HTTP from ``workers`` processes sharing caches and provider limits."""
+      import uvicorn
+
+      # Workers import this module afresh and take these settings from the environment
+      os.environ["RATE_LIMIT_SHARE"] = str(1 / workers)
+      os.environ.setdefault("SEARCH_CACHE_PATH", os.path.join(".cache", "search_cache.sqlite"))
+      os.environ.setdefault("LLM_CACHE_BACKEND", "sqlite")
+      os.environ.setdefault("DOC_INDEX_PATH", os.path.join(".cache", "doc_index.sqlite"))
+      uvicorn.run("server:http_app", factory=True, host=MCP_HOST, port=MCP_PORT, workers=workers,
+                  log_level=mcp.settings.log_level.lower())
+
+
 if __name__ == "__main__":
-      mcp.run(transport="stdio")
\ No newline at end of file
+      if MCP_TRANSPORT != "stdio" and "EXTRACT_PROCESSES" not in os.environ:
+            # A networked server parses pages for many clients at once: spread that over the cores
+            extract.EXTRACT_PROCESSES = max(1, (os.cpu_count() or 2) // MCP_WORKERS)
+            os.environ["EXTRACT_PROCESSES"] = str(extract.EXTRACT_PROCESSES)
+      if MCP_WORKERS > 1:
+            if MCP_TRANSPORT != "streamable-http":
+                  raise SystemExit("MCP_WORKERS > 1 needs MCP_TRANSPORT=streamable-http; SSE and stdio sessions live in one process")
+            serve_workers(MCP_WORKERS)
+      else:
+            mcp.run(transport=MCP_TRANSPORT)
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""Tracing spans and Prometheus metrics for the assistant's processes.
+
+Spans follow the OpenTelemetry model: trace and span IDs, a parent, start
+and end times, attributes and a status. The active span lives in a context
+variable, so nesting works across threads and asyncio tasks. With
+``TRACE_FILE`` set, every finished span is appended to that file as one JSON
+line. Each span also feeds the ``span_duration_seconds`` histogram.
+
+Metrics are kept in :data:`registry` and rendered in the Prometheus text
+format by :func:`render_metrics`.
+"""
+import bisect
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+SERVICE_NAME = os.getenv("SERVICE_NAME") or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+# Metrics
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+      pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(names, values)]
+      return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+      """Monotonic counter with labels."""
+
+      kind = "counter"
+
+      def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+            self.name = name
+            self.help = help
+            self.labels = labels
+            self._values: Dict[Tuple[str, ...], float] = {}
+            self._lock = threading.Lock()
+
+      def inc(self, *label_values: str, amount: float = 1):
+            key = tuple(str(value) for value in label_values)
+            with self._lock:
+                  self._values[key] = self._values.get(key, 0) + amount
+
+      def samples(self) -> Iterator[str]:
+            with self._lock:
+                  values = dict(self._values)
+            for key, value in values.items():
+                  yield f"{self.name}_total{_format_labels(self.labels, key)} {value:g}"
+
+
+class Histogram:
+      """Cumulative-bucket histogram with labels."""
+
+      kind = "histogram"
+
+      def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DURATION_BUCKETS):
+            self.name = name
+            self.help = help
+            self.labels = labels
+            self.buckets = tuple(sorted(buckets))
+            self._values: Dict[Tuple[str, ...], List[float]] = {}
+            self._lock = threading.Lock()
+
+      def observe(self, value: float, *label_values: str):
+            key = tuple(str(label) for label in label_values)
+            with self._lock:
+                  # Per-bucket counts followed by the total count and the sum
+                  series = self._values.setdefault(key, [0] * (len(self.buckets) + 2) + [0.0])
+                  series[bisect.bisect_left(self.buckets, value)] += 1
+                  series[-2] += 1
+                  series[-1] += value
+
+      def samples(self) -> Iterator[str]:
+            with self._lock:
+                  values = {key: list(series) for key, series in self._values.items()}
+            for key, series in values.items():
+                  cumulative = 0
+                  for bound, count in zip(self.buckets + (float("inf"),), series):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        yield f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (le,))} {cumulative}"
+                  yield f"{self.name}_count{_format_labels(self.labels, key)} {series[-2]}"
+                  yield f"{self.name}_sum{_format_labels(self.labels, key)} {series[-1]:.6f}"
+
+
+class Gauge:
+      """Gauge read from a callback at render time, e.g. a cache's current hit ratio."""
+
+      kind = "gauge"
+
+      def __init__(self, name: str, help: str, labels: Tuple[str, ...], read: Callable[[], Dict[Tuple[str, ...], float]]):
+            self.name = name
+            self.help = help
+            self.labels = labels
+            self.read = read
+
+      def samples(self) -> Iterator[str]:
+            for key, value in self.read().items():
+                  if value is not None:
+                        yield f"{self.name}{_format_labels(self.labels, key)} {float(value):g}"
+
+
+class Registry:
+      def __init__(self):
+            self.metrics: Dict[str, Any] = {}
+
+      def register(self, metric):
+            """Add ``metric``, or return the one already registered under its name."""
+            return self.metrics.setdefault(metric.name, metric)
+
+      def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+            return self.register(Counter(name, help, labels))
+
+      def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DURATION_BUCKETS) -> Histogram:
+            return self.register(Histogram(name, help, labels, buckets))
+
+      def gauge(self, name: str, help: str, labels: Tuple[str, ...], read) -> Gauge:
+            return self.register(Gauge(name, help, labels, read))
+
+      def render(self) -> str:
+            lines = []
+            for metric in self.metrics.values():
+                  try:
+                        samples = list(metric.samples())
+                  except Exception:
+                        continue
+                  lines.append(f"# HELP {metric.name} {metric.help}")
+                  lines.append(f"# TYPE {metric.name} {metric.kind}")
+                  lines.extend(samples)
+            return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+span_duration = registry.histogram("span_duration_seconds", "Duration of traced operations", ("service", "span", "status"))
+
+
+def render_metrics(extra_labels: Optional[Dict[str, str]] = None) -> str:
+      """All metrics in the Prometheus text format, optionally with constant labels added."""
+      text = registry.render()
+      if not extra_labels:
+            return text
+      added = ",".join(f'{name}="{value}"' for name, value in extra_labels.items())
+      lines = []
+      for line in text.splitlines():
+            if line.startswith("#"):
+                  lines.append(line)
+            elif "{" in line:
+                  lines.append(line.replace("{", "{" + added + ",", 1))
+            else:
+                  name, value = line.split(" ", 1)
+                  lines.append(f"{name}{{{added}}} {value}")
+      return "\n".join(lines) + "\n"
+
+
+def merge_metrics(texts: Iterable[str]) -> str:
+      """Combine Prometheus exports of several processes, keeping one HELP/TYPE per family."""
+      families: Dict[str, Dict[str, List[str]]] = {}
+      current = None
+      for text in texts:
+            for line in text.splitlines():
+                  if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                        current = families.setdefault(line.split(" ", 3)[2], {"header": [], "samples": []})
+                        if line not in current["header"]:
+                              current["header"].append(line)
+                  elif line.strip() and current is not None:
+                        current["samples"].append(line)
+      return "".join("\n".join(family["header"] + family["samples"]) + "\n" for family in families.values())
+
+
+# Tracing
+
+class Span:
+      """One timed operation; use :func:`span` or :func:`start_span` to create it."""
+
+      def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+            self.name = name
+            self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+            self.span_id = secrets.token_hex(8)
+            self.parent_id = parent.span_id if parent is not None else None
+            self.attributes: Dict[str, Any] = dict(attributes or {})
+            self.status = "ok"
+            self.error: Optional[str] = None
+            self.start_time = time.time()
+            self._started = time.perf_counter()
+            self.duration: Optional[float] = None
+
+      def set_attribute(self, key: str, value: Any):
+            self.attributes[key] = value
+
+      def set_attributes(self, attributes: Dict[str, Any]):
+            self.attributes.update(attributes)
+
+      def record_exception(self, error: BaseException):
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"
+
+      def end(self):
+            if self.duration is not None:
+                  return
+            self.duration = time.perf_counter() - self._started
+            span_duration.observe(self.duration, SERVICE_NAME, self.name, self.status)
+            if TRACE_FILE:
+                  _export(self)
+
+      def to_dict(self) -> Dict[str, Any]:
+            return {
+                  "traceId": self.trace_id,
+                  "spanId": self.span_id,
+                  "parentSpanId": self.parent_id,
+                  "name": self.name,
+                  "service": SERVICE_NAME,
+                  "startTimeUnixNano": int(self.start_time * 1e9),
+                  "endTimeUnixNano": int((self.start_time + (self.duration or 0)) * 1e9),
+                  "durationMs": round((self.duration or 0) * 1000, 3),
+                  "attributes": self.attributes,
+                  "status": {"code": self.status, "message": self.error} if self.error else {"code": self.status}
+            }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+
+
+def _export(finished: Span):
+      line = json.dumps(finished.to_dict(), default=str, ensure_ascii=False)
+      with _export_lock:
+            with open(TRACE_FILE, "a", encoding="utf-8") as handle:
+                  handle.write(line + "\n")
+
+
+def current_span() -> Optional[Span]:
+      return _current_span.get()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+      """Start a span that the caller ends explicitly; it does not become the current span."""
+      return Span(name, parent if parent is not None else _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+      """Trace the enclosed block as a child of the current span."""
+      active = Span(name, _current_span.get(), attributes)
+      token = _current_span.set(active)
+      try:
+            yield active
+      except BaseException as e:
+            active.record_exception(e)
+            raise
+      finally:
+            _current_span.reset(token)
+            active.end()
+
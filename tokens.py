@@ -0,0 +1,95 @@
+"""Token counting and token-aware text splitting.
+
+Counts use tiktoken's encoding for the Azure deployment's model when tiktoken
+is installed, and a four-characters-per-token estimate otherwise.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import List
+
+try:
+      import tiktoken
+except ImportError:
+      tiktoken = None
+
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", os.getenv("AZURE_DEPLOYMENT_NAME", "gpt-4o"))
+
+# Split points tried in order, coarsest first: headings, paragraphs, lines, sentences, words
+SEPARATORS = [r"\n(?=#{1,6} )", r"\n\s*\n", r"\n", r"(?<=[.!?])\s+", r"\s+"]
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+      if tiktoken is None:
+            return None
+      try:
+            try:
+                  return tiktoken.encoding_for_model(model)
+            except KeyError:
+                  return tiktoken.get_encoding("o200k_base")
+      except Exception:
+            # Encoding files could not be loaded (e.g. offline); fall back to estimates
+            return None
+
+
+def count_tokens(text: str, model: str = TOKENIZER_MODEL) -> int:
+      encoding = _encoding(model)
+      if encoding is None:
+            return (len(text) + 3) // 4
+      return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_text(text: str, max_tokens: int, model: str = TOKENIZER_MODEL) -> List[str]:
+      """Split ``text`` into chunks of at most ``max_tokens`` tokens.
+
+      Chunks break on the coarsest structural boundary that fits (headings,
+      then paragraphs, lines, sentences and finally words), and adjacent
+      pieces are packed together up to the limit.
+      """
+      return [chunk for chunk in _split(text.strip(), max_tokens, model, 0) if chunk.strip()]
+
+
+def _split(text: str, max_tokens: int, model: str, level: int) -> List[str]:
+      if count_tokens(text, model) <= max_tokens:
+            return [text]
+      if level >= len(SEPARATORS):
+            # A single unbreakable run: cut it by characters
+            size = max(1, len(text) * max_tokens // count_tokens(text, model))
+            return [text[i:i + size] for i in range(0, len(text), size)]
+
+      separator = SEPARATORS[level]
+      pieces = re.split(f"({separator})", text)
+      chunks: List[str] = []
+      current, current_tokens = "", 0
+      for piece in pieces:
+            # Token counts are treated as additive; close enough for packing
+            piece_tokens = count_tokens(piece, model)
+            if current_tokens + piece_tokens <= max_tokens:
+                  current += piece
+                  current_tokens += piece_tokens
+                  continue
+            if current.strip():
+                  chunks.append(current.strip())
+            if piece_tokens > max_tokens:
+                  chunks.extend(_split(piece, max_tokens, model, level + 1))
+                  current, current_tokens = "", 0
+            else:
+                  current, current_tokens = piece, piece_tokens
+      if current.strip():
+            chunks.append(current.strip())
+      return chunks
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = TOKENIZER_MODEL, marker: str = "...") -> str:
+      """Cut ``text`` to at most ``max_tokens`` tokens, appending ``marker`` when shortened."""
+      if max_tokens <= 0:
+            return ""
+      encoding = _encoding(model)
+      if encoding is None:
+            limit = max_tokens * 4
+            return text if len(text) <= limit else text[:limit].rstrip() + marker
+      token_ids = encoding.encode(text, disallowed_special=())
+      if len(token_ids) <= max_tokens:
+            return text
+      return encoding.decode(token_ids[:max_tokens]).rstrip() + marker